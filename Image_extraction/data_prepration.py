@@ -1,61 +1,178 @@
 import os
+import re
+import json
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
 import fitz  # PyMuPDF
-from PIL import Image
 
-def render_pages_with_images(pdf_folder, images_output_folder, dpi=150):
-    if not os.path.exists(images_output_folder):
-        os.makedirs(images_output_folder)
+# Pages whose images cover less than this fraction of the page (logos, headers,
+# signatures) are not worth sending to the paid table extraction; skipped pages are logged
+MIN_IMAGE_AREA_FRACTION = float(os.getenv("MIN_IMAGE_AREA_FRACTION", "0.05"))
+PAGES_PER_TASK = 20         # Pages handed to a scan worker at a time
+BATCH_PAGES_FILE = "batch_pages.json"
+
+ImagePage = Tuple[str, int]   # (pdf path, page number)
 
-    image_paths = []
-    img_counter = 0
 
-    for pdf_file in os.listdir(pdf_folder):
-        if not pdf_file.lower().endswith(".pdf"):
-            continue
+def image_area_fraction(page) -> float:
+    """Fraction of the page covered by placed images (overlapping images are summed, capped at 1)."""
+    page_area = abs(page.rect)
+    if not page_area:
+        return 0.0
+    covered = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+    return min(1.0, covered / page_area)
 
-        pdf_path = os.path.join(pdf_folder, pdf_file)
-        doc = fitz.open(pdf_path)
-        print(f"📄 Scanning {pdf_file} for pages with images...")
 
-        for page_num, page in enumerate(doc):
-            images = page.get_images(full=True)
-            if not images:
+def _scan_page_range(pdf_path: str, start: int, end: int, min_area: float):
+    """Process-pool worker: (pages in [start, end) with enough image area, image pages below min_area)."""
+    selected, skipped = [], []
+    with fitz.open(pdf_path) as doc:
+        for page_num in range(start, end):
+            page = doc[page_num]
+            if not page.get_images(full=True):
                 continue  # Skip pages without images
+            if image_area_fraction(page) < min_area:
+                skipped.append(page_num)  # Only small images (logos, headers)
+                continue
+            selected.append(page_num)
+    return selected, skipped
+
+
+def _page_range_tasks(pdf_paths: Iterable[str], pages_per_task: int):
+    for pdf_path in pdf_paths:
+        with fitz.open(pdf_path) as doc:
+            num_pages = len(doc)
+        print(f"📄 Scanning {os.path.basename(pdf_path)} for pages with images...")
+        for start in range(0, num_pages, pages_per_task):
+            yield pdf_path, start, min(start + pages_per_task, num_pages)
+
+
+def iter_image_pages(pdf_folder: str, min_area: float = MIN_IMAGE_AREA_FRACTION,
+                     max_workers: Optional[int] = None) -> Iterator[ImagePage]:
+    """Find image pages in a process pool and yield them in (file, page) order.
+
+    Only a bounded window of page ranges is in flight, so memory does not grow
+    with the size of the corpus. Pages skipped for their small image area are
+    listed per file.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    pdf_paths = sorted(
+        os.path.join(pdf_folder, f) for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf")
+    )
+    tasks = _page_range_tasks(pdf_paths, PAGES_PER_TASK)
+    in_flight = deque()
+    skipped = {}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while len(in_flight) < max_workers * 2:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                in_flight.append((task[0], executor.submit(_scan_page_range, *task, min_area)))
+            if not in_flight:
+                break
+
+            pdf_path, future = in_flight.popleft()
+            selected, small = future.result()
+            skipped.setdefault(pdf_path, []).extend(small)
+            for page_num in selected:
+                yield pdf_path, page_num
+
+    for pdf_path, pages in skipped.items():
+        if pages:
+            print(f"⏭️ {os.path.basename(pdf_path)}: skipped {len(pages)} pages with images under "
+                  f"{min_area:.0%} of the page: {', '.join(str(p + 1) for p in pages)}")
+
+
+def batch_stem(pdf_path: str) -> str:
+    """File-name-safe stem of a source PDF, used to name its batches."""
+    stem = re.sub(r"[^A-Za-z0-9]+", "_", os.path.splitext(os.path.basename(pdf_path))[0]).strip("_")
+    return stem or "pdf"
+
+
+def create_image_pdfs(image_pages: Iterable[ImagePage], output_folder: str, images_per_pdf: int = 25,
+                      on_batch: Optional[Callable[[str], None]] = None) -> int:
+    """Copy image pages into batch PDFs of up to images_per_pdf pages as they arrive.
+
+    Pages are copied with their original text and vector content (nothing is
+    rasterised), so the extraction sees the tables as they are in the source;
+    only the batch being filled is held in memory. Batches never span source
+    PDFs and are saved without a fresh document ID, so an unchanged source
+    yields byte-identical batches and the extraction cache still hits after
+    other PDFs are added or changed. on_batch is called with the path of every
+    batch PDF once it is saved. Returns the number of batch PDFs.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    batch_pages = {}
+    batch, batch_doc, batch_count, page_count = [], None, 0, 0
+    source_path, source_doc, source_batches = None, None, 0
 
-            # Render full page to image
-            pix = page.get_pixmap(dpi=dpi)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    def write_batch():
+        nonlocal batch, batch_doc, batch_count, source_batches
+        batch_count += 1
+        source_batches += 1
+        name = f"images_batch_{batch_stem(source_path)}_{source_batches}.pdf"
+        # no_new_id keeps the bytes (and so the extraction cache key) stable across re-renders
+        batch_doc.save(os.path.join(output_folder, name), garbage=3, deflate=True, no_new_id=True)
+        batch_doc.close()
+        batch_pages[name] = batch
+        print(f"📝 Created PDF: {os.path.join(output_folder, name)} with {len(batch)} pages")
+        batch, batch_doc = [], None
+        if on_batch is not None:
+            on_batch(os.path.join(output_folder, name))
 
-            img_filename = f"{os.path.splitext(pdf_file)[0]}_page_{page_num + 1}.jpg"
-            img_path = os.path.join(images_output_folder, img_filename)
-            img.save(img_path)
-            image_paths.append(img_path)
-            img_counter += 1
+    for pdf_path, page_num in image_pages:
+        if pdf_path != source_path:
+            # Pages arrive in file order, so one source document is open at a time
+            if batch:
+                write_batch()
+            if source_doc is not None:
+                source_doc.close()
+            source_path, source_doc, source_batches = pdf_path, fitz.open(pdf_path), 0
+        if batch_doc is None:
+            batch_doc = fitz.open()
+        batch_doc.insert_pdf(source_doc, from_page=page_num, to_page=page_num)
+        batch.append({"file": os.path.basename(pdf_path), "page": page_num + 1})
+        page_count += 1
+        if len(batch) == images_per_pdf:
+            write_batch()
+    if batch:
+        write_batch()
+    if source_doc is not None:
+        source_doc.close()
 
-    print(f"✅ Rendered {img_counter} pages that contained images.")
-    return image_paths
+    # Batches left over from a previous, larger run would be extracted again
+    stale = [f for f in os.listdir(output_folder)
+             if f.startswith("images_batch_") and f.endswith(".pdf") and f not in batch_pages]
+    for f in stale:
+        os.remove(os.path.join(output_folder, f))
 
-def create_image_pdfs(image_paths, output_folder, images_per_pdf=25):
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    # Which source page each batch page came from (the JPEG file names used to record this)
+    with open(os.path.join(output_folder, BATCH_PAGES_FILE), "w", encoding="utf-8") as f:
+        json.dump(batch_pages, f, indent=2)
 
-    chunks = [image_paths[i:i + images_per_pdf] for i in range(0, len(image_paths), images_per_pdf)]
+    print(f"✅ Copied {page_count} pages that contained images.")
+    print(f"✅ Created {batch_count} PDF files.")
+    return batch_count
 
-    for i, chunk in enumerate(chunks):
-        images = [Image.open(img).convert("RGB") for img in chunk]
-        pdf_path = os.path.join(output_folder, f"images_batch_{i+1}.pdf")
-        images[0].save(pdf_path, save_all=True, append_images=images[1:])
-        print(f"📝 Created PDF: {pdf_path} with {len(images)} images")
 
-    print(f"✅ Created {len(chunks)} PDF files.")
+def main():
+    parser = argparse.ArgumentParser(description="Group image-bearing PDF pages into batch PDFs for table extraction")
+    parser.add_argument("--input", default="Data", help="Folder containing PDFs")
+    parser.add_argument("--output", default="image_pdfs", help="Folder for the batch PDFs")
+    parser.add_argument("--pages-per-pdf", type=int, default=25, help="Adobe API page limit per request")
+    parser.add_argument("--min-image-area", type=float, default=MIN_IMAGE_AREA_FRACTION,
+                        help="Minimum fraction of the page covered by images (0 keeps every image page)")
+    parser.add_argument("--workers", type=int, default=None, help="Scan processes (default: CPU count)")
+    args = parser.parse_args()
 
-# === USAGE ===
-pdf_input_folder = "Data"                   # Folder containing PDFs
-images_temp_folder = "rendered_pages_with_images"  # Folder to store rendered page images
-output_pdf_folder = "image_pdfs"            # Final PDFs
+    pages = iter_image_pages(args.input, min_area=args.min_image_area, max_workers=args.workers)
+    create_image_pdfs(pages, args.output, images_per_pdf=args.pages_per_pdf)
 
-# Step 1: Render only pages with images
-page_images = render_pages_with_images(pdf_input_folder, images_temp_folder, dpi=150)
 
-# Step 2: Group into 25-image PDFs
-create_image_pdfs(page_images, output_pdf_folder, images_per_pdf=25)
+if __name__ == "__main__":
+    main()
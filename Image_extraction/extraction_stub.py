@@ -0,0 +1,68 @@
+"""Local stand-in for Adobe PDF Services table extraction.
+
+Returns a result zip shaped like the real one (structuredData.json plus
+tables/*.xlsx) after a configurable delay, so main.py can be run and load
+tested without credentials or quota:
+
+    python main.py --stub --stub-latency 2.0 --max-in-flight 8
+"""
+import io
+import json
+import time
+import random
+import zipfile
+import threading
+
+import fitz  # PyMuPDF
+import pandas as pd
+
+
+class StubRateLimitError(Exception):
+    """Raised like the service's HTTP 429 when the stub injects throttling."""
+
+    status_code = 429
+
+
+class LocalExtractionStub:
+    """Implements extract(pdf_bytes) -> zip bytes; tables are reported on every other page."""
+
+    # Kept apart from real Adobe results in main.py's extraction cache
+    cache_params = {"service": "stub"}
+
+    def __init__(self, latency_s: float = 0.5, throttle_rate: float = 0.0, seed: int = 0):
+        self.latency_s = latency_s
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def extract(self, pdf_bytes: bytes) -> bytes:
+        with self.lock:
+            self.calls += 1
+            throttled = self.rng.random() < self.throttle_rate
+        time.sleep(self.latency_s)
+        if throttled:
+            raise StubRateLimitError("Too many requests")
+
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            num_pages = len(doc)
+
+        elements, tables = [], []
+        for page in range(num_pages):
+            elements.append({"Path": "//Document/P", "Page": page})
+            if page % 2 == 0:
+                index = len(tables)
+                elements.append({"Path": f"//Document/Table[{index + 1}]", "Page": page,
+                                 "filePaths": [f"tables/fileoutpart{index}.xlsx"]})
+                tables.append(pd.DataFrame({"Parameter": ["Cmax (ng/mL)", "Tmax (h)"],
+                                            "Treatment A": [round(self.rng.uniform(1, 900), 2), 5],
+                                            "Treatment B": [round(self.rng.uniform(1, 900), 2), 6]}))
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zf:
+            zf.writestr("structuredData.json", json.dumps({"elements": elements}))
+            for index, table in enumerate(tables):
+                sheet = io.BytesIO()
+                table.to_excel(sheet, index=False)
+                zf.writestr(f"tables/fileoutpart{index}.xlsx", sheet.getvalue())
+        return buffer.getvalue()
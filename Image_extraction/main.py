@@ -1,144 +1,272 @@
+import io
 import os
 import json
-import csv
+import time
+import uuid
+import random
+import shutil
+import hashlib
 import zipfile
 import logging
-from datetime import datetime
-from multiprocessing import Pool, cpu_count,  current_process
-from adobe.pdfservices.operation.auth.service_principal_credentials import ServicePrincipalCredentials
-from adobe.pdfservices.operation.exception.exceptions import ServiceApiException, ServiceUsageException, SdkException
-from adobe.pdfservices.operation.io.cloud_asset import CloudAsset
-from adobe.pdfservices.operation.io.stream_asset import StreamAsset
-from adobe.pdfservices.operation.pdf_services import PDFServices
-from adobe.pdfservices.operation.pdf_services_media_type import PDFServicesMediaType
-from adobe.pdfservices.operation.pdfjobs.jobs.extract_pdf_job import ExtractPDFJob
-from adobe.pdfservices.operation.pdfjobs.params.extract_pdf.extract_element_type import ExtractElementType
-from adobe.pdfservices.operation.pdfjobs.params.extract_pdf.extract_pdf_params import ExtractPDFParams
-from adobe.pdfservices.operation.pdfjobs.result.extract_pdf_result import ExtractPDFResult
+import argparse
+import threading
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logging.basicConfig(level=logging.INFO)
 
-
-class ExtractTablesOnly:
-    def __init__(self, input_pdf_path, csv_output_dir):
-        self.missed_pages_log = "output/missed_tables_log.txt"
-
+# === Extraction settings (overridable from the environment or the command line) ===
+# The work is upload/submit/poll, so concurrency is bounded by the API, not the CPUs
+MAX_IN_FLIGHT = int(os.getenv("ADOBE_MAX_IN_FLIGHT", "8"))
+REQUESTS_PER_MINUTE = float(os.getenv("ADOBE_REQUESTS_PER_MINUTE", "30"))
+MAX_RETRIES = int(os.getenv("ADOBE_MAX_RETRIES", "4"))
+BACKOFF_BASE_S = float(os.getenv("ADOBE_BACKOFF_BASE_S", "5"))
+
+# Results are stored once per (PDF content, extraction parameters), so reruns only pay for new inputs
+CACHE_DIR = "output/extraction_cache"
+MISSED_PAGES_LOG = "output/missed_tables_log.txt"
+MANIFEST_FILE = "output/extraction_manifest.json"
+EXTRACTION_PARAMS = {"operation": "ExtractPDF", "elements_to_extract": ["TABLES"]}
+
+
+class AdobeExtractionService:
+    """One PDFServices client shared by every extraction thread."""
+
+    cache_params = {"service": "adobe"}
+
+    def __init__(self, client_id: str, client_secret: str):
+        # Imported here so the stub and the result processing work without the SDK installed
+        from adobe.pdfservices.operation.auth.service_principal_credentials import ServicePrincipalCredentials
+        from adobe.pdfservices.operation.pdf_services import PDFServices
+
+        credentials = ServicePrincipalCredentials(client_id=client_id, client_secret=client_secret)
+        self.pdf_services = PDFServices(credentials=credentials)
+
+    def extract(self, pdf_bytes: bytes) -> bytes:
+        """Upload, submit and poll one table-extraction job; return the result zip bytes."""
+        from adobe.pdfservices.operation.pdf_services_media_type import PDFServicesMediaType
+        from adobe.pdfservices.operation.pdfjobs.jobs.extract_pdf_job import ExtractPDFJob
+        from adobe.pdfservices.operation.pdfjobs.params.extract_pdf.extract_element_type import ExtractElementType
+        from adobe.pdfservices.operation.pdfjobs.params.extract_pdf.extract_pdf_params import ExtractPDFParams
+        from adobe.pdfservices.operation.pdfjobs.result.extract_pdf_result import ExtractPDFResult
+
+        input_asset = self.pdf_services.upload(input_stream=pdf_bytes, mime_type=PDFServicesMediaType.PDF)
+        extract_params = ExtractPDFParams(elements_to_extract=[ExtractElementType.TABLES])
+        extract_job = ExtractPDFJob(input_asset=input_asset, extract_pdf_params=extract_params)
+
+        location = self.pdf_services.submit(extract_job)
+        result: ExtractPDFResult = self.pdf_services.get_job_result(location, ExtractPDFResult)
+        stream_asset = self.pdf_services.get_content(result.get_result().get_resource())
+        return stream_asset.get_input_stream()
+
+
+class RateLimiter:
+    """Spaces job submissions evenly to stay under requests_per_minute."""
+
+    def __init__(self, requests_per_minute: float):
+        self.interval_s = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval_s
+        time.sleep(max(0.0, slot - now))
+
+
+def is_retryable(error: Exception) -> bool:
+    # Rate limiting and transient server errors; bad input or exhausted quota are final
+    status = getattr(error, "status_code", None) or getattr(error, "get_status_code", lambda: None)()
+    return status == 429 or (isinstance(status, int) and status >= 500)
+
+
+def summarize_tables(data: dict):
+    """Return (table count, missed pages) from structuredData.json."""
+    elements = data.get("elements", [])
+    table_elements = [el for el in elements if "Table" in el.get("Path", "")]
+    pages_with_tables = {el["Page"] for el in table_elements if el.get("Page") is not None}
+    total_pages = max([el.get("Page", 0) for el in elements], default=0)
+    missed_pages = [p for p in range(1, total_pages + 1) if p not in pages_with_tables]
+    return len(table_elements), missed_pages
+
+
+def cache_key(pdf_bytes: bytes, params: dict) -> str:
+    digest = hashlib.sha256(pdf_bytes)
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def store_result_zip(zip_bytes: bytes, entry_dir: str):
+    """Unpack structuredData.json and the table files from the in-memory zip into a cache entry.
+
+    The entry is assembled in a temporary directory and renamed into place, so
+    an interrupted run never leaves a half-written entry that looks cached.
+    """
+    tmp_dir = f"{entry_dir}.tmp-{uuid.uuid4().hex[:8]}"
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+        json.loads(zf.read("structuredData.json"))  # Refuse to cache a result without valid JSON
+        for name in zf.namelist():
+            if name.startswith("tables/") or name == "structuredData.json":
+                zf.extract(name, tmp_dir)
+    shutil.rmtree(entry_dir, ignore_errors=True)  # Only present when refreshing
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another thread cached the same content first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_cached_result(entry_dir: str) -> dict:
+    with open(os.path.join(entry_dir, "structuredData.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ExtractionRun:
+    """Extracts every PDF of a folder with a bounded number of jobs in flight.
+
+    Results live in a content-addressed cache keyed by the PDF's SHA-256 and the
+    extraction parameters; inputs already in the cache are not resubmitted, so
+    an interrupted or repeated run only pays for new or changed PDFs. The
+    manifest maps the current input files to their cache entries.
+    """
+
+    def __init__(self, service, max_in_flight: int = MAX_IN_FLIGHT,
+                 requests_per_minute: float = REQUESTS_PER_MINUTE, cache_dir: str = CACHE_DIR,
+                 manifest_path: str = MANIFEST_FILE, refresh: bool = False):
+        self.service = service
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.cache_dir = cache_dir
+        self.manifest_path = manifest_path
+        self.refresh = refresh
+        self.params = {**EXTRACTION_PARAMS, **getattr(service, "cache_params", {})}
+        self.manifest = {"cache_dir": cache_dir, "params": self.params, "files": {}}
+        self.lock = threading.Lock()
+        self.cached = self.failed = 0
+
+    def _save_manifest(self):
+        # Write-then-rename, so a crash never leaves a truncated manifest behind
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def extract_one(self, pdf_path: str) -> dict:
+        file_name = os.path.basename(pdf_path)
+        with open(pdf_path, "rb") as f:
+            pdf_bytes = f.read()
+        key = cache_key(pdf_bytes, self.params)
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not self.refresh and os.path.exists(os.path.join(entry_dir, "structuredData.json")):
+            return {"status": "done", "cache_key": key, "cached": True}
+
+        for attempt in range(MAX_RETRIES + 1):
+            self.rate_limiter.wait()
+            try:
+                zip_bytes = self.service.extract(pdf_bytes)
+                break
+            except Exception as e:
+                if attempt == MAX_RETRIES or not is_retryable(e):
+                    raise
+                delay = BACKOFF_BASE_S * (2 ** attempt) * (1 + random.random())
+                logging.warning(f"⏳ Extraction of {file_name} throttled, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+        store_result_zip(zip_bytes, entry_dir)
+        return {"status": "done", "cache_key": key, "cached": False}
+
+    def complete(self, pdf_path: str, future) -> Optional[str]:
+        """Record a finished extract_one future; returns its cache entry directory, or None if it failed."""
+        file_name = os.path.basename(pdf_path)
         try:
-            logging.info(f"Processing PDF file: {input_pdf_path}")
-            with open(input_pdf_path, 'rb') as file:
-                input_stream = file.read()
-
-            credentials = ServicePrincipalCredentials(
-                client_id='client_id',
-                client_secret='client_secret'
-            )
-
-            pdf_services = PDFServices(credentials=credentials)
-
-            input_asset = pdf_services.upload(
-                input_stream=input_stream,
-                mime_type=PDFServicesMediaType.PDF
-            )
-
-            extract_params = ExtractPDFParams(
-                elements_to_extract=[ExtractElementType.TABLES]
-            )
-            extract_job = ExtractPDFJob(input_asset=input_asset, extract_pdf_params=extract_params)
-
-            location = pdf_services.submit(extract_job)
-            result: ExtractPDFResult = pdf_services.get_job_result(location, ExtractPDFResult)
-
-            result_asset: CloudAsset = result.get_result().get_resource()
-            stream_asset: StreamAsset = pdf_services.get_content(result_asset)
-
-            base_output_dir = "output/ExtractTablesOnly"
-            output_dir = self.get_timestamped_dir(base_output_dir)
-            os.makedirs(output_dir, exist_ok=True)
-            os.makedirs(csv_output_dir, exist_ok=True)
-
-            zip_path = os.path.join(output_dir, "result.zip")
-            with open(zip_path, "wb") as f:
-                f.write(stream_asset.get_input_stream())
-            logging.info(f"✅ ZIP saved: {zip_path}")
-
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(output_dir)
-
-            json_path = os.path.join(output_dir, 'structuredData.json')
-            with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            base_name = os.path.splitext(os.path.basename(input_pdf_path))[0]
-
-            table_elements = [el for el in data.get('elements', []) if "Table" in el.get('Path', '')]
-            pages_with_tables = set()
-            table_count = 0
-
-            for el in table_elements:
-                page_number = el.get('Page', None)
-                if page_number is not None:
-                    pages_with_tables.add(page_number)
-
-                rows = el.get('Rows', [])
-
-
-                table_count += 1
-
+            entry = future.result()
+            entry_dir = os.path.join(self.cache_dir, entry["cache_key"])
+            table_count, _ = summarize_tables(load_cached_result(entry_dir))
             if table_count == 0:
-                logging.warning("⚠️ No tables found.")
-
-            total_pages = max([el.get('Page', 0) for el in data.get('elements', [])])
-            missed_pages = [str(p) for p in range(1, total_pages + 1) if p not in pages_with_tables]
-
-            if missed_pages:
-                os.makedirs(os.path.dirname(self.missed_pages_log), exist_ok=True)
-                with open(self.missed_pages_log, 'a', encoding='utf-8') as log_file:
-                    log_file.write(f"{base_name}.pdf - Missed Table Pages: {', '.join(missed_pages)}\n")
-                logging.warning(f"⚠️ Table not found on pages: {', '.join(missed_pages)} in {base_name}.pdf")
-
-        except (ServiceApiException, ServiceUsageException, SdkException) as e:
-            logging.exception(f"Adobe PDF Services error: {e}")
+                logging.warning(f"⚠️ No tables found in {file_name}.")
+            logging.info(f"✅ Finished extraction for {file_name} ({table_count} tables)")
         except Exception as e:
-            logging.exception(f"Unexpected error: {e}")
-
-    def get_timestamped_dir(self, base_dir):
-        time_stamp = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
-        return os.path.join(base_dir, f"run_{time_stamp}")
-
-def extract_worker(pdf_path_and_output):
-    pdf_path, csv_output_dir = pdf_path_and_output
-    process_name = current_process().name
-
-    try:
-        logging.info(f"[{process_name}] Starting extraction for {pdf_path}")
-        ExtractTablesOnly(pdf_path, csv_output_dir)
-        logging.info(f"[{process_name}] ✅ Finished extraction for {pdf_path}")
-    except Exception as e:
-        logging.exception(f"[{process_name}] ❌ Error processing {pdf_path}: {e}")
-
-def process_all_pdfs_in_folder(folder_path):
-    pdf_files = [f for f in os.listdir(folder_path) if f.lower().endswith('.pdf')]
-    if not pdf_files:
+            entry, entry_dir = {"status": "failed", "error": str(e)}, None
+            logging.exception(f"❌ Error processing {file_name}: {e}")
+        with self.lock:
+            self.cached += entry.pop("cached", False)
+            self.failed += entry["status"] == "failed"
+            self.manifest["files"][file_name] = entry
+            if entry_dir is not None:
+                # Saved per result, so a crash mid-run keeps every completed extraction on record
+                self._save_manifest()
+        return entry_dir
+
+    def finish(self) -> int:
+        """Write the final manifest and the missed-pages log once every input has completed; returns the failure count."""
+        self._save_manifest()
+        self.write_missed_pages_log()
+        logging.info(f"✅ All PDF files have been processed ({self.cached} from cache, {self.failed} failed).")
+        return self.failed
+
+    def run(self, pdf_paths):
+        logging.info(f"🧠 Extracting {len(pdf_paths)} PDF(s) with up to {self.max_in_flight} in flight")
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            futures = {executor.submit(self.extract_one, path): path for path in pdf_paths}
+            for future in as_completed(futures):
+                self.complete(futures[future], future)
+        return self.finish()
+
+    def write_missed_pages_log(self, log_path: str = MISSED_PAGES_LOG):
+        """Rebuild the log from the cached JSON of the current inputs, so reruns do not append duplicates."""
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        with open(log_path, "w", encoding="utf-8") as log_file:
+            for file_name, entry_dir in result_dirs(self.manifest_path).items():
+                _, missed_pages = summarize_tables(load_cached_result(entry_dir))
+                if missed_pages:
+                    log_file.write(f"{file_name} - Missed Table Pages: {', '.join(str(p) for p in missed_pages)}\n")
+
+
+def result_dirs(manifest_path: str = MANIFEST_FILE) -> dict:
+    """Cache entry directory (structuredData.json + tables/) of every successfully extracted input PDF."""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return {file_name: os.path.join(manifest["cache_dir"], entry["cache_key"])
+            for file_name, entry in sorted(manifest["files"].items()) if entry["status"] == "done"}
+
+
+def failed_extractions(manifest_path: str = MANIFEST_FILE) -> list:
+    """Input PDFs whose extraction failed in the last run."""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return sorted(file_name for file_name, entry in manifest["files"].items() if entry["status"] == "failed")
+
+
+def process_all_pdfs_in_folder(folder_path, service=None, max_in_flight: int = MAX_IN_FLIGHT,
+                               requests_per_minute: float = REQUESTS_PER_MINUTE, refresh: bool = False):
+    pdf_paths = sorted(os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.lower().endswith('.pdf'))
+    if not pdf_paths:
         logging.warning(f"No PDF files found in {folder_path}")
         return
 
-    csv_output_dir = "output/all_tables"
-    os.makedirs(csv_output_dir, exist_ok=True)
-
-    pdf_paths = [(os.path.join(folder_path, f), csv_output_dir) for f in pdf_files]
-
-    num_processes = max(1, min(4, cpu_count() // 2))  # Limit to 4 or half the CPUs
-    logging.info(f"🧠 Starting multiprocessing with {num_processes} worker(s)...")
-
-    with Pool(processes=num_processes) as pool:
-        pool.map(extract_worker, pdf_paths)
-
-    logging.info("✅ All PDF files have been processed.")
+    if service is None:
+        service = AdobeExtractionService(
+            client_id=os.getenv("PDF_SERVICES_CLIENT_ID", "client_id"),
+            client_secret=os.getenv("PDF_SERVICES_CLIENT_SECRET", "client_secret"),
+        )
+    return ExtractionRun(service, max_in_flight, requests_per_minute, refresh=refresh).run(pdf_paths)
 
 
 if __name__ == '__main__':
-    input_folder = 'image_pdfs'  # Folder containing PDFs
-    process_all_pdfs_in_folder(input_folder)
-
-#157
-#211
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract tables from the batch PDFs with Adobe PDF Services")
+    parser.add_argument("--input", default="image_pdfs", help="Folder containing PDFs")
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT, help="Concurrent extraction jobs")
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="Maximum job submissions per minute")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached results and resubmit every file")
+    parser.add_argument("--stub", action="store_true", help="Use the local stand-in instead of Adobe")
+    parser.add_argument("--stub-latency", type=float, default=0.5, help="Seconds per stubbed job")
+    args = parser.parse_args()
+
+    service = None
+    if args.stub:
+        from extraction_stub import LocalExtractionStub
+        service = LocalExtractionStub(latency_s=args.stub_latency)
+    process_all_pdfs_in_folder(args.input, service, args.max_in_flight, args.rpm, args.refresh)
@@ -1,44 +1,218 @@
 import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 
+from main import MANIFEST_FILE, result_dirs, failed_extractions, load_cached_result
+from data_prepration import BATCH_PAGES_FILE
+
 # --- CONFIGURATION ---
-root_folder = "results"               # Folder to search recursively
-output_folder = "csv_files"        # Folder to save renamed CSVs
+root_folder = "results"               # Folder to search recursively when there is no extraction manifest
+output_folder = "csv_files"        # Folder to save the CSVs
+SOURCES_FILE = "csv_sources.json"  # Which workbook, source PDF and page each CSV was converted from
+BATCH_PAGES_PATH = os.path.join("image_pdfs", BATCH_PAGES_FILE)   # Source page of every batch PDF page
+
+# Excel's escaped carriage return and raw line breaks become spaces
+LINE_BREAKS = r"_x000D_|\r|\n"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def csv_name_for(sha: str) -> str:
+    # Derived from the workbook's content, so adding a file never renames the others
+    return f"table_{sha[:16]}.csv"
+
+
+def clean_text(values: pd.Series) -> pd.Series:
+    """Vectorized line-break cleanup; non-string cells are left as they are."""
+    is_text = values.map(type).eq(str)
+    if not is_text.any():
+        return values
+    cleaned = values[is_text].str.replace(LINE_BREAKS, " ", regex=True).str.strip()
+    return values.mask(is_text, cleaned)
+
+
+def header_depth(raw: pd.DataFrame) -> int:
+    """2 when the first two rows look like a grouped header, else 1.
+
+    A grouped header has a merged (blank) cell in the first row and only text
+    in the second; a second row with numbers is already data.
+    """
+    if len(raw) < 3:
+        return 1
+    first, second = raw.iloc[0], raw.iloc[1].dropna()
+    has_merged_cell = first.isna().any() and first.notna().any()
+    second_is_text = len(second) > 0 and all(isinstance(v, str) for v in second)
+    return 2 if has_merged_cell and second_is_text else 1
+
+
+def flatten_header(raw: pd.DataFrame, depth: int):
+    levels = raw.iloc[:depth].copy()
+    if depth > 1:
+        levels.iloc[0] = levels.iloc[0].ffill()  # A merged group label covers the columns to its right
+    levels = levels.apply(lambda level: clean_text(level.astype("object")), axis=1)
+
+    columns = []
+    for position in range(raw.shape[1]):
+        parts = []
+        for part in levels.iloc[:, position]:
+            if pd.notna(part) and str(part) not in parts:
+                parts.append(str(part))
+        columns.append(" - ".join(parts) or f"Column {position + 1}")
+    return columns
 
-# Create output folder if it doesn't exist
-os.makedirs(output_folder, exist_ok=True)
 
 # --- Function to clean and convert Excel to CSV ---
 def clean_and_convert_excel(file_path, output_csv_path):
-    try:
-        # Try reading multi-row header
-        df = pd.read_excel(file_path, header=[0, 1])
-        df.columns = [' - '.join([str(i).strip() for i in col if str(i) != 'nan'])
-                      .replace('_x000D_', ' ').replace('\r', ' ').replace('\n', ' ').strip()
-                      for col in df.columns]
-    except:
-        # Fallback to single-row header
-        df = pd.read_excel(file_path, header=0)
-        df.columns = [str(col).replace('_x000D_', ' ').replace('\r', ' ').replace('\n', ' ').strip()
-                      for col in df.columns]
+    # One read of the raw cells; the header rows are detected from them
+    raw = pd.read_excel(file_path, header=None)
+    depth = header_depth(raw)
+    # The header cells made every column object-typed; let numeric columns be numeric again
+    df = raw.iloc[depth:].reset_index(drop=True).infer_objects()
+    df.columns = flatten_header(raw, depth)
 
     # Clean cell contents
-    df = df.applymap(lambda x: str(x).replace('_x000D_', ' ').replace('\r', ' ').replace('\n', ' ').strip()
-                     if isinstance(x, str) else x)
+    for column in df.select_dtypes(include=["object", "string"]).columns:
+        df[column] = clean_text(df[column])
+
+    # Save as CSV (written under a temporary name, so an interrupted run leaves no partial CSV)
+    tmp_path = output_csv_path + ".tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output_csv_path)
+    return output_csv_path
+
+
+def find_workbooks(root_folders):
+    for folder in root_folders:
+        for dirpath, _, filenames in sorted(os.walk(folder)):
+            for filename in sorted(filenames):
+                if filename.lower().endswith(".xlsx") and not filename.startswith("~$"):  # Skip temp files
+                    yield os.path.join(dirpath, filename)
+
+
+def load_table_origins(manifest_path: str = MANIFEST_FILE, batch_pages_path: str = BATCH_PAGES_PATH) -> dict:
+    """Workbook path -> {"source_file", "page"} of the source PDF page each extracted table came from.
+
+    Follows the table element of structuredData.json to its batch PDF page,
+    then batch_pages.json back to the page of the original PDF.
+    """
+    if not (os.path.exists(manifest_path) and os.path.exists(batch_pages_path)):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    with open(batch_pages_path, "r", encoding="utf-8") as f:
+        batch_pages = json.load(f)
+
+    origins = {}
+    for batch_name, entry in manifest["files"].items():
+        if entry["status"] != "done" or batch_name not in batch_pages:
+            continue
+        entry_dir = os.path.join(manifest["cache_dir"], entry["cache_key"])
+        pages = batch_pages[batch_name]
+        for element in load_cached_result(entry_dir).get("elements", []):
+            page = element.get("Page")  # 0-based page of the batch PDF
+            if page is None or not 0 <= page < len(pages):
+                continue
+            for file_path in element.get("filePaths", []):
+                if file_path.endswith(".xlsx"):
+                    origins[os.path.normpath(os.path.join(entry_dir, file_path))] = {
+                        "source_file": pages[page]["file"], "page": pages[page]["page"]}
+    return origins
+
+
+def finish_conversion(sources: dict, output_folder: str = output_folder, prune: bool = True,
+                      origins: dict = None):
+    """Remove CSVs no longer produced by any workbook (so the vector store sync drops their chunks
+    as well) and record the workbook and source page (from origins) of every remaining CSV.
+
+    With prune=False (some extractions failed, so their workbooks are missing
+    rather than gone) every existing CSV is kept.
+    """
+    origins = origins or {}
+    stale = [f for f in os.listdir(output_folder)
+             if prune and f.startswith("table_") and f.endswith(".csv") and f not in sources]
+    for f in stale:
+        os.remove(os.path.join(output_folder, f))
+    if stale:
+        print(f"🧹 Removed {len(stale)} CSVs whose workbooks are gone")
+
+    records = {name: {"workbook": path, **origins.get(os.path.normpath(path), {})} for name, path in sources.items()}
+    sources_path = os.path.join(output_folder, SOURCES_FILE)
+    if not prune and os.path.exists(sources_path):
+        # Kept CSVs keep what the run that wrote them recorded
+        with open(sources_path, "r", encoding="utf-8") as f:
+            earlier = json.load(f)
+        for name, record in earlier.items():
+            if name not in records and os.path.exists(os.path.join(output_folder, name)):
+                records[name] = record
+    with open(sources_path, "w", encoding="utf-8") as f:
+        json.dump(records, f, indent=2)
+
+
+def convert_all(root_folders, output_folder: str = output_folder, max_workers=None, force: bool = False,
+                prune: bool = True):
+    """Convert every workbook under root_folders, skipping those whose CSV already exists."""
+    os.makedirs(output_folder, exist_ok=True)
+    sources, pending = {}, []
+    for path in find_workbooks(root_folders):
+        name = csv_name_for(file_sha256(path))
+        if name in sources:
+            continue  # Identical table extracted twice
+        sources[name] = path
+        if force or not os.path.exists(os.path.join(output_folder, name)):
+            pending.append(path)
+
+    print(f"📊 {len(sources)} workbooks, {len(sources) - len(pending)} unchanged, converting {len(pending)}")
+    output_for = {path: os.path.join(output_folder, name) for name, path in sources.items()}
+    failed = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {path: executor.submit(clean_and_convert_excel, path, output_for[path]) for path in pending}
+            for path, future in futures.items():
+                try:
+                    print(f"✅ Saved: {future.result()}")
+                except Exception as e:
+                    failed += 1
+                    sources = {name: source for name, source in sources.items() if source != path}
+                    print(f"❌ Could not convert {path}: {e}")
+
+    finish_conversion(sources, output_folder, prune, load_table_origins())
+    return failed
+
 
-    # Save as CSV
-    df.to_csv(output_csv_path, index=False)
-    print(f"✅ Saved: {output_csv_path}")
+def main():
+    parser = argparse.ArgumentParser(description="Convert the extracted Excel tables into clean CSVs")
+    parser.add_argument("--input", nargs="*", help="Folders to search for .xlsx files "
+                        "(default: the extraction cache entries in the manifest, else results/)")
+    parser.add_argument("--output", default=output_folder)
+    parser.add_argument("--workers", type=int, default=None, help="Conversion processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Convert every workbook even if its CSV exists")
+    args = parser.parse_args()
 
-# --- Process all Excel files and save as csv1.csv, csv2.csv, ... ---
-counter = 1
+    prune = True
+    if args.input:
+        root_folders = args.input
+    elif os.path.exists(MANIFEST_FILE):
+        # Read the extraction cache entries of the current image_pdfs when main.py has run
+        root_folders = list(result_dirs().values())
+        failed = failed_extractions()
+        if failed:
+            # Their tables are missing from this run, not gone: keep the CSVs until a rerun succeeds
+            print(f"⚠️ {len(failed)} batch PDFs failed extraction, keeping CSVs of earlier runs")
+            prune = False
+    else:
+        root_folders = [root_folder]
+    convert_all(root_folders, args.output, args.workers, args.force, prune)
 
-for dirpath, _, filenames in os.walk(root_folder):
-    for filename in filenames:
-        if filename.lower().endswith(".xlsx") and not filename.startswith("~$"):  # Skip temp files
-            file_path = os.path.join(dirpath, filename)
-            output_csv_name = f"csv{counter}.csv"
-            output_csv_path = os.path.join(output_folder, output_csv_name)
 
-            clean_and_convert_excel(file_path, output_csv_path)
-            counter += 1
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 import streamlit as st
-from graph_builder import build_graph
-from generator import generate_answer
+from graph_builder import get_graph, cache_answer
 from langchain.schema import Document
 from dotenv import load_dotenv
 from db import init_db, save_conversation
+from telemetry import start_trace, span, save_trace
 
 load_dotenv()
 init_db()
@@ -12,51 +12,72 @@ st.set_page_config(page_title="💊 Pharma QA Assistant", layout="wide")
 st.title("💊 Pharma QA Assistant")
 
 # Step 1: Let user select retrieval source
+retrieval_options = {
+    "Text Documents including intext tables": "text",
+    "Tables embedded in images": "csv",
+    "Both (text and image tables)": "all",
+}
 retrieval_label = st.radio(
     "Select data source:",
-    options=["Text Documents including intext tables", "Tables embedded in images"],
+    options=list(retrieval_options),
     index=0
 )
 
 # Step 2: Normalize to expected values for retriever
-retrieval_source = "text" if retrieval_label == "Text Documents including intext tables" else "csv"
+retrieval_source = retrieval_options[retrieval_label]
 
 # Step 3: Query box
 query = st.text_input("Enter your pharmaceutical question:")
 
 if query:
+    # Every span recorded below (graph nodes, embedding and LLM calls) belongs to this query
+    trace = start_trace()
     with st.spinner("Retrieving and analyzing documents..."):
-        from retriever import get_retriever
-        retriever = get_retriever(source=retrieval_source)
-
-        app = build_graph(retriever)
-        result = app.invoke({"query": query})
+        app = get_graph(retrieval_source, stream=True)
+        with span("graph", source=retrieval_source):
+            result = app.invoke({"query": query})
         documents: list[Document] = result.get("documents", [])
 
-        if not documents:
-            st.warning("No documents retrieved. Try a different query.")
-        else:
-            answer = result.get("answer", "")
-            instruction_prompt = generate_answer(query, documents)[1]
+    cache_hit = result.get("cache_hit", False)
+    sql_lookup = result.get("sql_lookup", False)
 
-            save_conversation(query, answer, instruction_prompt)
+    if not documents and not cache_hit and not sql_lookup:
+        st.warning("No documents retrieved. Try a different query.")
+    else:
+        instruction_prompt = result.get("prompt", "")
 
-            st.markdown("## ✅ Answer")
+        st.markdown("## ✅ Answer")
+        if cache_hit:
+            st.caption("⚡ Served from the answer cache (similar question asked before)")
+            answer = result["answer"]
             st.write(answer)
+        elif sql_lookup:
+            st.caption("🔢 Exact values looked up in the PK tables (the SQL is shown below)")
+            answer = result["answer"]
+            st.markdown(answer)
+        else:
+            # Tokens are rendered as Claude produces them; write_stream returns the full text
+            answer = st.write_stream(result["answer_stream"])
+            cache_answer(result, answer)
+            stats = result.get("context_stats", {})
+            st.caption(f"🧮 Context: {stats.get('chunks_used', 0)}/{stats.get('chunks_in', 0)} chunks, "
+                       f"{stats.get('duplicates', 0)} duplicates removed, ~{stats.get('prompt_tokens', 0)} prompt tokens")
 
-            st.markdown("## 📋 Prompt used for LLM")
-            with st.expander("Show prompt"):
-                st.code(instruction_prompt)
-
-            st.markdown("## 📄 Retrieved Document Chunks")
-            for i, doc in enumerate(documents, 1):
-                is_csv = doc.metadata.get("csv_processed", False)
-                label = f"Chunk {i} — {'📊 CSV Summary' if is_csv else '📝 Text'}"
-                with st.expander(label):
-                    st.markdown(doc.page_content)
-                    source = doc.metadata.get("source", "Unknown")
-                    page = doc.metadata.get("page", "?")
-                    st.caption(f"📎 Source: {source} | Page: {page}")
-
+        save_conversation(query, answer, instruction_prompt, query_id=trace.trace_id)
+        save_trace(trace)
 
+        st.markdown("## 📋 SQL used for the lookup" if sql_lookup else "## 📋 Prompt used for LLM")
+        with st.expander("Show SQL" if sql_lookup else "Show prompt"):
+            st.code(instruction_prompt)
 
+        st.markdown("## 📄 Retrieved Document Chunks")
+        if cache_hit:
+            st.caption(f"📎 Cached answer was based on: {', '.join(result.get('doc_ids', []))}")
+        for i, doc in enumerate(documents, 1):
+            is_csv = doc.metadata.get("csv_processed", False)
+            label = f"Chunk {i} — {'📊 CSV Summary' if is_csv else '📝 Text'}"
+            with st.expander(label):
+                st.markdown(doc.page_content)
+                source = doc.metadata.get("source", "Unknown")
+                page = doc.metadata.get("page", "?")
+                st.caption(f"📎 Source: {source} | Page: {page}")
@@ -0,0 +1,94 @@
+"""Per-stage query latency benchmark: retrieve, csv_agent and generate.
+
+Usage:
+    python bench_query.py --fake --queries 200            # offline, fake Bedrock
+    python bench_query.py --fake --llm-latency 0.8 --source all
+    python bench_query.py --queries-file questions.txt     # live Bedrock
+    python bench_query.py --fake --max-p95-ms 500         # CI gate
+
+Run from the folder holding faiss_db_text / faiss_db_csv (as the app is).
+Stages are timed around the same functions the graph nodes call; the answer
+cache is bypassed so every query runs the full path.
+Exits non-zero when a --max-p95-ms threshold is exceeded.
+"""
+import os
+import time
+import random
+import argparse
+
+import numpy as np
+
+SAMPLE_QUERIES = [
+    "What is the Cmax of netupitant after a single 300 mg dose?",
+    "How much sorbitol does a 3 kg child get from the oral suspension?",
+    "What is the recommended dose for adults?",
+    "Which adverse reactions were reported most frequently?",
+    "What is the terminal half-life of palonosetron?",
+    "What was the AUC in patients with hepatic impairment?",
+]
+STAGES = ["retrieve", "csv_agent", "generate", "total"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="text", choices=["text", "csv", "all"])
+    parser.add_argument("--queries", type=int, default=50, help="Number of queries to run")
+    parser.add_argument("--queries-file", help="One question per line (default: built-in sample)")
+    parser.add_argument("--fake", action="store_true", help="Use the offline fake models (MODEL_PROVIDER=fake)")
+    parser.add_argument("--llm-latency", type=float, help="Fake LLM latency per call in seconds")
+    parser.add_argument("--embed-latency", type=float, help="Fake embedding latency per call in seconds")
+    parser.add_argument("--max-p95-ms", type=float, help="Fail if the total p95 latency exceeds this")
+    args = parser.parse_args()
+
+    # Providers read these when the modules below are imported
+    if args.fake:
+        os.environ["MODEL_PROVIDER"] = "fake"
+    if args.llm_latency is not None:
+        os.environ["FAKE_LLM_LATENCY_S"] = str(args.llm_latency)
+    if args.embed_latency is not None:
+        os.environ["FAKE_EMBED_LATENCY_S"] = str(args.embed_latency)
+
+    from retriever import get_retriever, get_vectorstore
+    from csv_interpreter import run_csv_interpreter_agent
+    from generator import generate_answer
+
+    queries = SAMPLE_QUERIES
+    if args.queries_file:
+        with open(args.queries_file, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    # Index loading is a startup cost, not a per-query one
+    for source in (["text", "csv"] if args.source == "all" else [args.source]):
+        get_vectorstore(source)
+    retriever = get_retriever(args.source)
+
+    rng = random.Random(0)
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(args.queries):
+        query = rng.choice(queries)
+        start = time.perf_counter()
+        documents = retriever(query, k=10)
+        retrieved = time.perf_counter()
+        documents = run_csv_interpreter_agent(documents)
+        interpreted = time.perf_counter()
+        generate_answer(query, documents)
+        done = time.perf_counter()
+        timings["retrieve"].append(retrieved - start)
+        timings["csv_agent"].append(interpreted - retrieved)
+        timings["generate"].append(done - interpreted)
+        timings["total"].append(done - start)
+
+    print(f"\n📊 {args.queries} queries on '{args.source}' ({os.getenv('MODEL_PROVIDER', 'bedrock')} models)")
+    print(f"{'stage':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for stage in STAGES:
+        ms = np.array(timings[stage]) * 1000
+        print(f"{stage:<12}{np.percentile(ms, 50):>10.1f}{np.percentile(ms, 95):>10.1f}"
+              f"{np.percentile(ms, 99):>10.1f}{ms.mean():>10.1f}")
+
+    total_p95 = np.percentile(np.array(timings["total"]) * 1000, 95)
+    if args.max_p95_ms is not None and total_p95 > args.max_p95_ms:
+        raise SystemExit(f"Total p95 {total_p95:.1f} ms exceeds --max-p95-ms {args.max_p95_ms:.1f}")
+
+
+if __name__ == "__main__":
+    main()
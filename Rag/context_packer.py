@@ -0,0 +1,108 @@
+import os
+import re
+import hashlib
+from typing import Dict, List, Tuple
+from langchain.schema import Document
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# === Context budget (overridable from .env) ===
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Chunks sharing at least this fraction of their word shingles count as duplicates
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.85"))
+# A truncated chunk shorter than this is not worth sending
+MIN_TRUNCATED_TOKENS = int(os.getenv("MIN_TRUNCATED_TOKENS", "60"))
+# Claude's tokenizer is not available offline; ~4 characters per token holds for English prose
+CHARS_PER_TOKEN = 4
+SHINGLE_SIZE = 5
+
+SENTENCE_END = re.compile(r"(?<=[.!?;])\s+|\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def shingles(words: List[str]) -> set:
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def is_near_duplicate(candidate: set, kept: List[set]) -> bool:
+    for other in kept:
+        overlap = len(candidate & other)
+        # Containment over the smaller chunk also catches a page that repeats a shorter chunk
+        if overlap and overlap / min(len(candidate), len(other)) >= NEAR_DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+
+def truncate_to_sentences(text: str, max_tokens: int) -> str:
+    """Longest prefix of whole sentences (or table rows) that fits max_tokens; '' if none does."""
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = 0
+    for boundary in SENTENCE_END.finditer(text):
+        if boundary.start() > limit:
+            break
+        cut = boundary.start()
+    return text[:cut].rstrip()
+
+
+def format_chunk(doc: Document, content: str) -> str:
+    return f"[Source: {doc.metadata.get('source', 'Unknown')} | Page: {doc.metadata.get('page', '?')}] {content}"
+
+
+def pack_context(documents: List[Document], token_budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, Dict[str, int]]:
+    """Join retrieved chunks into one context block within token_budget.
+
+    Documents are taken in the order given (retrieval score order). Exact and
+    near-duplicate chunks are dropped; the first chunk that no longer fits is
+    cut at a sentence boundary and packing stops there.
+    Returns (context, stats) where stats holds the chunk and token counts.
+    """
+    stats = {"chunks_in": len(documents), "chunks_used": 0, "duplicates": 0,
+             "truncated": 0, "dropped": 0, "context_tokens": 0}
+    seen_hashes = set()
+    kept_shingles = []
+    parts = []
+    remaining = token_budget
+
+    for position, doc in enumerate(documents):
+        content = doc.page_content.strip()
+        words = normalize(content).split()
+        digest = hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()
+        doc_shingles = shingles(words)
+        if digest in seen_hashes or is_near_duplicate(doc_shingles, kept_shingles):
+            stats["duplicates"] += 1
+            continue
+
+        chunk = format_chunk(doc, content)
+        tokens = estimate_tokens(chunk) + 1
+        if tokens > remaining:
+            header_tokens = estimate_tokens(format_chunk(doc, ""))
+            content = truncate_to_sentences(content, remaining - header_tokens - 1)
+            stats["dropped"] = len(documents) - position
+            if estimate_tokens(content) >= MIN_TRUNCATED_TOKENS:
+                chunk = format_chunk(doc, content)
+                parts.append(chunk)
+                stats["truncated"] += 1
+                stats["dropped"] -= 1
+                stats["context_tokens"] += estimate_tokens(chunk) + 1
+            break
+
+        seen_hashes.add(digest)
+        kept_shingles.append(doc_shingles)
+        parts.append(chunk)
+        remaining -= tokens
+        stats["context_tokens"] += tokens
+
+    stats["chunks_used"] = len(parts)
+    return "\n\n".join(parts), stats
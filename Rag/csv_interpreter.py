@@ -1,12 +1,25 @@
+import os
 import re
-from typing import List
+import time
+import random
+import logging
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from langchain.schema import Document, HumanMessage
-from langchain_aws import ChatBedrock
+from model_providers import get_chat_model
+from telemetry import span, record_usage, in_context
+
+# Concurrency settings for query-time interpretation (overridable from .env)
+MAX_IN_FLIGHT = int(os.getenv("CSV_INTERPRETER_MAX_IN_FLIGHT", "4"))
+CHUNK_TIMEOUT_S = float(os.getenv("CSV_INTERPRETER_TIMEOUT_S", "60"))
+MAX_RETRIES = int(os.getenv("CSV_INTERPRETER_MAX_RETRIES", "3"))
+BACKOFF_BASE_S = float(os.getenv("CSV_INTERPRETER_BACKOFF_BASE_S", "1.0"))
+
+THROTTLING_CODES = ("ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException")
 
 # Initialize the LLM client
-llm = ChatBedrock(
-    model_id="mistral.mistral-7b-instruct-v0:2",
-    client=None,
+llm = get_chat_model(
+    "mistral.mistral-7b-instruct-v0:2",
     model_kwargs={"temperature": 0.3, "max_tokens": 1024},
 )
 
@@ -57,29 +70,105 @@ Table:
 
 
 """
-    response = llm.invoke([HumanMessage(content=prompt)])
+    with span("llm.mistral") as attrs:
+        response = llm.invoke([HumanMessage(content=prompt)])
+        record_usage(attrs, response, prompt, response.content)
     return response.content.strip()
 
-def run_csv_interpreter_agent(documents: List[Document]) -> List[Document]:
-    updated_docs = []
-
-    for doc in documents:
-        content = doc.page_content.strip()
+def is_throttling_error(error: Exception) -> bool:
+    response = getattr(error, "response", None)
+    code = response.get("Error", {}).get("Code", "") if isinstance(response, dict) else ""
+    # langchain_aws re-raises Bedrock errors as ValueError, keeping only the message
+    return code in THROTTLING_CODES or any(c in str(error) for c in THROTTLING_CODES)
+
+
+def _summarize_with_retry(chunk_text: str) -> str:
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return llm_summarize_or_pass_through(chunk_text)
+        except Exception as e:
+            if attempt == MAX_RETRIES or not is_throttling_error(e):
+                raise
+            delay = BACKOFF_BASE_S * (2 ** attempt) * (1 + random.random())
+            logging.warning(f"Bedrock throttled the CSV interpreter, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def interpret_chunks(
+    chunk_texts: List[str],
+    max_in_flight: int = MAX_IN_FLIGHT,
+    timeout_s: float = CHUNK_TIMEOUT_S,
+) -> List[Optional[str]]:
+    """Interpret chunks concurrently, returning results in input order.
+
+    A chunk that fails or exceeds timeout_s (measured from when its call starts,
+    retries included) yields None so the caller can fall back to the raw text.
+    """
+    results: List[Optional[str]] = [None] * len(chunk_texts)
+    if not chunk_texts:
+        return results
+
+    started = {}
+
+    def task(i: int) -> str:
+        started[i] = time.monotonic()
+        return _summarize_with_retry(chunk_texts[i])
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_in_flight))
+    futures = {executor.submit(in_context(task), i): i for i in range(len(chunk_texts))}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    logging.warning(f"CSV interpretation failed for chunk {i}, using raw text: {e}")
+
+            now = time.monotonic()
+            for future in list(pending):
+                i = futures[future]
+                if i in started and now - started[i] > timeout_s:
+                    # The call keeps running in its thread; its result is simply ignored
+                    pending.discard(future)
+                    logging.warning(f"CSV interpretation timed out for chunk {i}, using raw text")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
 
-        # Only interpret chunks that contain the phrase "this is a csv"
-        if "this is a csv" in content.lower():
-            result = llm_summarize_or_pass_through(content)
 
-            if result == content:
-                doc.metadata["csv_processed"] = False
-            else:
-                doc.page_content = result
-                doc.metadata["csv_processed"] = True
-        else:
-            # Return other chunks as they are
-            doc.metadata["csv_processed"] = False
+def run_csv_interpreter_agent(documents: List[Document]) -> List[Document]:
+    # Work on copies: retrieved documents are shared with the cached docstore
+    updated_docs = [
+        Document(page_content=doc.page_content, metadata=dict(doc.metadata))
+        for doc in documents
+    ]
+
+    # Only interpret chunks that contain the phrase "this is a csv"; prefer the
+    # interpretation stored at ingest time, older indexes need the LLM here
+    pending = []
+    for i, doc in enumerate(updated_docs):
+        doc.metadata["csv_processed"] = False
+        if "this is a csv" in doc.page_content.strip().lower() and not doc.metadata.get("csv_interpretation"):
+            pending.append(i)
+
+    interpreted = interpret_chunks([updated_docs[i].page_content.strip() for i in pending])
+    for i, result in zip(pending, interpreted):
+        if result is not None:
+            updated_docs[i].metadata["csv_interpretation"] = result
+
+    for doc in updated_docs:
+        content = doc.page_content.strip()
+        result = doc.metadata.get("csv_interpretation")
+        if "this is a csv" not in content.lower() or not result:
+            # Return other chunks (and failed interpretations) as they are
+            continue
 
-        updated_docs.append(doc)
+        if result != content:
+            doc.page_content = result
+            doc.metadata["csv_processed"] = True
 
     return updated_docs
-
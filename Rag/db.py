@@ -1,10 +1,148 @@
+import os
+import json
+import time
+import queue
+import atexit
 import sqlite3
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence
+import numpy as np
 
 DB_NAME = "conversations.db"
 
+# Minimum cosine similarity for a previous query to count as the same question
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# Every lookup scans the cached embeddings; the oldest answers are evicted beyond this many rows
+ANSWER_CACHE_MAX_ROWS = int(os.getenv("ANSWER_CACHE_MAX_ROWS", "5000"))
+
+# === Background conversation logging (overridable from .env) ===
+WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "100"))
+WRITE_FLUSH_INTERVAL_S = float(os.getenv("DB_WRITE_FLUSH_INTERVAL_S", "1.0"))
+WRITE_QUEUE_SIZE = int(os.getenv("DB_WRITE_QUEUE_SIZE", "10000"))
+# Full prompts are the bulk of every row; they are blanked after this many days
+PROMPT_RETENTION_DAYS = float(os.getenv("PROMPT_RETENTION_DAYS", "7"))
+# Older conversations (and their spans) are rolled up into daily counts and deleted
+CONVERSATION_RETENTION_DAYS = float(os.getenv("CONVERSATION_RETENTION_DAYS", "90"))
+RETENTION_INTERVAL_S = 3600
+
+
+def connect(db_path: str = DB_NAME, check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=check_same_thread)
+    # WAL lets readers (cache lookups, reports) run while the writer commits
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class BackgroundWriter:
+    """Single writer thread per database: queued inserts are committed in batches.
+
+    One long-lived connection does every write, so concurrent sessions never
+    contend for the write lock; callers only pay for a queue put. Pending
+    writes are flushed by flush(), close() and at interpreter exit.
+    """
+
+    def __init__(self, db_path: str = DB_NAME, batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval_s: float = WRITE_FLUSH_INTERVAL_S, retention: bool = False):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.retention = retention
+        self.queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.last_retention = 0.0
+        self.thread = threading.Thread(target=self._run, name=f"db-writer-{db_path}", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, sql: str, rows: Sequence[tuple] = ((),)):
+        """Queue an executemany; blocks only when WRITE_QUEUE_SIZE writes are already pending."""
+        self.queue.put((sql, list(rows)))
+
+    def flush(self, timeout: Optional[float] = None):
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def _run(self):
+        conn = connect(self.db_path, check_same_thread=False)
+        stopping = False
+        while not stopping:
+            batch, waiters = [], []
+            try:
+                item = self.queue.get(timeout=self.flush_interval_s)
+            except queue.Empty:
+                item = False
+            # Drain whatever else is queued, up to one batch per transaction
+            while item is not False:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    item = False
+
+            if batch:
+                try:
+                    with conn:
+                        for sql, rows in batch:
+                            conn.executemany(sql, rows)
+                except sqlite3.Error as e:
+                    print(f"❌ Failed to write {len(batch)} queued statements to {self.db_path}: {e}")
+            if self.retention and time.monotonic() - self.last_retention > RETENTION_INTERVAL_S:
+                self.last_retention = time.monotonic()
+                apply_retention(conn)
+            for waiter in waiters:
+                waiter.set()
+        conn.close()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db_path: str = DB_NAME) -> BackgroundWriter:
+    with _writers_lock:
+        if db_path not in _writers:
+            _writers[db_path] = BackgroundWriter(db_path, retention=db_path == DB_NAME)
+        return _writers[db_path]
+
+
+def apply_retention(conn: sqlite3.Connection, now: Optional[datetime] = None):
+    """Blank old prompts, roll old conversations up into daily counts, delete them and their spans."""
+    now = now or datetime.now()
+    prompt_cutoff = (now - timedelta(days=PROMPT_RETENTION_DAYS)).isoformat()
+    cutoff = (now - timedelta(days=CONVERSATION_RETENTION_DAYS)).isoformat()
+    try:
+        with conn:
+            conn.execute("UPDATE conversations SET prompt = '' WHERE timestamp < ? AND prompt != ''", (prompt_cutoff,))
+            conn.execute("""
+                INSERT INTO conversation_rollup (day, conversations, answer_chars)
+                SELECT substr(timestamp, 1, 10), COUNT(*), SUM(LENGTH(answer))
+                FROM conversations WHERE timestamp < ? GROUP BY substr(timestamp, 1, 10)
+                ON CONFLICT(day) DO UPDATE SET
+                    conversations = conversations + excluded.conversations,
+                    answer_chars = answer_chars + excluded.answer_chars
+            """, (cutoff,))
+            conn.execute("DELETE FROM conversations WHERE timestamp < ?", (cutoff,))
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'spans'").fetchone():
+                conn.execute("DELETE FROM spans WHERE timestamp < ?", (cutoff,))
+    except sqlite3.Error as e:
+        print(f"⚠️ Conversation retention skipped: {e}")
+
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
+    conn = connect(DB_NAME)
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS conversations (
@@ -15,16 +153,99 @@ def init_db():
             timestamp TEXT NOT NULL
         )
     """)
+    # Databases created before telemetry have no query_id linking rows to their spans
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(conversations)")]
+    if "query_id" not in columns:
+        cursor.execute("ALTER TABLE conversations ADD COLUMN query_id TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_timestamp ON conversations (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_query_id ON conversations (query_id)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_rollup (
+            day TEXT PRIMARY KEY,
+            conversations INTEGER NOT NULL,
+            answer_chars INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            index_version TEXT NOT NULL,
+            query TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            answer TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            doc_ids TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_answer_cache_source_version
+        ON answer_cache (source, index_version)
+    """)
     conn.commit()
     conn.close()
 
-def save_conversation(query: str, answer: str, prompt: str):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+def save_conversation(query: str, answer: str, prompt: str, query_id: Optional[str] = None):
+    # Queued for the background writer; the answer path never waits on SQLite
     timestamp = datetime.now().isoformat()
+    get_writer(DB_NAME).submit("""
+        INSERT INTO conversations (query, prompt, answer, timestamp, query_id) VALUES (?, ?, ?, ?, ?)
+    """, [(query, prompt, answer, timestamp, query_id)])
 
-    cursor.execute("""
-        INSERT INTO conversations (query, prompt, answer, timestamp) VALUES (?, ?, ?, ?)
-    """, (query, prompt, answer, timestamp))
-    conn.commit()
-    conn.close()
+
+def save_cached_answer(query: str, embedding: List[float], answer: str, prompt: str,
+                       doc_ids: List[str], source: str, index_version: str):
+    # Queued for the background writer like conversations; statements run in order on its connection
+    timestamp = datetime.now().isoformat()
+    writer = get_writer(DB_NAME)
+    # Entries built against an older index can never be hit again
+    writer.submit("""
+        DELETE FROM answer_cache WHERE source = ? AND index_version != ?
+    """, [(source, index_version)])
+    writer.submit("""
+        INSERT INTO answer_cache (source, index_version, query, embedding, answer, prompt, doc_ids, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(source, index_version, query, np.asarray(embedding, dtype=np.float32).tobytes(),
+           answer, prompt, json.dumps(doc_ids), timestamp)])
+    writer.submit("""
+        DELETE FROM answer_cache
+        WHERE id < (SELECT id FROM answer_cache ORDER BY id DESC LIMIT 1 OFFSET ?)
+    """, [(ANSWER_CACHE_MAX_ROWS - 1,)])
+
+
+def lookup_cached_answer(embedding: List[float], source: str, index_version: str,
+                         threshold: float = SEMANTIC_CACHE_THRESHOLD) -> Optional[dict]:
+    """Return the cached answer of the most similar previous query, if above threshold."""
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        rows = conn.execute("""
+            SELECT query, embedding, answer, prompt, doc_ids FROM answer_cache
+            WHERE source = ? AND index_version = ?
+        """, (source, index_version)).fetchall()
+    except sqlite3.OperationalError:
+        # No answer_cache table yet (init_db not run): nothing can be cached
+        return None
+    finally:
+        conn.close()
+
+    if not rows:
+        return None
+
+    query_vector = np.asarray(embedding, dtype=np.float32)
+    cached_vectors = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+    norms = np.linalg.norm(cached_vectors, axis=1) * np.linalg.norm(query_vector)
+    similarities = cached_vectors @ query_vector / np.maximum(norms, 1e-12)
+
+    best = int(np.argmax(similarities))
+    if similarities[best] < threshold:
+        return None
+
+    query, _, answer, prompt, doc_ids = rows[best]
+    return {
+        "query": query,
+        "answer": answer,
+        "prompt": prompt,
+        "doc_ids": json.loads(doc_ids),
+        "similarity": float(similarities[best]),
+    }
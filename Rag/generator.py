@@ -1,21 +1,28 @@
-from langchain_aws import ChatBedrock
 from langchain.schema import Document, HumanMessage
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Tuple, Union
 from dotenv import load_dotenv
+from context_packer import pack_context, estimate_tokens
+from model_providers import get_chat_model
+from telemetry import span, record_usage
 
 load_dotenv()
 
-llm = ChatBedrock(
-    model_id="eu.anthropic.claude-3-5-sonnet-20240620-v1:0",
-    client=None,
+llm = get_chat_model(
+    "eu.anthropic.claude-3-5-sonnet-20240620-v1:0",
     model_kwargs={"temperature": 0.3, "max_tokens": 2048},
 )
 
-def generate_answer(query: str, documents: List[Document]) -> Tuple[str, str]:
-    text = "\n\n".join(
-        f"[Source: {doc.metadata.get('source', 'Unknown')} | Page: {doc.metadata.get('page', '?')}] {doc.page_content.strip()}"
-        for doc in documents
-    )
+def generate_answer(
+    query: str, documents: List[Document], stream: bool = False
+) -> Tuple[Union[str, Iterator[str]], str, Dict[str, int]]:
+    """Return (answer, instruction_prompt, context_stats).
+
+    The context is deduplicated and packed into CONTEXT_TOKEN_BUDGET tokens
+    (see context_packer); context_stats reports the chunk and token counts.
+    With stream=True the answer is an iterator yielding text tokens as Claude
+    produces them; the LLM call starts when the iterator is first consumed.
+    """
+    text, context_stats = pack_context(documents)
 
     instruction_prompt = f"""As an expert in pharmaceutical regulatory affairs, analyze the following EMA public assessment content. The content may include:
 
@@ -43,9 +50,28 @@ Input:
 "{text}"
 """
 
-    full_prompt = f"{instruction_prompt}\n{text}"
-    response = llm.invoke([HumanMessage(content=full_prompt)])
-    return response.content.strip(), instruction_prompt
+    # The context is already inside instruction_prompt; it is sent once
+    context_stats["prompt_tokens"] = estimate_tokens(instruction_prompt)
+    messages = [HumanMessage(content=instruction_prompt)]
+
+    if stream:
+        def token_stream() -> Iterator[str]:
+            # Timed from the first token request to the last token
+            with span("llm.claude", stream=True) as attrs:
+                parts, usage_chunk = [], None
+                for chunk in llm.stream(messages):
+                    if getattr(chunk, "usage_metadata", None):
+                        usage_chunk = chunk
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield chunk.content
+                record_usage(attrs, usage_chunk, instruction_prompt, "".join(parts))
+        return token_stream(), instruction_prompt, context_stats
+
+    with span("llm.claude", stream=False) as attrs:
+        response = llm.invoke(messages)
+        record_usage(attrs, response, instruction_prompt, response.content)
+    return response.content.strip(), instruction_prompt, context_stats
 
 
 
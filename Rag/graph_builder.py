@@ -1,38 +1,120 @@
+import threading
 from langgraph.graph import StateGraph, END
 from langchain_core.runnables import RunnableLambda
-from typing import TypedDict, List
-from retriever import get_retriever
+from typing import Iterator, TypedDict, List
+from retriever import get_retriever, get_index_version, embed_query, document_ids
 from generator import generate_answer
 from langchain.schema import Document
 from csv_interpreter import run_csv_interpreter_agent
+from pk_lookup import answer_pk_lookup
+from db import lookup_cached_answer, save_cached_answer
+from telemetry import span
 
-retriever = get_retriever()
 #retriever.search_kwargs['k'] = 10
 
-def build_graph(retriever):
-    class GraphState(TypedDict):
+# One compiled graph per retrieval source and answer mode, reused across
+# queries and sessions. The retriever resolves the index through the registry, so a rebuilt index
+# is picked up without recompiling the graph.
+_graphs_lock = threading.Lock()
+_graphs = {}
+
+def cache_answer(state: dict, answer: str):
+    """Store a freshly generated answer in the semantic cache."""
+    if not state.get("documents") or "query_embedding" not in state:
+        return
+    save_cached_answer(
+        state["query"], state["query_embedding"], answer, state.get("prompt", ""),
+        document_ids(state["documents"]), state["source"], state["index_version"],
+    )
+
+
+def build_graph(retriever, stream: bool = False, source: str = "text"):
+    class GraphState(TypedDict, total=False):
         query: str
+        source: str
+        query_embedding: List[float]
+        index_version: str
+        cache_hit: bool
+        sql_lookup: bool
+        doc_ids: List[str]
         documents: List[Document]
         answer: str
+        prompt: str
+        answer_stream: Iterator[str]
+        context_stats: dict
+
+    def cache_lookup_node(state: GraphState) -> GraphState:
+        with span("cache_lookup", source=source) as attrs:
+            embedding = embed_query(state["query"])
+            index_version = get_index_version(source)
+            cached = lookup_cached_answer(embedding, source, index_version)
+            attrs["cache_hit"] = cached is not None
+            if cached:
+                attrs["similarity"] = cached["similarity"]
+        if cached:
+            # Skip retrieval, interpretation and generation entirely
+            return {"query": state["query"], "source": source, "cache_hit": True, "documents": [],
+                    "answer": cached["answer"], "prompt": cached["prompt"], "doc_ids": cached["doc_ids"]}
+        return {"query": state["query"], "source": source, "cache_hit": False,
+                "query_embedding": embedding, "index_version": index_version}
+
+    def pk_lookup_node(state: GraphState) -> GraphState:
+        with span("pk_lookup") as attrs:
+            result = answer_pk_lookup(state["query"])
+            attrs["hit"] = result is not None
+            if result:
+                attrs["values"] = len(result["values"])
+        if result:
+            # Exact values straight from the table store: no retrieval, interpreter or Claude call
+            return {**state, "sql_lookup": True, "documents": [], "doc_ids": [],
+                    "answer": result["answer"], "prompt": result["sql"]}
+        return {**state, "sql_lookup": False}
 
     def retrieve_docs(state: GraphState) -> GraphState:
-        docs = retriever(state["query"], k=10)
-        return {"query": state["query"], "documents": docs}
+        with span("retrieve", source=source) as attrs:
+            docs = retriever(state["query"], k=10, embedding=state.get("query_embedding"))
+            attrs["chunks"] = len(docs)
+        return {**state, "documents": docs}
 
     def csv_agent_node(state: GraphState) -> GraphState:
-        processed_docs = run_csv_interpreter_agent(state["documents"])
+        with span("csv_agent") as attrs:
+            processed_docs = run_csv_interpreter_agent(state["documents"])
+            attrs["chunks"] = len(processed_docs)
+            attrs["csv_chunks"] = sum(1 for doc in processed_docs if doc.metadata.get("csv_processed"))
         return {**state, "documents": processed_docs}
 
     def generate_node(state: GraphState) -> GraphState:
-        answer, prompt = generate_answer(state["query"], state["documents"])
-        return {**state, "answer": answer}
+        with span("generate", stream=stream) as attrs:
+            # With stream=True the caller consumes the tokens; nothing is sent to Claude until it
+            # does, and the llm.claude span is recorded when the stream is exhausted.
+            answer, prompt, context_stats = generate_answer(state["query"], state["documents"], stream=stream)
+            # Packing details (duplicates, truncated, dropped) go to the span instead of stdout
+            attrs.update(context_stats, chunks=context_stats["chunks_used"], input_tokens=context_stats["prompt_tokens"])
+        if stream:
+            return {**state, "answer_stream": answer, "prompt": prompt, "context_stats": context_stats}
+        cache_answer({**state, "prompt": prompt}, answer)
+        return {**state, "answer": answer, "prompt": prompt, "context_stats": context_stats}
 
     graph = StateGraph(GraphState)
+    graph.add_node("cache", RunnableLambda(cache_lookup_node))
     graph.add_node("retriever", RunnableLambda(retrieve_docs))
+    graph.add_node("pk_lookup", RunnableLambda(pk_lookup_node))
     graph.add_node("csv_agent", RunnableLambda(csv_agent_node))
     graph.add_node("generate", RunnableLambda(generate_node))
 
-    graph.set_entry_point("retriever")
+    graph.set_entry_point("cache")
+    # Table sources try an exact SQL lookup before retrieval
+    after_cache = "pk_lookup" if source in ("csv", "all") else "retriever"
+    graph.add_conditional_edges(
+        "cache",
+        lambda state: "hit" if state.get("cache_hit") else "miss",
+        {"hit": END, "miss": after_cache},
+    )
+    graph.add_conditional_edges(
+        "pk_lookup",
+        lambda state: "answered" if state.get("sql_lookup") else "not_a_lookup",
+        {"answered": END, "not_a_lookup": "retriever"},
+    )
     graph.add_edge("retriever", "csv_agent")
     graph.add_edge("csv_agent", "generate")
     graph.add_edge("generate", END)
@@ -40,4 +122,9 @@ def build_graph(retriever):
     return graph.compile()
 
 
-
+def get_graph(source: str = "text", stream: bool = False):
+    key = (source, stream)
+    with _graphs_lock:
+        if key not in _graphs:
+            _graphs[key] = build_graph(get_retriever(source=source), stream=stream, source=source)
+        return _graphs[key]
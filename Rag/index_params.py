@@ -0,0 +1,38 @@
+"""FAISS index parameters shared by ingestion (Storing_in_vectorstore/index_factory.py) and the retriever."""
+import os
+import json
+from typing import Optional
+import faiss
+
+INDEX_CONFIG_FILE = "index_config.json"
+
+# Config keys the structure of each index type is built from; the others
+# (ivf_nprobe, hnsw_ef_search) only apply at query time
+BUILD_KEYS = {
+    "flat": (),
+    "ivf": ("ivf_nlist",),
+    "hnsw": ("hnsw_m", "hnsw_ef_construction"),
+}
+
+
+def build_params(config: dict) -> dict:
+    """The part of an index config that requires re-indexing when it changes."""
+    return {"type": config["type"], **{key: config.get(key) for key in BUILD_KEYS.get(config["type"], ())}}
+
+
+def apply_search_params(index, config: dict):
+    """Set query-time parameters (nprobe / efSearch) for IVF and HNSW indexes."""
+    params = faiss.ParameterSpace()
+    if config["type"] == "ivf":
+        params.set_index_parameter(index, "nprobe", config["ivf_nprobe"])
+    elif config["type"] == "hnsw":
+        params.set_index_parameter(index, "efSearch", config["hnsw_ef_search"])
+
+
+def load_index_config(index_dir: str) -> Optional[dict]:
+    """The config an index was saved with, or None for indexes saved without one."""
+    path = os.path.join(index_dir, INDEX_CONFIG_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
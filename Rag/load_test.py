@@ -0,0 +1,85 @@
+"""Concurrent load test for server.py.
+
+Usage:
+    python load_test.py --url http://localhost:8080 --requests 200 --concurrency 20
+    python load_test.py --queries-file questions.txt --source all
+
+Sends --requests POST /query calls with at most --concurrency outstanding and
+reports status codes, throughput and p50/p95/p99 latency of answered queries.
+Point it at a server running against local stand-ins for Bedrock to measure
+the service itself rather than model latency.
+"""
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+import aiohttp
+import numpy as np
+
+DEFAULT_QUERIES = [
+    "What is the Cmax of netupitant after a single 300 mg dose?",
+    "How much sorbitol does a 3 kg child get from Netupitant suspension?",
+    "What is the recommended dose of Akynzeo?",
+    "Which adverse reactions were reported most frequently?",
+    "What is the terminal half-life of palonosetron?",
+]
+
+
+async def one_request(session, url, query, source, results):
+    start = time.perf_counter()
+    try:
+        async with session.post(f"{url}/query", json={"query": query, "source": source}) as response:
+            await response.read()
+            results.append((response.status, time.perf_counter() - start))
+    except aiohttp.ClientError as e:
+        results.append((type(e).__name__, time.perf_counter() - start))
+
+
+async def run(url, queries, source, total, concurrency):
+    results = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def bounded(query):
+        async with limit:
+            await one_request(session, url, query, source, results)
+
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(f"{url}/ready") as response:
+            print(f"ℹ️ Readiness: {response.status} {await response.text()}")
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(random.choice(queries)) for _ in range(total)))
+        elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--source", default="text", choices=["text", "csv", "all"])
+    parser.add_argument("--queries-file", help="One question per line (default: built-in sample)")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries_file:
+        with open(args.queries_file, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    results, elapsed = asyncio.run(run(args.url, queries, args.source, args.requests, args.concurrency))
+    statuses = Counter(status for status, _ in results)
+    ok_ms = np.array([latency for status, latency in results if status == 200]) * 1000
+
+    print(f"📊 {len(results)} requests in {elapsed:.1f}s ({len(results) / elapsed:.1f} req/s), "
+          f"concurrency {args.concurrency}")
+    print(f"   Status codes: {dict(statuses)}")
+    if len(ok_ms):
+        print(f"   Answered latency ms: p50 {np.percentile(ok_ms, 50):.0f}, p95 {np.percentile(ok_ms, 95):.0f}, "
+              f"p99 {np.percentile(ok_ms, 99):.0f}, max {ok_ms.max():.0f}")
+
+
+if __name__ == "__main__":
+    main()
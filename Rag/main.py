@@ -7,10 +7,11 @@ import warnings
 
 #load_dotenv()
 
-from graph_builder import build_graph
+from db import init_db
+from graph_builder import get_graph
 
 if __name__ == "__main__":
-    app = build_graph()
+    init_db()
+    app = get_graph("text")
     result = app.invoke({"query": "How much sorbitol does a 3 kg child get from Netupitant suspension?"})
     print(result["answer"])
-
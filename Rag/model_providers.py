@@ -0,0 +1,154 @@
+"""Embedding and chat model providers: Bedrock in production, a deterministic local fake offline.
+
+Set MODEL_PROVIDER=fake (in .env or the environment) to run ingestion, the app,
+the service and the benchmarks without AWS. The fake embeddings hash words into
+vectors of the Titan dimension, so chunks sharing words still retrieve each
+other; the fake chat model returns a canned answer after a configurable delay
+and can raise Bedrock-style throttling errors at a configurable rate.
+"""
+import os
+import re
+import time
+import random
+import hashlib
+import threading
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+load_dotenv()
+
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "bedrock")
+
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v2:0"
+EMBEDDING_REGION = "eu-west-1"
+EMBEDDING_DIM = 1024      # Titan text v2 default output size
+
+# The message langchain_aws raises for a throttled Bedrock call
+THROTTLING_MESSAGE = ("Error raised by bedrock service: An error occurred (ThrottlingException) "
+                      "when calling the InvokeModel operation: Too many requests, please wait before trying again.")
+
+
+def _fake_setting(name: str, default: str) -> float:
+    # Read at construction time so benchmarks can set them before building models
+    return float(os.getenv(name, default))
+
+
+class _FaultInjector:
+    """Shared latency and throttling injection for the fake models."""
+
+    def __init__(self, latency_s: float, throttle_rate: float, seed: int = 0):
+        self.latency_s = latency_s
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def call(self):
+        with self.lock:
+            throttled = self.rng.random() < self.throttle_rate
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if throttled:
+            raise ValueError(THROTTLING_MESSAGE)
+
+
+class FakeHashEmbeddings(Embeddings):
+    """Deterministic bag-of-words feature-hashing embeddings, L2-normalised."""
+
+    def __init__(self, dim: int = EMBEDDING_DIM, latency_s: float = 0.0, throttle_rate: float = 0.0):
+        self.dim = dim
+        # Distinct model ID keeps fake vectors out of the real embedding cache entries
+        self.model_id = f"fake-hash-{dim}"
+        self.faults = _FaultInjector(latency_s, throttle_rate)
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()) or [text]:
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0], norm = 1.0, 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # One injected delay/throttle per call, like one Bedrock request per batch
+        self.faults.call()
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.faults.call()
+        return self._embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Canned chat model with per-call latency, per-token streaming delay and throttling."""
+
+    model_id: str = "fake"
+    latency_s: float = 0.0
+    token_latency_s: float = 0.0
+    throttle_rate: float = 0.0
+    response: Optional[str] = None
+    faults: Any = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.faults = _FaultInjector(self.latency_s, self.throttle_rate)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        if self.response is not None:
+            return self.response
+        prompt = str(messages[-1].content)
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        return (f"Answer — Canned response {digest} from {self.model_id}.\n\n"
+                f"Justification — The prompt had {len(prompt)} characters.")
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs) -> ChatResult:
+        self.faults.call()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        self.faults.call()
+        for token in re.findall(r"\S+\s*", self._reply(messages)):
+            if self.token_latency_s:
+                time.sleep(self.token_latency_s)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def get_embedding_model() -> Embeddings:
+    if MODEL_PROVIDER == "fake":
+        return FakeHashEmbeddings(
+            dim=int(_fake_setting("FAKE_EMBEDDING_DIM", str(EMBEDDING_DIM))),
+            latency_s=_fake_setting("FAKE_EMBED_LATENCY_S", "0"),
+            throttle_rate=_fake_setting("FAKE_THROTTLE_RATE", "0"),
+        )
+    if MODEL_PROVIDER != "bedrock":
+        raise ValueError(f"Unknown MODEL_PROVIDER: {MODEL_PROVIDER}")
+    from langchain.embeddings import BedrockEmbeddings
+    return BedrockEmbeddings(model_id=EMBEDDING_MODEL_ID, region_name=EMBEDDING_REGION)
+
+
+def get_chat_model(model_id: str, model_kwargs: dict) -> BaseChatModel:
+    if MODEL_PROVIDER == "fake":
+        return FakeChatModel(
+            model_id=model_id,
+            latency_s=_fake_setting("FAKE_LLM_LATENCY_S", "0.05"),
+            token_latency_s=_fake_setting("FAKE_LLM_TOKEN_LATENCY_S", "0"),
+            throttle_rate=_fake_setting("FAKE_THROTTLE_RATE", "0"),
+        )
+    if MODEL_PROVIDER != "bedrock":
+        raise ValueError(f"Unknown MODEL_PROVIDER: {MODEL_PROVIDER}")
+    from langchain_aws import ChatBedrock
+    return ChatBedrock(model_id=model_id, client=None, model_kwargs=model_kwargs)
@@ -0,0 +1,248 @@
+"""Exact PK parameter lookups against the table store written at ingest time.
+
+Questions like "What is the Cmax of Akynzeo for Treatment A on Day 1?" are
+answered with a generated SQL query over pk_tables.sqlite (one table per CSV,
+columns named after the flattened headers) instead of the CSV interpreter and
+Claude. Only the tables of the one product the question names are queried;
+questions naming no product, or a name shared by several, go to retrieval, as
+do questions with qualifiers the tables cannot be filtered on (population,
+fed state, dose, ...) and yes/no, threshold or comparison questions.
+Query generation is rule-based: table and column names only ever come from
+the store's own catalog, user text is passed as parameters, and an SQLite
+authorizer restricts the statement to reading the catalogued tables.
+"""
+import os
+import re
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+PK_TABLES_DB = os.getenv("PK_TABLES_DB", "pk_tables.sqlite")
+CATALOG_TABLE = "pk_catalog"
+PRODUCTS_TABLE = "pk_products"
+MAX_RESULT_ROWS = 50
+
+# Canonical parameter -> pattern matched against the question and the tables' row labels
+PK_PARAMETERS = {
+    "Cmax": r"\bc\s*max\b|maximum (plasma |serum )?concentration|peak (plasma |serum )?concentration",
+    "AUC": r"\bauc|area under the (plasma )?(concentration|curve)",
+    "Tmax": r"\bt\s*max\b|time to (maximum|peak)",
+}
+# Questions asking for reasoning rather than a value go through retrieval and Claude
+ANALYTIC_WORDS = re.compile(r"\b(why|explain|compare|comparison|difference|differ|trend|interpret|summari[sz]e|"
+                            r"significant|conclude|conclusion|recommend)\b", re.IGNORECASE)
+# Only the keyword ignores case; the label must be an uppercase letter or a number ("treatment group" has none)
+TREATMENT = re.compile(r"\b((?i:treatment|arm|group|cohort|regimen))\s+([A-Z]|\d+)\b")
+DAY = re.compile(r"\bday\s*(\d+)\b", re.IGNORECASE)
+STATISTIC = re.compile(r"\b(geometric mean|mean|median|sd)\b", re.IGNORECASE)
+# Yes/no, threshold and comparison questions need an answer, not a list of values
+COMPARISON = re.compile(r"^\s*(did|does|do|is|was|were|are|has|have|can|could|would|should)\b|"
+                        r"\b(exceed\w*|above|below|over|under|greater|less|more|fewer|higher|lower|"
+                        r"than|least|most|between|within|versus|vs)\b|[<>=\u2264\u2265]", re.IGNORECASE)
+# Words a value question may contain besides the product, parameter and filters; any other
+# term (population, fed state, dose, unit, ...) is a qualifier the tables cannot be filtered on
+LOOKUP_WORDS = {
+    "what", "whats", "which", "is", "are", "was", "were", "the", "a", "an", "of", "for", "in", "on", "at", "to",
+    "and", "with", "by", "s", "its", "value", "values", "level", "levels", "reported", "observed", "measured",
+    "give", "tell", "show", "list", "find", "me", "please", "pk", "pharmacokinetic", "pharmacokinetics",
+    "parameter", "parameters",
+}
+
+
+@dataclass
+class PKLookup:
+    parameters: List[str]
+    # Regexes every selected column header must match (treatment, day, statistic)
+    column_filters: List[str] = field(default_factory=list)
+    # Product key whose tables are queried
+    product: Optional[str] = None
+    # Remaining words of the question; each must be a product name for the lookup to be answered
+    terms: List[str] = field(default_factory=list)
+
+
+def parse_lookup(query: str) -> Optional[PKLookup]:
+    """Detect a parameter/value lookup; None for anything else.
+
+    Questions that compare against a threshold or another value are not
+    lookups. Words outside the parameter, filter and LOOKUP_WORDS vocabulary
+    are returned as terms, for the caller to check against the product names.
+    """
+    if ANALYTIC_WORDS.search(query) or COMPARISON.search(query):
+        return None
+    parameters = [name for name, pattern in PK_PARAMETERS.items() if re.search(pattern, query, re.IGNORECASE)]
+    if not parameters:
+        return None
+    filters = [rf"\b{re.escape(kind)}\s+{re.escape(label)}\b" for kind, label in TREATMENT.findall(query)]
+    filters += [rf"\bday\s*{day}\b" for day in DAY.findall(query)]
+    filters += [rf"\b{statistic}\b" for statistic in STATISTIC.findall(query)[:1]]
+
+    rest = query
+    # Parameter suffixes such as AUC0-inf or AUC(0-t) belong to the parameter
+    for pattern in PK_PARAMETERS.values():
+        rest = re.sub(rf"(?:{pattern})(?:\([^)]*\)|[\w\u221e-])*", " ", rest, flags=re.IGNORECASE)
+    for pattern in (TREATMENT, DAY, STATISTIC):
+        rest = pattern.sub(" ", rest)
+    terms = [word for word in re.findall(r"[a-z0-9]+(?:[./%][a-z0-9]+)*", rest.lower()) if word not in LOOKUP_WORDS]
+    return PKLookup(parameters, filters, terms=terms)
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _regexp(pattern: str, value) -> bool:
+    return value is not None and re.search(pattern, str(value), re.IGNORECASE) is not None
+
+
+def build_query(table: str, columns: List[str], lookup: PKLookup) -> Optional[Tuple[str, list, List[str]]]:
+    """(SQL, parameters, value columns) selecting the lookup's parameters from one catalogued table,
+    or None if the table has no column matching the filters.
+
+    Parameters are looked for in the row labels (first column); the value
+    columns are those whose header matches every treatment/day/statistic filter.
+    """
+    label, value_columns = columns[0], columns[1:]
+    selected = [c for c in value_columns if all(re.search(f, c, re.IGNORECASE) for f in lookup.column_filters)]
+    if not selected:
+        return None
+    patterns = [PK_PARAMETERS[name] for name in lookup.parameters]
+    sql = (f"SELECT {', '.join(quote_identifier(c) for c in [label] + selected)} FROM {quote_identifier(table)} "
+           f"WHERE {' OR '.join(f'{quote_identifier(label)} REGEXP ?' for _ in patterns)} LIMIT {MAX_RESULT_ROWS}")
+    return sql, patterns, selected
+
+
+class PKTableStore:
+    """Read-only access to pk_tables.sqlite; reopened when ingestion swaps in a new file."""
+
+    def __init__(self, path: str = PK_TABLES_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.stamp = None
+        self.catalog: Dict[str, dict] = {}
+        self.aliases: Dict[str, set] = {}
+
+    def _refresh(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        stamp = (stat.st_ino, stat.st_mtime)
+        if stamp != self.stamp:
+            if self.conn is not None:
+                self.conn.close()
+            uri = Path(self.path).absolute().as_uri() + "?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self.conn.create_function("regexp", 2, _regexp, deterministic=True)
+            rows = self.conn.execute(f"SELECT table_name, file_name, product, source_file, page, columns, row_labels "
+                                     f"FROM {CATALOG_TABLE}")
+            self.catalog = {name: {"file_name": file_name, "product": product, "source_file": source_file,
+                                   "page": page, "columns": json.loads(columns), "row_labels": json.loads(row_labels)}
+                            for name, file_name, product, source_file, page, columns, row_labels in rows}
+            self.aliases = {}
+            for alias, product in self.conn.execute(f"SELECT alias, product FROM {PRODUCTS_TABLE}"):
+                self.aliases.setdefault(alias, set()).add(product)
+            self.stamp = stamp
+        return True
+
+    def _authorize(self, table: str):
+        allowed_columns = set(self.catalog[table]["columns"])
+
+        def check(action, arg1, arg2, db_name, trigger):
+            if action == sqlite3.SQLITE_SELECT:
+                return sqlite3.SQLITE_OK
+            if action == sqlite3.SQLITE_READ and arg1 == table and arg2 in allowed_columns:
+                return sqlite3.SQLITE_OK
+            if action == sqlite3.SQLITE_FUNCTION and arg2 == "regexp":
+                return sqlite3.SQLITE_OK
+            return sqlite3.SQLITE_DENY
+        return check
+
+    def match_product(self, query: str) -> Optional[str]:
+        """The one product the query names, or None when it names none or an ambiguous name."""
+        with self.lock:
+            if not self._refresh():
+                return None
+            products = set()
+            for word in set(re.findall(r"[a-z]{3,}", query.lower())):
+                matches = self.aliases.get(word, set())
+                if len(matches) > 1:
+                    return None
+                products |= matches
+        return products.pop() if len(products) == 1 else None
+
+    def lookup(self, lookup: PKLookup) -> Tuple[List[dict], List[str]]:
+        """Run the lookup against every table of lookup.product whose row labels mention a requested parameter.
+
+        Returns (values, executed SQL); each value is {product, source_file, page, file_name, row, column, value}.
+        """
+        results, statements = [], []
+        with self.lock:
+            if not self._refresh():
+                return results, statements
+            label_patterns = [PK_PARAMETERS[name] for name in lookup.parameters]
+            for table, entry in self.catalog.items():
+                if entry["product"] != lookup.product:
+                    continue
+                labels = " | ".join(str(label) for label in entry["row_labels"])
+                if not any(re.search(pattern, labels, re.IGNORECASE) for pattern in label_patterns):
+                    continue
+                query = build_query(table, entry["columns"], lookup)
+                if query is None:
+                    continue
+                sql, params, value_columns = query
+                self.conn.set_authorizer(self._authorize(table))
+                try:
+                    rows = self.conn.execute(sql, params).fetchall()
+                finally:
+                    self.conn.set_authorizer(None)
+                statements.append(sql)
+                for row in rows:
+                    for column, value in zip(value_columns, row[1:]):
+                        if str(value).strip():
+                            results.append({"product": entry["product"], "source_file": entry["source_file"],
+                                            "page": entry["page"], "file_name": entry["file_name"],
+                                            "row": row[0], "column": column, "value": value})
+        return results, statements
+
+
+_store = PKTableStore()
+
+
+def source_label(value: dict) -> str:
+    """Where a value comes from: the source PDF and page when recorded, else the CSV file."""
+    if value["source_file"]:
+        return f"{value['source_file']}, page {value['page']}"
+    return value["file_name"]
+
+
+def format_answer(lookup: PKLookup, values: List[dict]) -> str:
+    lines = [f"Exact values for {', '.join(lookup.parameters)} of {lookup.product.capitalize()} "
+             f"from the extracted PK tables:"]
+    values = sorted(values, key=lambda v: (v["source_file"] or v["file_name"], v["page"] or 0))
+    for label in dict.fromkeys(source_label(v) for v in values):
+        lines.append(f"\nSource: {label}")
+        lines += [f"- {v['row']} | {v['column']}: {v['value']}" for v in values if source_label(v) == label]
+    return "\n".join(lines)
+
+
+def answer_pk_lookup(query: str, store: PKTableStore = _store) -> Optional[dict]:
+    """Answer a parameter/value question from the table store; None when it is not one or nothing matched."""
+    lookup = parse_lookup(query)
+    if lookup is None:
+        return None
+    # Tables of different products hold the same parameters; without exactly one product the values would mix
+    lookup.product = store.match_product(query)
+    if lookup.product is None:
+        return None
+    # An unrecognised qualifier ("in hepatic impairment", "under fed conditions") would be silently
+    # ignored and the generic values returned as exact; retrieval handles those questions instead
+    if any(term not in store.aliases for term in lookup.terms):
+        return None
+    values, statements = store.lookup(lookup)
+    if not values:
+        return None
+    return {"answer": format_answer(lookup, values), "sql": ";\n".join(statements), "values": values}
@@ -1,28 +1,231 @@
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import faiss
 from langchain.vectorstores import FAISS
-from langchain.embeddings import BedrockEmbeddings
+from model_providers import get_embedding_model
+from telemetry import span, in_context
+from sqlite_docstore import SQLiteDocstore, DOCSTORE_FILE
+from index_params import apply_search_params, load_index_config
 
-def get_retriever(source: str = "text"):
+INDEX_PATHS = {
+    "text": "faiss_db_text",
+    "csv": "faiss_db_csv",
+}
 
-    embeddings = BedrockEmbeddings(
-        model_id="amazon.titan-embed-text-v2:0",
-        region_name="eu-west-1",
-    )
+# Chunks taken from each index; "all" merges both sources by score
+SOURCE_K = {
+    "text": 10,
+    "csv": 7,
+}
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
 
-    if source == "csv":
-        db_path = "faiss_db_csv"
-    else:
-        db_path = "faiss_db_text"
+PARTITIONS_FILE = "partitions.json"
+# Chunks returned when a query is routed to product partitions (less noise, so fewer are needed)
+PARTITION_K = int(os.getenv("PARTITION_K", "6"))
 
-    vectorstore = FAISS.load_local(
-        db_path,
-        embeddings,
-        allow_dangerous_deserialization=True
-    )
+# Process-wide registry: one loaded vectorstore per source, shared by every
+# Streamlit session and thread. Entries are reloaded when the index on disk changes.
+_registry_lock = threading.Lock()
+_vectorstores = {}
+_embeddings = None
+_search_pool = ThreadPoolExecutor(max_workers=len(INDEX_PATHS), thread_name_prefix="faiss-search")
 
-    def retriever(query: str, k: int = 10):
-        if source == "csv":
-            return vectorstore.similarity_search(query=query, k=7)
+
+def get_embeddings():
+    global _embeddings
+    with _registry_lock:
+        if _embeddings is None:
+            _embeddings = get_embedding_model()
+        return _embeddings
+
+
+def _index_signature(db_path: str):
+    """Size and mtime of the saved index files, used to detect a rebuilt index."""
+    signature = []
+    for file_name in ("index.faiss", DOCSTORE_FILE):
+        stat = os.stat(os.path.join(db_path, file_name))
+        signature.append((file_name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def _load_partition_lookup(db_path: str):
+    path = os.path.join(db_path, PARTITIONS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _apply_search_params(vectorstore, db_path: str):
+    """Apply the query-time parameters recorded by ingestion for IVF and HNSW indexes."""
+    config = load_index_config(db_path)
+    if config is not None:
+        apply_search_params(vectorstore.index, config)
+
+
+def _get_entry(source: str):
+    db_path = INDEX_PATHS.get(source, INDEX_PATHS["text"])
+    embeddings = get_embeddings()
+
+    with _registry_lock:
+        entry = _vectorstores.get(db_path)
+        try:
+            signature = _index_signature(db_path)
+        except OSError:
+            # Index directory is missing or being swapped: keep serving what we have.
+            if entry is not None:
+                return entry
+            raise
+
+        if entry is None or entry["signature"] != signature:
+            if entry is not None:
+                # The partition stores read positions through the old docstore; both go with it
+                entry["partition_stores"].clear()
+                entry["docstore"].close()
+            # Only the vectors are loaded eagerly; chunk text is read from SQLite per hit
+            # (no pickle on the serving path)
+            docstore = SQLiteDocstore(os.path.join(db_path, DOCSTORE_FILE))
+            vectorstore = FAISS(
+                embeddings,
+                faiss.read_index(os.path.join(db_path, "index.faiss")),
+                docstore,
+                docstore.positions(),
+            )
+            _apply_search_params(vectorstore, db_path)
+            entry = {
+                "db_path": db_path,
+                "docstore": docstore,
+                "vectorstore": vectorstore,
+                "signature": signature,
+                "partitions": _load_partition_lookup(db_path),
+                "partition_stores": {},
+            }
+            _vectorstores[db_path] = entry
+
+        return entry
+
+
+def get_vectorstore(source: str = "text"):
+    return _get_entry(source)["vectorstore"]
+
+
+def _get_partition_store(entry, product: str):
+    embeddings = get_embeddings()
+    with _registry_lock:
+        if product not in entry["partition_stores"]:
+            partition_dir = os.path.join(entry["db_path"], entry["partitions"]["partitions"][product]["dir"])
+            entry["partition_stores"][product] = FAISS(
+                embeddings,
+                faiss.read_index(os.path.join(partition_dir, "index.faiss")),
+                entry["docstore"],
+                entry["docstore"].positions(product),
+            )
+        return entry["partition_stores"][product]
+
+
+def route_query(query: str, source: str = "text"):
+    """Products named in the query (brand word or configured alias), via the precomputed lookup.
+
+    A name that belongs to more than one product is ambiguous, so the query is
+    then searched in the global index instead (empty result).
+    """
+    lookup = _get_entry(source)["partitions"]
+    if not lookup:
+        return []
+    products = set()
+    for word in set(re.findall(r"[a-z]{3,}", query.lower())):
+        matches = lookup["aliases"].get(word, [])
+        if len(matches) > 1:
+            return []
+        products.update(matches)
+    return sorted(product for product in products if product in lookup["partitions"])
+
+
+def get_index_version(source: str = "text") -> str:
+    """Short fingerprint of the index(es) currently served; changes whenever one is rebuilt."""
+    sources = list(INDEX_PATHS) if source == "all" else [source]
+    signature = tuple(_get_entry(name)["signature"] for name in sources)
+    return hashlib.sha1(repr(signature).encode("utf-8")).hexdigest()[:16]
+
+
+_embed_calls = threading.local()
+
+
+@lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+def _embed_query_cached(query: str):
+    _embed_calls.miss = True
+    return tuple(get_embeddings().embed_query(query))
+
+
+def embed_query(query: str):
+    # Repeated questions (and the semantic cache + retrieval of the same query) cost one Titan call
+    with span("embed_query") as attrs:
+        _embed_calls.miss = False
+        embedding = list(_embed_query_cached(query))
+        attrs["cache_hit"] = not _embed_calls.miss
+        attrs["input_tokens"] = (len(query) + 3) // 4
+    return embedding
+
+
+def document_ids(documents):
+    return [f"{doc.metadata.get('file_name', doc.metadata.get('source', '?'))}#{doc.metadata.get('chunk_id', '?')}"
+            for doc in documents]
+
+
+def search_with_scores(source: str, query: str, embedding, k: int):
+    """(document, L2 distance) pairs from one source, routed to product partitions when possible."""
+    try:
+        return _search_with_scores(source, query, embedding, k)
+    except sqlite3.ProgrammingError:
+        # The index was swapped mid-search and its old docstore closed: search the new one
+        return _search_with_scores(source, query, embedding, k)
+
+
+def _search_with_scores(source: str, query: str, embedding, k: int):
+    # Resolve through the registry on every call so a rebuilt index is picked up
+    entry = _get_entry(source)
+
+    products = route_query(query, source)
+    with span("faiss_search", source=source, partitions=products) as attrs:
+        if products:
+            # Search only the partitions of the products named in the query
+            k = min(k, PARTITION_K)
+            scored = []
+            for product in products:
+                scored.extend(_get_partition_store(entry, product).similarity_search_with_score_by_vector(embedding, k=k))
+            scored.sort(key=lambda pair: pair[1])
+            scored = scored[:k]
         else:
-            return vectorstore.similarity_search(query=query, k=k)
+            scored = entry["vectorstore"].similarity_search_with_score_by_vector(embedding, k=k)
+        attrs["chunks"] = len(scored)
+    return scored
+
+
+def get_retriever(source: str = "text"):
+
+    def retriever(query: str, k: int = 10, embedding=None):
+        if embedding is None:
+            embedding = embed_query(query)
+        if source == "csv":
+            k = SOURCE_K["csv"]
+        return [doc for doc, _ in search_with_scores(source, query, embedding, k)]
+
+    def combined_retriever(query: str, k: int = 10, embedding=None):
+        # One query embedding, both indexes searched concurrently, merged by distance
+        if embedding is None:
+            embedding = embed_query(query)
+        futures = [
+            _search_pool.submit(in_context(search_with_scores), name, query, embedding, source_k)
+            for name, source_k in SOURCE_K.items()
+        ]
+        scored = [pair for future in futures for pair in future.result()]
+        scored.sort(key=lambda pair: pair[1])
+        return [doc for doc, _ in scored]
 
-    return retriever
\ No newline at end of file
+    return combined_retriever if source == "all" else retriever
@@ -0,0 +1,200 @@
+"""Headless HTTP query service around the RAG graph.
+
+Usage:
+    python server.py                      # http://0.0.0.0:8080
+    python server.py --port 9000 --max-concurrent 16
+
+Endpoints:
+    POST /query   {"query": "...", "source": "text" | "csv" | "all"}
+    GET  /health  liveness, always 200 while the process runs
+    GET  /ready   200 once the required indexes are loaded, 503 before (or if one failed to load);
+                  the body reports every index and which query sources can be served
+
+Indexes and compiled graphs are loaded once at startup and shared by all
+requests. At most MAX_CONCURRENT_QUERIES graphs run at a time and at most
+MAX_QUEUED_QUERIES wait for a slot; beyond that the service answers 429 with
+Retry-After instead of queueing without bound. Readiness only waits for the
+REQUIRED_INDEXES (the text index by default), so a deployment without a CSV
+index still becomes ready; queries for a source whose index is not loaded
+answer 503.
+"""
+import os
+import time
+import asyncio
+import argparse
+from aiohttp import web
+from dotenv import load_dotenv
+
+from db import init_db, save_conversation
+from telemetry import start_trace, span, save_trace
+from graph_builder import get_graph
+from retriever import INDEX_PATHS, get_vectorstore, get_index_version
+
+load_dotenv()
+
+# === Serving limits (overridable from .env or the command line) ===
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", "8"))
+MAX_QUEUED_QUERIES = int(os.getenv("MAX_QUEUED_QUERIES", "32"))
+QUERY_TIMEOUT_S = float(os.getenv("QUERY_TIMEOUT_S", "120"))
+RETRY_AFTER_S = 2
+# Comma-separated indexes that must load before /ready reports ready (any of INDEX_PATHS)
+REQUIRED_INDEXES = os.getenv("REQUIRED_INDEXES", "text")
+
+SOURCES = list(INDEX_PATHS) + ["all"]
+
+
+class QueryService:
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_QUERIES,
+                 max_queued: int = MAX_QUEUED_QUERIES, timeout_s: float = QUERY_TIMEOUT_S,
+                 required_indexes: str = REQUIRED_INDEXES):
+        self.required = [name.strip() for name in required_indexes.split(",") if name.strip()]
+        unknown = [name for name in self.required if name not in INDEX_PATHS]
+        if unknown:
+            raise ValueError(f"Unknown required index(es) {unknown}; expected some of {list(INDEX_PATHS)}")
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_concurrent + max_queued
+        self.timeout_s = timeout_s
+        self.pending = 0
+        self.index_state = {source: "loading" for source in INDEX_PATHS}
+        self.index_versions = {}
+        self.counters = {"served": 0, "rejected": 0, "timed_out": 0, "failed": 0}
+
+    async def load_indexes(self):
+        """Load every index and compile its graph in worker threads; readiness follows."""
+        for source in INDEX_PATHS:
+            try:
+                await asyncio.to_thread(get_vectorstore, source)
+                self.index_versions[source] = await asyncio.to_thread(get_index_version, source)
+                self.index_state[source] = "loaded"
+                print(f"✅ Loaded {source} index ({INDEX_PATHS[source]})")
+            except Exception as e:
+                self.index_state[source] = f"error: {e}"
+                print(f"❌ Failed to load {source} index: {e}")
+        for source in SOURCES:
+            await asyncio.to_thread(get_graph, source)
+
+    def source_ready(self, source: str) -> bool:
+        """Whether every index a query source searches is loaded ("all" needs both)."""
+        needed = list(INDEX_PATHS) if source == "all" else [source]
+        return all(self.index_state[name] == "loaded" for name in needed)
+
+    @property
+    def ready(self) -> bool:
+        return all(self.index_state[name] == "loaded" for name in self.required)
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def readiness(self, request: web.Request) -> web.Response:
+        body = {
+            "ready": self.ready,
+            "required": self.required,
+            "indexes": {source: {"state": state, "path": INDEX_PATHS[source],
+                                 "version": self.index_versions.get(source)}
+                        for source, state in self.index_state.items()},
+            "sources": {source: self.source_ready(source) for source in SOURCES},
+            "in_flight": min(self.pending, self.max_concurrent),
+            "queued": max(0, self.pending - self.max_concurrent),
+            **self.counters,
+        }
+        return web.json_response(body, status=200 if self.ready else 503)
+
+    async def query(self, request: web.Request) -> web.Response:
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.json_response({"error": "Body must be JSON"}, status=400)
+        query = str(payload.get("query", "")).strip()
+        source = payload.get("source", "text")
+        if not query:
+            return web.json_response({"error": "Missing 'query'"}, status=400)
+        if source not in SOURCES:
+            return web.json_response({"error": f"'source' must be one of {SOURCES}"}, status=400)
+        if not self.source_ready(source):
+            return web.json_response({"error": f"The index for '{source}' is not loaded"}, status=503,
+                                     headers={"Retry-After": str(RETRY_AFTER_S)})
+
+        # Backpressure: refuse instead of growing an unbounded queue
+        if self.pending >= self.max_pending:
+            self.counters["rejected"] += 1
+            return web.json_response({"error": "Too many concurrent queries"}, status=429,
+                                     headers={"Retry-After": str(RETRY_AFTER_S)})
+
+        self.pending += 1
+        start = time.perf_counter()
+        # Each request runs in its own task, so the trace is private to it
+        trace = start_trace()
+        try:
+            async with self.slots:
+                # Nodes are synchronous, so ainvoke runs them in worker threads (which see the trace).
+                # A timed-out graph keeps running in its thread until its current call returns.
+                with span("graph", source=source):
+                    result = await asyncio.wait_for(
+                        get_graph(source).ainvoke({"query": query}), timeout=self.timeout_s
+                    )
+        except asyncio.TimeoutError:
+            self.counters["timed_out"] += 1
+            return web.json_response({"error": f"Query timed out after {self.timeout_s:.0f}s"}, status=504)
+        except Exception as e:
+            self.counters["failed"] += 1
+            print(f"❌ Query failed: {e}")
+            return web.json_response({"error": str(e)}, status=500)
+        finally:
+            self.pending -= 1
+
+        answer = result.get("answer", "")
+        await asyncio.to_thread(save_conversation, query, answer, result.get("prompt", ""), trace.trace_id)
+        await asyncio.to_thread(save_trace, trace)
+        self.counters["served"] += 1
+        documents = result.get("documents", [])
+        return web.json_response({
+            "answer": answer,
+            "source": source,
+            "cache_hit": result.get("cache_hit", False),
+            "sql_lookup": result.get("sql_lookup", False),
+            "doc_ids": result.get("doc_ids", []),
+            "sources": [{"source": doc.metadata.get("source", "Unknown"), "page": doc.metadata.get("page", "?"),
+                         "csv_processed": doc.metadata.get("csv_processed", False)} for doc in documents],
+            "context_stats": result.get("context_stats", {}),
+            "query_id": trace.trace_id,
+            "timings_ms": trace.summary(),
+            "latency_s": round(time.perf_counter() - start, 3),
+        })
+
+
+def create_app(max_concurrent: int = MAX_CONCURRENT_QUERIES, max_queued: int = MAX_QUEUED_QUERIES,
+               timeout_s: float = QUERY_TIMEOUT_S, required_indexes: str = REQUIRED_INDEXES) -> web.Application:
+    init_db()
+    service = QueryService(max_concurrent, max_queued, timeout_s, required_indexes)
+    app = web.Application()
+    app.router.add_post("/query", service.query)
+    app.router.add_get("/health", service.health)
+    app.router.add_get("/ready", service.readiness)
+
+    async def start_loading(app):
+        # Serve /health and /ready immediately; /query answers 503 until loading finishes
+        app["index_loader"] = asyncio.create_task(service.load_indexes())
+
+    app.on_startup.append(start_loading)
+    app["service"] = service
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT_QUERIES)
+    parser.add_argument("--max-queued", type=int, default=MAX_QUEUED_QUERIES)
+    parser.add_argument("--timeout", type=float, default=QUERY_TIMEOUT_S, help="Per-query timeout in seconds")
+    parser.add_argument("--require", default=REQUIRED_INDEXES,
+                        help="Comma-separated indexes that must load before the service is ready, e.g. text,csv")
+    args = parser.parse_args()
+
+    web.run_app(create_app(args.max_concurrent, args.max_queued, args.timeout, args.require),
+                host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from collections.abc import Mapping
+from typing import Union
+from langchain.docstore.base import Docstore
+from langchain.schema import Document
+
+DOCSTORE_FILE = "docstore.sqlite"
+MAIN_INDEX = ""
+
+
+class SQLiteDocstore(Docstore):
+    """Read-only docstore over the docstore.sqlite written by ingestion.
+
+    Chunks are fetched by ID only when a search returns them, so startup cost
+    and memory do not depend on how much text the corpus holds.
+    """
+
+    def __init__(self, path: str):
+        uri = Path(path).absolute().as_uri() + "?mode=ro"
+        self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def search(self, search: str) -> Union[str, Document]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT page_content, metadata FROM docs WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def positions(self, index_name: str = MAIN_INDEX) -> "PositionMap":
+        return PositionMap(self, index_name)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class PositionMap(Mapping):
+    """Lazy FAISS position -> docstore ID mapping for one index (main or a partition)."""
+
+    def __init__(self, docstore: SQLiteDocstore, index_name: str):
+        self.docstore = docstore
+        self.index_name = index_name
+
+    def __getitem__(self, pos: int) -> str:
+        with self.docstore.lock:
+            row = self.docstore.conn.execute(
+                "SELECT doc_id FROM positions WHERE index_name = ? AND pos = ?", (self.index_name, int(pos))
+            ).fetchone()
+        if row is None:
+            raise KeyError(pos)
+        return row[0]
+
+    def __len__(self) -> int:
+        with self.docstore.lock:
+            return self.docstore.conn.execute(
+                "SELECT COUNT(*) FROM positions WHERE index_name = ?", (self.index_name,)
+            ).fetchone()[0]
+
+    def __iter__(self):
+        with self.docstore.lock:
+            rows = self.docstore.conn.execute(
+                "SELECT pos FROM positions WHERE index_name = ? ORDER BY pos", (self.index_name,)
+            ).fetchall()
+        return iter(row[0] for row in rows)
@@ -0,0 +1,191 @@
+"""Per-query timing spans with token, chunk and cache-hit attributes.
+
+A trace is started per query (or ingestion run) and made current through a
+context variable; `span()` blocks anywhere below it record into that trace,
+including from worker threads submitted with `in_context()`. Without a current
+trace spans are no-ops, so instrumented code runs unchanged elsewhere.
+
+Report:
+    python telemetry.py                          # conversations.db, all queries
+    python telemetry.py --since-hours 24
+    python telemetry.py --db ../Storing_in_vectorstore/ingestion_metrics.db
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import threading
+import contextvars
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from db import DB_NAME, get_writer
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    def __init__(self, trace_id: Optional[str] = None, kind: str = "query"):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.timestamp = datetime.now().isoformat()
+        self.spans: List[Dict] = []
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, start: float, duration_s: float, attrs: dict):
+        with self.lock:
+            self.spans.append({
+                "stage": stage,
+                "start_ms": round((start - self.started) * 1000, 3),
+                "duration_ms": round(duration_s * 1000, 3),
+                "attrs": attrs,
+            })
+
+    def summary(self) -> Dict[str, float]:
+        """Total milliseconds per stage, for logging."""
+        totals = {}
+        with self.lock:
+            for s in self.spans:
+                totals[s["stage"]] = totals.get(s["stage"], 0.0) + s["duration_ms"]
+        return totals
+
+
+def start_trace(trace_id: Optional[str] = None, kind: str = "query") -> Trace:
+    trace = Trace(trace_id, kind)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    """Time a block; the yielded dict can be filled with attributes (tokens, chunks, ...)."""
+    trace = _current_trace.get()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        if trace is not None:
+            trace.add(stage, start, time.perf_counter() - start, attrs)
+
+
+def record(stage: str, duration_s: float, **attrs):
+    """Add a span whose duration was measured elsewhere (e.g. in a worker process)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, time.perf_counter() - duration_s, duration_s, attrs)
+
+
+def in_context(fn):
+    """Wrap fn so it runs with the caller's trace when submitted to a thread pool."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def record_usage(attrs: dict, message, prompt_text: str, output_text: str):
+    """Token counts from Bedrock usage metadata when present, else the ~4 chars/token estimate."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    attrs["input_tokens"] = usage.get("input_tokens") or (len(prompt_text) + 3) // 4
+    attrs["output_tokens"] = usage.get("output_tokens") or (len(output_text) + 3) // 4
+    attrs["token_source"] = "bedrock" if usage else "estimate"
+
+
+def save_trace(trace: Trace, db_path: str = DB_NAME):
+    """Queue the trace's spans for the database's background writer."""
+    with trace.lock:
+        rows = [(trace.trace_id, trace.kind, s["stage"], s["start_ms"], s["duration_ms"],
+                 json.dumps(s["attrs"], default=str), trace.timestamp) for s in trace.spans]
+    writer = get_writer(db_path)
+    # Statements run in order on the writer's connection, so the table exists before the insert
+    writer.submit("""
+        CREATE TABLE IF NOT EXISTS spans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trace_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            start_ms REAL NOT NULL,
+            duration_ms REAL NOT NULL,
+            attrs TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        )
+    """)
+    writer.submit("CREATE INDEX IF NOT EXISTS idx_spans_trace ON spans (trace_id)")
+    writer.submit("CREATE INDEX IF NOT EXISTS idx_spans_timestamp ON spans (timestamp)")
+    writer.submit("""
+        INSERT INTO spans (trace_id, kind, stage, start_ms, duration_ms, attrs, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+
+
+def load_spans(db_path: str = DB_NAME, since_hours: Optional[float] = None, kind: Optional[str] = None):
+    if not os.path.exists(db_path):
+        return []
+    conn = sqlite3.connect(db_path)
+    # save_trace creates the table with the first spans; before that there is nothing to report
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'spans'").fetchone():
+        conn.close()
+        return []
+    sql = "SELECT trace_id, stage, duration_ms, attrs FROM spans WHERE 1 = 1"
+    params = []
+    if since_hours is not None:
+        sql += " AND timestamp >= ?"
+        params.append((datetime.now() - timedelta(hours=since_hours)).isoformat())
+    if kind is not None:
+        sql += " AND kind = ?"
+        params.append(kind)
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    return [(trace_id, stage, duration_ms, json.loads(attrs)) for trace_id, stage, duration_ms, attrs in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--since-hours", type=float)
+    parser.add_argument("--kind", choices=["query", "ingestion"])
+    args = parser.parse_args()
+
+    rows = load_spans(args.db, args.since_hours, args.kind)
+    if not rows:
+        print("No spans recorded yet.")
+        return
+
+    stages = {}
+    for _, stage, duration_ms, attrs in rows:
+        stages.setdefault(stage, []).append((duration_ms, attrs))
+
+    print(f"📊 {len({row[0] for row in rows})} traces, {len(rows)} spans from {args.db}")
+    print(f"{'stage':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'in tok':>9}{'out tok':>9}{'chunks':>8}{'hit %':>7}")
+    for stage, entries in sorted(stages.items()):
+        ms = np.array([duration for duration, _ in entries])
+
+        def mean_of(key):
+            values = [attrs[key] for _, attrs in entries if isinstance(attrs.get(key), (int, float))]
+            return f"{np.mean(values):.0f}" if values else "-"
+
+        hits = [bool(attrs["cache_hit"]) for _, attrs in entries if "cache_hit" in attrs]
+        hit_rate = f"{100 * np.mean(hits):.0f}" if hits else "-"
+        batched = [(attrs["cache_hits"], attrs["chunks"]) for _, attrs in entries if attrs.get("chunks") and "cache_hits" in attrs]
+        if batched:
+            # Batch-level stages count hits per chunk
+            hit_rate = f"{100 * sum(h for h, _ in batched) / sum(n for _, n in batched):.0f}"
+        print(f"{stage:<22}{len(ms):>7}{np.percentile(ms, 50):>10.1f}{np.percentile(ms, 95):>10.1f}"
+              f"{np.percentile(ms, 99):>10.1f}{mean_of('input_tokens'):>9}{mean_of('output_tokens'):>9}"
+              f"{mean_of('chunks'):>8}{hit_rate:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import json
+import sqlite3
+import tempfile
+import unittest
+
+from pk_lookup import CATALOG_TABLE, PRODUCTS_TABLE, PKTableStore, answer_pk_lookup
+
+
+def write_store(path: str):
+    """A pk_tables.sqlite with one healthy-subject Akynzeo table, as written by pk_tables.py."""
+    columns = ["Parameter", "Treatment A Day 1", "Treatment B Day 1"]
+    rows = [("Cmax (ng/mL)", "434", "512"), ("AUC0-inf (ng.h/mL)", "14401", "15830")]
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE t_akynzeo ("Parameter" TEXT, "Treatment A Day 1" TEXT, "Treatment B Day 1" TEXT)')
+    conn.executemany("INSERT INTO t_akynzeo VALUES (?, ?, ?)", rows)
+    conn.execute(f"CREATE TABLE {CATALOG_TABLE} (table_name TEXT PRIMARY KEY, source TEXT NOT NULL, "
+                 "file_name TEXT NOT NULL, product TEXT, source_file TEXT, page INTEGER, sha256 TEXT NOT NULL, "
+                 "columns TEXT NOT NULL, row_labels TEXT NOT NULL)")
+    conn.execute(f"INSERT INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                 ("t_akynzeo", "csv_files/table_1.csv", "table_1.csv", "akynzeo", "Akynzeo_EPAR.pdf", 12, "0",
+                  json.dumps(columns), json.dumps([row[0] for row in rows])))
+    conn.execute(f"CREATE TABLE {PRODUCTS_TABLE} (alias TEXT NOT NULL, product TEXT NOT NULL)")
+    conn.executemany(f"INSERT INTO {PRODUCTS_TABLE} VALUES (?, ?)",
+                     [("akynzeo", "akynzeo"), ("netupitant", "akynzeo")])
+    conn.commit()
+    conn.close()
+
+
+class PKLookupFallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "pk_tables.sqlite")
+        write_store(path)
+        self.store = PKTableStore(path)
+
+    def tearDown(self):
+        if self.store.conn is not None:
+            self.store.conn.close()
+        self.tmp.cleanup()
+
+    def test_plain_lookup_is_answered(self):
+        result = answer_pk_lookup("What is the Cmax of Akynzeo for Treatment A on Day 1?", self.store)
+        self.assertIsNotNone(result)
+        self.assertEqual([v["value"] for v in result["values"]], ["434"])
+        self.assertIn("Source: Akynzeo_EPAR.pdf, page 12", result["answer"])
+
+    def test_alias_and_parameter_suffix_are_answered(self):
+        result = answer_pk_lookup("What is the AUC0-inf of netupitant?", self.store)
+        self.assertIsNotNone(result)
+        self.assertEqual([v["value"] for v in result["values"]], ["14401", "15830"])
+
+    def test_population_qualifier_falls_back(self):
+        self.assertIsNone(answer_pk_lookup("AUC of Akynzeo in patients with severe hepatic impairment", self.store))
+
+    def test_fed_state_qualifier_falls_back(self):
+        self.assertIsNone(answer_pk_lookup("What is the Cmax of Akynzeo under fed conditions?", self.store))
+        self.assertIsNone(answer_pk_lookup("What is the Cmax of Akynzeo in the fed state?", self.store))
+
+    def test_threshold_question_falls_back(self):
+        self.assertIsNone(answer_pk_lookup("Did the Cmax of Akynzeo exceed 1000 ng/mL?", self.store))
+        self.assertIsNone(answer_pk_lookup("Is the Cmax of Akynzeo above 400 ng/mL for Treatment A?", self.store))
+
+    def test_comparison_question_falls_back(self):
+        self.assertIsNone(answer_pk_lookup("Was the AUC of Akynzeo higher for Treatment A than Treatment B?",
+                                           self.store))
+
+    def test_question_without_product_falls_back(self):
+        self.assertIsNone(answer_pk_lookup("What is the Cmax for Treatment A?", self.store))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+"""Micro-benchmark: batched CSV chunker vs the original row-by-row loop.
+
+Usage:
+    python bench_csv_chunker.py                      # synthetic PK tables
+    python bench_csv_chunker.py --csv-folder csv_files
+    python bench_csv_chunker.py --rows 20000 --repeat 3
+
+Synthetic tables mimic the output of Image_extraction/xlsx_to_csv.py:
+multi-level headers flattened with " - " and PK parameters as row labels.
+Both chunkers must produce identical chunks; the script exits non-zero otherwise.
+"""
+import os
+import time
+import random
+import argparse
+from typing import List
+
+from test import MAX_TOKENS, count_tokens, split_csv_by_tokens, list_files
+
+PARAMETERS = ["Cmax (ng/mL)", "Tmax (h)", "AUC0-inf (ng·h/mL)", "AUC0-t (ng·h/mL)", "t1/2 (h)", "CL/F (L/h)", "Vz/F (L)"]
+TREATMENTS = ["Treatment A", "Treatment B", "Treatment C"]
+DAYS = ["Day 1", "Day 5", "Day 14"]
+STATS = ["Mean", "SD", "CV%"]
+
+
+def synthetic_csv(rows: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    columns = [f"{t} - {d} - {s}" for t in TREATMENTS for d in DAYS for s in STATS]
+    lines = ["Parameter," + ",".join(columns)]
+    for i in range(rows):
+        label = f"{PARAMETERS[i % len(PARAMETERS)]} subject {i // len(PARAMETERS) + 1}"
+        values = [f"{rng.uniform(0.1, 5000):.2f}" if rng.random() > 0.05 else "nan" for _ in columns]
+        lines.append(label + "," + ",".join(values))
+    return "\n".join(lines)
+
+
+def legacy_split_csv_by_tokens(csv_text: str, max_tokens: int) -> List[str]:
+    """The original chunker: one tokenizer.encode per row and per header reuse."""
+    lines = csv_text.strip().splitlines()
+    header = lines[0]
+    rows = lines[1:]
+
+    chunks = []
+    current_chunk = [header]
+    current_token_count = count_tokens(header)
+
+    for row in rows:
+        row_token_count = count_tokens(row)
+        if current_token_count + row_token_count > max_tokens:
+            chunk_text = "\n".join(current_chunk) + "\n\nthis is a csv"
+            chunks.append(chunk_text)
+            current_chunk = [header, row]
+            current_token_count = count_tokens(header) + row_token_count
+        else:
+            current_chunk.append(row)
+            current_token_count += row_token_count
+
+    if len(current_chunk) > 1:
+        chunk_text = "\n".join(current_chunk) + "\n\nthis is a csv"
+        chunks.append(chunk_text)
+
+    return chunks
+
+
+def best_of(fn, text: str, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(text, MAX_TOKENS)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv-folder", help="Benchmark real CSVs instead of synthetic ones")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.csv_folder:
+        cases = []
+        for path in list_files(args.csv_folder, ".csv"):
+            with open(path, "r", encoding="utf-8") as f:
+                cases.append((os.path.basename(path), f.read().strip()))
+    else:
+        cases = [(f"synthetic {rows} rows", synthetic_csv(rows)) for rows in args.rows]
+
+    count_tokens("warm up")  # load the tokenizer outside the timings
+    mismatches = 0
+    print(f"{'case':<32}{'rows':>8}{'chunks':>8}{'legacy s':>12}{'batched s':>12}{'speedup':>10}")
+    for name, text in cases:
+        legacy_s, legacy_chunks = best_of(legacy_split_csv_by_tokens, text, args.repeat)
+        batched_s, batched_chunks = best_of(split_csv_by_tokens, text, args.repeat)
+        same = legacy_chunks == batched_chunks
+        mismatches += not same
+        print(f"{name[:31]:<32}{text.count(chr(10)):>8}{len(batched_chunks):>8}"
+              f"{legacy_s:>12.4f}{batched_s:>12.4f}{legacy_s / max(batched_s, 1e-9):>9.1f}x"
+              f"{'' if same else '  ❌ chunk boundaries differ'}")
+
+    if mismatches:
+        raise SystemExit(f"{mismatches} case(s) produced different chunks")
+
+
+if __name__ == "__main__":
+    main()
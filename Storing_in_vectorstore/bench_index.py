@@ -0,0 +1,109 @@
+"""Recall/latency benchmark of the configurable FAISS index types against exact flat search.
+
+Usage:
+    python bench_index.py --index faiss_db_text                  # vectors of a built index
+    python bench_index.py --embedding-cache embedding_cache.db   # every vector ever embedded
+    python bench_index.py --synthetic 200000                     # clustered random vectors
+    python bench_index.py --index faiss_db_text --query-vectors queries.npy
+
+Queries are held out from the corpus (or loaded from a .npy file of embedded
+questions) and never added to the indexes. For every corpus size, each index
+type is built with the parameters from index_factory.INDEX_CONFIG (.env) and
+compared against the flat index on recall@k and p50/p99 single-query latency.
+"""
+import time
+import sqlite3
+import argparse
+
+import faiss
+import numpy as np
+
+from index_factory import INDEX_CONFIG, build_faiss_index, reconstruct_vectors
+
+
+def load_index_vectors(index_dir: str) -> np.ndarray:
+    index = faiss.read_index(f"{index_dir}/index.faiss")
+    return reconstruct_vectors(index, list(range(index.ntotal)))
+
+
+def load_cache_vectors(db_path: str) -> np.ndarray:
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT vector FROM embeddings").fetchall()
+    conn.close()
+    return np.vstack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+
+
+def synthetic_vectors(n: int, dim: int = 1024, clusters: int = 200, seed: int = 0) -> np.ndarray:
+    # Clustered data behaves more like real embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def timed_search(index, queries: np.ndarray, k: int):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies) * 1000
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--index", help="Directory of a built FAISS index")
+    source.add_argument("--embedding-cache", help="embedding_cache.db from ingestion")
+    source.add_argument("--synthetic", type=int, help="Number of synthetic vectors")
+    parser.add_argument("--query-vectors", help=".npy file of held-out query embeddings")
+    parser.add_argument("--queries", type=int, default=200, help="Held-out corpus vectors used as queries")
+    parser.add_argument("--sizes", type=int, nargs="+", help="Corpus sizes to test (default: 10%%, 50%%, 100%%)")
+    parser.add_argument("--types", nargs="+", default=["ivf", "hnsw"])
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.index:
+        vectors = load_index_vectors(args.index)
+    elif args.embedding_cache:
+        vectors = load_cache_vectors(args.embedding_cache)
+    else:
+        vectors = synthetic_vectors(args.synthetic)
+
+    rng = np.random.default_rng(0)
+    vectors = vectors[rng.permutation(len(vectors))].astype(np.float32)
+    if args.query_vectors:
+        queries = np.load(args.query_vectors).astype(np.float32)
+    else:
+        queries, vectors = vectors[:args.queries], vectors[args.queries:]
+
+    sizes = args.sizes or sorted({max(args.k, len(vectors) // 10), max(args.k, len(vectors) // 2), len(vectors)})
+    print(f"{len(vectors)} corpus vectors, {len(queries)} queries, dim {vectors.shape[1]}, k={args.k}")
+    print(f"{'size':>9} {'type':<6}{'build s':>9}{'MB':>9}{'recall@k':>10}{'p50 ms':>9}{'p99 ms':>9}")
+
+    for size in sizes:
+        base = vectors[:size]
+        flat = build_faiss_index(base, {**INDEX_CONFIG, "type": "flat"})
+        truth, flat_ms = timed_search(flat, queries, args.k)
+        flat_mb = len(faiss.serialize_index(flat)) / 1e6
+        print(f"{size:>9} {'flat':<6}{0:>9.2f}{flat_mb:>9.1f}{1.0:>10.3f}"
+              f"{np.percentile(flat_ms, 50):>9.3f}{np.percentile(flat_ms, 99):>9.3f}")
+
+        for index_type in args.types:
+            start = time.perf_counter()
+            index = build_faiss_index(base, {**INDEX_CONFIG, "type": index_type})
+            build_s = time.perf_counter() - start
+            found, ms = timed_search(index, queries, args.k)
+            mb = len(faiss.serialize_index(index)) / 1e6
+            print(f"{size:>9} {index_type:<6}{build_s:>9.2f}{mb:>9.1f}{recall_at_k(found, truth):>10.3f}"
+                  f"{np.percentile(ms, 50):>9.3f}{np.percentile(ms, 99):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Offline end-to-end benchmark: ingestion throughput and per-stage query latency.
+
+Usage:
+    python bench_pipeline.py                                  # 20 PDFs x 30 pages, 20 CSVs
+    python bench_pipeline.py --pdfs 100 --pages 50 --csvs 100
+    python bench_pipeline.py --embed-latency 0.2 --throttle-rate 0.05
+    python bench_pipeline.py --min-pages-per-s 20 --max-query-p95-ms 500   # CI gate
+
+Builds a synthetic corpus (PK-style PDF pages and tables) in a scratch folder,
+ingests it with MODEL_PROVIDER=fake (hash embeddings, canned LLM, no network)
+and reports pages/s and chunks/s per index. The query stages are then timed by
+Rag/bench_query.py on the freshly built indexes, in a separate process because
+both folders have a sqlite_docstore module.
+CSV ingestion needs the bert-base-uncased tokenizer; it is skipped when that
+cannot be loaded. Exits non-zero when a threshold is missed.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+PRODUCTS = ["Akynzeo", "Netupitant", "Palonosetron", "Aloxi", "Emend", "Zofran", "Kytril", "Sancuso"]
+SENTENCES = [
+    "The mean Cmax of {p} was {v} ng/mL after a single oral dose.",
+    "Tmax was reached {h} hours after administration of {p}.",
+    "The terminal half-life of {p} was approximately {h} hours.",
+    "Exposure (AUC) increased by {pct}% in patients with moderate hepatic impairment.",
+    "The most common adverse reactions were headache, constipation and fatigue.",
+    "Each capsule contains {v} mg of {p} and excipients including sorbitol.",
+    "No dose adjustment is necessary in patients with mild renal impairment.",
+]
+
+
+def synthetic_page(rng: random.Random, product: str, lines: int = 40) -> str:
+    return "\n".join(
+        rng.choice(SENTENCES).format(p=product, v=round(rng.uniform(1, 900), 1),
+                                     h=rng.randint(1, 96), pct=rng.randint(5, 80))
+        for _ in range(lines)
+    )
+
+
+def write_synthetic_pdfs(folder: str, count: int, pages: int, seed: int = 0):
+    import fitz
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        product = PRODUCTS[i % len(PRODUCTS)]
+        doc = fitz.open()
+        for _ in range(pages):
+            doc.new_page().insert_text((40, 50), synthetic_page(rng, product), fontsize=8)
+        doc.save(os.path.join(folder, f"{product}_EPAR_{i:04d}.pdf"))
+        doc.close()
+
+
+def write_synthetic_csvs(folder: str, count: int, rows: int):
+    from bench_csv_chunker import synthetic_csv
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(folder, f"{PRODUCTS[i % len(PRODUCTS)]}_table_{i:04d}.csv"), "w", encoding="utf-8") as f:
+            f.write(synthetic_csv(rows, seed=i))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=30, help="Pages per PDF")
+    parser.add_argument("--csvs", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=60, help="Rows per CSV")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent embedding calls")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="Fake embedding latency per call (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Fake LLM latency per call (s)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of fake embedding calls that throttle")
+    parser.add_argument("--workdir", help="Keep the corpus and indexes here (default: a temp folder)")
+    parser.add_argument("--min-pages-per-s", type=float)
+    parser.add_argument("--min-chunks-per-s", type=float)
+    parser.add_argument("--max-query-p95-ms", type=float)
+    args = parser.parse_args()
+
+    # The providers read these when test.py (and through it the Rag modules) is imported
+    os.environ.update({
+        "MODEL_PROVIDER": "fake",
+        "FAKE_EMBED_LATENCY_S": str(args.embed_latency),
+        "FAKE_LLM_LATENCY_S": str(args.llm_latency),
+        "FAKE_THROTTLE_RATE": str(args.throttle_rate),
+    })
+    from test import (RAG_DIR, EmbeddingGenerator, IncrementalIndexer, get_embedding_model, get_tokenizer,
+                      iter_pdf_documents, iter_csv_documents, list_files)
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="rag_bench_"))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    print(f"📂 Working in {workdir}")
+
+    write_synthetic_pdfs("Data", args.pdfs, args.pages)
+    csv_enabled = args.csvs > 0
+    if csv_enabled:
+        try:
+            get_tokenizer()
+        except Exception as e:
+            print(f"⚠️ Skipping CSV ingestion, tokenizer unavailable: {e}")
+            csv_enabled = False
+    if csv_enabled:
+        write_synthetic_csvs("csv_files", args.csvs, args.rows)
+
+    embedder = get_embedding_model()
+    runs = [("faiss_db_text", "Data", ".pdf", iter_pdf_documents, args.pdfs * args.pages)]
+    if csv_enabled:
+        runs.append(("faiss_db_csv", "csv_files", ".csv", iter_csv_documents, None))
+
+    failures = []
+    print(f"\n{'index':<16}{'files':>7}{'pages':>8}{'chunks':>8}{'s':>8}{'pages/s':>10}{'chunks/s':>10}{'retries':>9}")
+    for index_dir, folder, ext, iter_docs, pages in runs:
+        generator = EmbeddingGenerator(embedder, max_workers=args.workers)
+        indexer = IncrementalIndexer(index_dir, embedder, generator, iter_docs=iter_docs, full_rebuild=True)
+        paths = list_files(folder, ext)
+        start = time.perf_counter()
+        indexer.sync(paths)
+        elapsed = time.perf_counter() - start
+        metrics = generator.metrics()
+        chunks_per_s = metrics["docs"] / elapsed
+        pages_per_s = pages / elapsed if pages else None
+        print(f"{index_dir:<16}{len(paths):>7}{pages or '-':>8}{metrics['docs']:>8}{elapsed:>8.2f}"
+              f"{pages_per_s or 0:>10.1f}{chunks_per_s:>10.1f}{metrics['retries']:>9}")
+        if pages and args.min_pages_per_s is not None and pages_per_s < args.min_pages_per_s:
+            failures.append(f"{index_dir}: {pages_per_s:.1f} pages/s < {args.min_pages_per_s}")
+        if args.min_chunks_per_s is not None and chunks_per_s < args.min_chunks_per_s:
+            failures.append(f"{index_dir}: {chunks_per_s:.1f} chunks/s < {args.min_chunks_per_s}")
+
+    query_cmd = [sys.executable, os.path.join(RAG_DIR, "bench_query.py"), "--fake",
+                 "--source", "all" if csv_enabled else "text", "--queries", str(args.queries)]
+    if args.max_query_p95_ms is not None:
+        query_cmd += ["--max-p95-ms", str(args.max_query_p95_ms)]
+    # Throttling is injected into ingestion only; the query path has no retry layer to exercise
+    query_env = {**os.environ, "FAKE_THROTTLE_RATE": "0"}
+    if subprocess.run(query_cmd, cwd=workdir, env=query_env).returncode != 0:
+        failures.append("query latency threshold exceeded")
+
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if failures:
+        raise SystemExit("❌ " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+EMBEDDING_CACHE_DB = "embedding_cache.db"
+
+
+class EmbeddingCache:
+    """Persistent, content-addressed store of embeddings.
+
+    Vectors are keyed by sha256(model_id + chunk text), so an unchanged chunk is
+    never sent to Bedrock twice, whatever file or position it comes from.
+    """
+
+    def __init__(self, model_id: str, db_path: str = EMBEDDING_CACHE_DB):
+        self.model_id = model_id
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model_id TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_id}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return [found.get(key) for key in keys]
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        rows = [
+            (self.key(text), self.model_id, len(vector), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model_id, dim, vector) VALUES (?, ?, ?, ?)", rows
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+from typing import List, Optional
+
+import faiss
+import numpy as np
+from langchain.vectorstores.faiss import FAISS
+from langchain.docstore.in_memory import InMemoryDocstore
+
+RAG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Rag")
+# Search parameters are applied by the RAG app as well, from the same module
+if RAG_DIR not in sys.path:
+    sys.path.append(RAG_DIR)
+from index_params import INDEX_CONFIG_FILE, build_params, apply_search_params
+
+# === Index type and parameters (overridable from .env) ===
+# flat: exact brute-force L2 (LangChain default)
+# ivf:  inverted lists, searches nprobe of nlist clusters
+# hnsw: graph index, ef_search trades recall for speed
+INDEX_CONFIG = {
+    "type": os.getenv("FAISS_INDEX_TYPE", "flat"),
+    "ivf_nlist": int(os.getenv("FAISS_IVF_NLIST", "256")),
+    "ivf_nprobe": int(os.getenv("FAISS_IVF_NPROBE", "16")),
+    "hnsw_m": int(os.getenv("FAISS_HNSW_M", "32")),
+    "hnsw_ef_construction": int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200")),
+    "hnsw_ef_search": int(os.getenv("FAISS_HNSW_EF_SEARCH", "64")),
+}
+
+# FAISS recommends at least ~39 training points per IVF centroid
+IVF_POINTS_PER_LIST = 39
+
+
+def training_size(config: dict = INDEX_CONFIG) -> int:
+    """Vectors to collect before the index can be trained (0 if it needs no training)."""
+    return config["ivf_nlist"] * IVF_POINTS_PER_LIST if config["type"] == "ivf" else 0
+
+
+def new_index(dim: int, config: dict = INDEX_CONFIG, n_train: Optional[int] = None):
+    index_type = config["type"]
+    if index_type == "ivf":
+        nlist = config["ivf_nlist"]
+        if n_train is not None:
+            # Small corpora cannot fill the configured number of lists
+            nlist = max(1, min(nlist, n_train // IVF_POINTS_PER_LIST))
+        return faiss.index_factory(dim, f"IVF{nlist},Flat")
+    if index_type == "hnsw":
+        index = faiss.index_factory(dim, f"HNSW{config['hnsw_m']},Flat")
+        index.hnsw.efConstruction = config["hnsw_ef_construction"]
+        return index
+    if index_type != "flat":
+        raise ValueError(f"Unknown FAISS index type: {index_type}")
+    return faiss.IndexFlatL2(dim)
+
+
+def ivf_outgrown(index, config: dict = INDEX_CONFIG) -> bool:
+    """Whether an IVF index trained with a shrunken nlist now holds enough vectors for twice as many lists.
+
+    new_index shrinks nlist to fit a small first corpus; incremental adds never
+    revisit it, so the lists grow long and recall and latency degrade. The
+    trained nlist is read from the index itself. Retraining once the corpus
+    supports double (or the configured) nlist keeps retrains logarithmic in growth.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if config["type"] != "ivf" or ivf is None or ivf.nlist >= config["ivf_nlist"]:
+        return False
+    supported = min(config["ivf_nlist"], index.ntotal // IVF_POINTS_PER_LIST)
+    return supported >= min(config["ivf_nlist"], 2 * ivf.nlist)
+
+
+def build_faiss_index(vectors: np.ndarray, config: dict = INDEX_CONFIG):
+    """Train (if needed) and fill an index of the configured type; used by ingestion and the benchmark."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = new_index(vectors.shape[1], config, n_train=len(vectors))
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    apply_search_params(index, config)
+    return index
+
+
+def empty_vectorstore(embedder, dim: int, config: dict = INDEX_CONFIG) -> FAISS:
+    return FAISS(embedder, new_index(dim, config), InMemoryDocstore(), {})
+
+
+def train_vectorstore(vectorstore: FAISS, vectors: List[List[float]], config: dict = INDEX_CONFIG):
+    """Train an empty IVF vectorstore on a sample, shrinking nlist for small corpora."""
+    sample = np.asarray(vectors, dtype=np.float32)
+    vectorstore.index = new_index(sample.shape[1], config, n_train=len(sample))
+    vectorstore.index.train(sample)
+    apply_search_params(vectorstore.index, config)
+
+
+def reconstruct_vectors(index, positions: List[int]) -> np.ndarray:
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # IVF lists are not addressable by position without a direct map
+        ivf.make_direct_map()
+    return np.vstack([index.reconstruct(int(pos)) for pos in positions])
+
+
+def rebuild_vectorstore(vectorstore: FAISS, embedder, exclude_ids=(), config: dict = INDEX_CONFIG) -> FAISS:
+    """Rebuild from the vectors already stored, dropping exclude_ids; needs no embedding calls.
+
+    Used to delete from IVF/HNSW indexes (which cannot remove vectors in
+    place) and to switch an existing index to another type.
+    """
+    exclude_ids = set(exclude_ids)
+    kept = [(pos, doc_id) for pos, doc_id in sorted(vectorstore.index_to_docstore_id.items())
+            if doc_id not in exclude_ids]
+    if not kept:
+        return empty_vectorstore(embedder, vectorstore.index.d, config)
+
+    vectors = reconstruct_vectors(vectorstore.index, [pos for pos, _ in kept])
+    docs = [vectorstore.docstore.search(doc_id) for _, doc_id in kept]
+    rebuilt = FAISS(embedder, build_faiss_index(vectors, config), InMemoryDocstore(), {})
+    rebuilt.docstore.add({doc_id: doc for (_, doc_id), doc in zip(kept, docs)})
+    rebuilt.index_to_docstore_id = {i: doc_id for i, (_, doc_id) in enumerate(kept)}
+    return rebuilt
+
+
+def write_index_config(out_dir: str, config: dict = INDEX_CONFIG):
+    with open(os.path.join(out_dir, INDEX_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+
+def read_index_config(index_dir: str) -> dict:
+    path = os.path.join(index_dir, INDEX_CONFIG_FILE)
+    if not os.path.exists(path):
+        # Indexes built before index types were configurable are flat
+        return {**INDEX_CONFIG, "type": "flat"}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import shutil
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+import faiss
+
+from index_factory import INDEX_CONFIG, build_faiss_index, reconstruct_vectors
+
+PARTITIONS_DIR = "partitions"
+PARTITIONS_FILE = "partitions.json"
+
+# File-name words that never identify a product
+NAME_STOPWORDS = {
+    "epar", "public", "assessment", "report", "annex", "product", "information", "summary",
+    "scientific", "discussion", "procedural", "steps", "taken", "authorisation", "variation",
+    "ema", "chmp", "pdf", "csv", "the", "and", "for", "with", "final", "version", "images", "batch",
+    "table", "tables",
+}
+# Optional extra names per product key, e.g. {"akynzeo": ["netupitant", "palonosetron"]}
+PRODUCT_ALIASES_FILE = os.getenv("PRODUCT_ALIASES_FILE", "product_aliases.json")
+CSV_SOURCES_FILE = "csv_sources.json"   # Written by Image_extraction/xlsx_to_csv.py next to the CSVs
+
+
+def name_tokens(file_name: str) -> List[str]:
+    stem = os.path.splitext(file_name)[0].lower()
+    return [token for token in re.findall(r"[a-z]{3,}", stem) if token not in NAME_STOPWORDS]
+
+
+def product_key(file_name: str) -> str:
+    """Partition key of a source file: its first meaningful name word, e.g. Akynzeo_EPAR.pdf -> akynzeo."""
+    tokens = name_tokens(file_name)
+    if tokens:
+        return tokens[0]
+    return re.sub(r"[^a-z0-9]+", "_", os.path.splitext(file_name)[0].lower()).strip("_") or "other"
+
+
+def load_product_aliases(path: str = PRODUCT_ALIASES_FILE) -> Dict[str, List[str]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return {product.lower(): [alias.lower() for alias in aliases] for product, aliases in json.load(f).items()}
+
+
+def read_csv_origins(csv_paths: Iterable[str]) -> Dict[str, dict]:
+    """CSV path -> {"source_file", "page"} from the csv_sources.json of each CSV folder."""
+    origins = {}
+    for folder in sorted({os.path.dirname(path) for path in csv_paths}):
+        sources_path = os.path.join(folder, CSV_SOURCES_FILE)
+        if not os.path.exists(sources_path):
+            continue
+        with open(sources_path, "r", encoding="utf-8") as f:
+            for name, record in json.load(f).items():
+                if isinstance(record, dict) and record.get("source_file"):
+                    origins[os.path.join(folder, name)] = record
+    return origins
+
+
+def partition_keys(paths: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Product of every source file, or None for files that belong to no product.
+
+    Converted tables are named table_<hash>.csv, so they take the product of the
+    PDF they were extracted from (csv_sources.json); one whose origin was not
+    recorded stays in the global index only. Other files use their own name.
+    """
+    paths = list(paths)
+    origins = read_csv_origins(paths)
+    keys = {}
+    for path in paths:
+        file_name = os.path.basename(path)
+        if path in origins:
+            keys[path] = product_key(origins[path]["source_file"])
+        elif file_name.startswith("table_") and file_name.endswith(".csv"):
+            keys[path] = None
+        else:
+            keys[path] = product_key(file_name)
+    return keys
+
+
+def _live_assignment(live_dir: str) -> Optional[Dict[str, str]]:
+    """file name -> product of the partitions saved in live_dir, or None if there are none."""
+    path = os.path.join(live_dir, PARTITIONS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        partitions = json.load(f)["partitions"]
+    return {file_name: product for product, entry in partitions.items() for file_name in entry["file_names"]}
+
+
+def partitions_current(files: Dict[str, dict], live_dir: str) -> bool:
+    """Whether the partitions in live_dir still group files by their current product.
+
+    A converted table whose origin is recorded after it was indexed moves to
+    another partition without the CSV itself changing.
+    """
+    live = _live_assignment(live_dir)
+    if live is None:
+        return False
+    current = {os.path.basename(path): product for path, product in partition_keys(files).items()
+               if product is not None and files[path]["chunk_ids"]}
+    return current == live
+
+
+def write_partitions(vectorstore, files: Dict[str, dict], out_dir: str,
+                     live_dir: str, changed_paths: Iterable[str]) -> Dict[str, List[str]]:
+    """Write one sub-index per product under out_dir/partitions plus the routing lookup.
+
+    Sub-indexes are built from vectors already in the main index (no embedding
+    calls); partitions whose files did not change are copied from live_dir.
+    Returns the chunk ID at each position of every partition index, for the docstore.
+    """
+    keys = partition_keys(files)
+    groups = defaultdict(list)
+    for path in sorted(files):
+        if keys[path] is not None:
+            groups[keys[path]].append(path)
+    # A changed file invalidates the partition it is in now and the one it was in before
+    changed_paths = list(changed_paths)
+    live = _live_assignment(live_dir) or {}
+    changed_products = {keys[path] for path in changed_paths if keys.get(path) is not None}
+    changed_products |= {live[os.path.basename(path)] for path in changed_paths if os.path.basename(path) in live}
+
+    id_to_position = {doc_id: pos for pos, doc_id in vectorstore.index_to_docstore_id.items()}
+    partitions = {}
+    partition_ids = {}
+    for product, paths in groups.items():
+        partition_dir = os.path.join(out_dir, PARTITIONS_DIR, product)
+        live_partition_dir = os.path.join(live_dir, PARTITIONS_DIR, product)
+        chunk_ids = [chunk_id for path in paths for chunk_id in files[path]["chunk_ids"] if chunk_id in id_to_position]
+        if not chunk_ids:
+            continue
+
+        if product not in changed_products and os.path.exists(live_partition_dir):
+            shutil.copytree(live_partition_dir, partition_dir)
+        else:
+            # Partitions are small, so they always use an exact flat index
+            vectors = reconstruct_vectors(vectorstore.index, [id_to_position[chunk_id] for chunk_id in chunk_ids])
+            os.makedirs(partition_dir, exist_ok=True)
+            faiss.write_index(
+                build_faiss_index(vectors, {**INDEX_CONFIG, "type": "flat"}),
+                os.path.join(partition_dir, "index.faiss"),
+            )
+
+        partition_ids[product] = chunk_ids
+        partitions[product] = {
+            "dir": f"{PARTITIONS_DIR}/{product}",
+            "file_names": [os.path.basename(path) for path in paths],
+            "chunks": len(chunk_ids),
+        }
+
+    # Only the product key (the brand word of the source PDF name) and explicitly configured names
+    # route to a partition; other file-name words are shared by too many documents to identify a product
+    aliases = defaultdict(set)
+    for product, extra in load_product_aliases().items():
+        if product in partitions:
+            for alias in extra:
+                aliases[alias].add(product)
+    for product in partitions:
+        aliases[product] = {product}
+    aliases = {alias: sorted(products) for alias, products in aliases.items()}
+
+    with open(os.path.join(out_dir, PARTITIONS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"partitions": partitions, "aliases": aliases}, f, indent=2)
+
+    return partition_ids
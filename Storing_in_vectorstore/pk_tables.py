@@ -0,0 +1,126 @@
+import os
+import re
+import json
+import sqlite3
+import hashlib
+from typing import Dict, Iterable, List
+
+import pandas as pd
+
+from partitions import CSV_SOURCES_FILE, load_product_aliases, partition_keys, read_csv_origins
+
+# Structured copy of csv_files for exact parameter/value lookups in the RAG app
+PK_TABLES_DB = "pk_tables.sqlite"
+CATALOG_TABLE = "pk_catalog"
+SOURCES_TABLE = "pk_sources"     # Every input file and its hash, including CSVs without a usable table
+PRODUCTS_TABLE = "pk_products"   # Names a question may use for each product (product keys and aliases)
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def table_name_for(csv_path: str, taken: set) -> str:
+    base = "t_" + re.sub(r"\W+", "_", os.path.splitext(os.path.basename(csv_path))[0]).strip("_").lower()
+    name, suffix = base, 2
+    while name in taken:
+        name, suffix = f"{base}_{suffix}", suffix + 1
+    taken.add(name)
+    return name
+
+
+def unique_columns(columns: List[str]) -> List[str]:
+    """Header text as column names (already flattened by xlsx_to_csv), made unique and non-empty."""
+    seen, result = {}, []
+    for position, column in enumerate(columns):
+        name = str(column).strip() or f"Column {position + 1}"
+        if name.startswith("Unnamed:"):
+            name = f"Column {position + 1}"
+        seen[name] = seen.get(name, 0) + 1
+        result.append(name if seen[name] == 1 else f"{name} ({seen[name]})")
+    return result
+
+
+def write_pk_tables(csv_paths: Iterable[str], db_path: str = PK_TABLES_DB) -> Dict[str, int]:
+    """Load every CSV into its own SQLite table plus a catalog of tables, columns and row labels.
+
+    Cells are stored as the exact text of the CSV, so lookups return values with
+    their original precision. Each table is labelled with the product and
+    source PDF page it was extracted from (csv_sources.json); CSVs placed by
+    hand take their product from the file name. The store is rebuilt next to
+    the live one and swapped in, and only when a CSV, its recorded origin or
+    the product aliases changed.
+    """
+    csv_paths = list(csv_paths)
+    hashes = {path: _file_sha256(path) for path in csv_paths}
+    for folder in sorted({os.path.dirname(path) for path in csv_paths}):
+        sources_path = os.path.join(folder, CSV_SOURCES_FILE)
+        if os.path.exists(sources_path):
+            hashes[sources_path] = _file_sha256(sources_path)
+    product_aliases = load_product_aliases()
+    hashes["product_aliases"] = hashlib.sha256(json.dumps(product_aliases, sort_keys=True).encode()).hexdigest()
+    origins = read_csv_origins(csv_paths)
+    # Same product assignment as the index partitions
+    products_by_path = partition_keys(csv_paths)
+    if os.path.exists(db_path) and read_catalog(db_path) == hashes:
+        print(f"✅ {db_path} is up to date ({len(csv_paths)} CSVs)")
+        return {"csvs": len(csv_paths), "rebuilt": 0}
+
+    tmp_path = f"{db_path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute(f"CREATE TABLE {SOURCES_TABLE} (source TEXT PRIMARY KEY, sha256 TEXT NOT NULL)")
+    conn.executemany(f"INSERT INTO {SOURCES_TABLE} (source, sha256) VALUES (?, ?)", hashes.items())
+    conn.execute(f"""
+        CREATE TABLE {CATALOG_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            product TEXT,
+            source_file TEXT,
+            page INTEGER,
+            sha256 TEXT NOT NULL,
+            columns TEXT NOT NULL,
+            row_labels TEXT NOT NULL
+        )
+    """)
+
+    taken, products, total_rows = set(), set(), 0
+    for path in csv_paths:
+        try:
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        except Exception as e:
+            print(f"⚠️ Skipping {os.path.basename(path)} for the PK store: {e}")
+            continue
+        if df.shape[1] < 2:
+            continue  # Needs a row label column and at least one value column
+        df.columns = unique_columns(list(df.columns))
+        name = table_name_for(path, taken)
+        origin = origins.get(path, {})
+        product = products_by_path[path]
+        if product:
+            products.add(product)
+        df.to_sql(name, conn, index=False)
+        conn.execute(
+            f"INSERT INTO {CATALOG_TABLE} (table_name, source, file_name, product, source_file, page, sha256, "
+            "columns, row_labels) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, path, os.path.basename(path), product, origin.get("source_file"), origin.get("page"),
+             hashes[path], json.dumps(list(df.columns), ensure_ascii=False),
+             json.dumps(df.iloc[:, 0].tolist(), ensure_ascii=False)),
+        )
+        total_rows += len(df)
+
+    # A product is matched by its key or any configured alias (same aliases as the index partitions)
+    conn.execute(f"CREATE TABLE {PRODUCTS_TABLE} (alias TEXT NOT NULL, product TEXT NOT NULL)")
+    aliases = {(product, product) for product in products}
+    aliases |= {(alias, product) for product, extra in product_aliases.items()
+                if product in products for alias in extra}
+    conn.executemany(f"INSERT INTO {PRODUCTS_TABLE} (alias, product) VALUES (?, ?)", sorted(aliases))
+    conn.commit()
+    conn.close()
+
+    os.replace(tmp_path, db_path)
+    print(f"🗄️ Loaded {len(taken)} tables ({total_rows} rows, {len(products)} products) into {db_path}")
+    return {"csvs": len(csv_paths), "tables": len(taken), "rows": total_rows, "products": len(products), "rebuilt": 1}
@@ -0,0 +1,45 @@
+import os
+import json
+import sqlite3
+from typing import Dict, List
+
+DOCSTORE_FILE = "docstore.sqlite"
+MAIN_INDEX = ""
+
+
+def write_sqlite_docstore(out_dir: str, vectorstore, partition_ids: Dict[str, List[str]]):
+    """Write chunk text/metadata by ID and the position -> ID map of every index in out_dir.
+
+    The RAG app reads this lazily (only the top-k hits of each query) instead of
+    unpickling the whole in-memory docstore at startup.
+    """
+    conn = sqlite3.connect(os.path.join(out_dir, DOCSTORE_FILE))
+    conn.execute("""
+        CREATE TABLE docs (
+            id TEXT PRIMARY KEY,
+            page_content TEXT NOT NULL,
+            metadata TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE positions (
+            index_name TEXT NOT NULL,
+            pos INTEGER NOT NULL,
+            doc_id TEXT NOT NULL,
+            PRIMARY KEY (index_name, pos)
+        )
+    """)
+
+    doc_rows = []
+    for _, doc_id in sorted(vectorstore.index_to_docstore_id.items()):
+        doc = vectorstore.docstore.search(doc_id)
+        doc_rows.append((doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)))
+    conn.executemany("INSERT INTO docs (id, page_content, metadata) VALUES (?, ?, ?)", doc_rows)
+
+    position_rows = [(MAIN_INDEX, pos, doc_id) for pos, doc_id in vectorstore.index_to_docstore_id.items()]
+    for partition, ids in partition_ids.items():
+        position_rows.extend((partition, pos, doc_id) for pos, doc_id in enumerate(ids))
+    conn.executemany("INSERT INTO positions (index_name, pos, doc_id) VALUES (?, ?, ?)", position_rows)
+
+    conn.commit()
+    conn.close()
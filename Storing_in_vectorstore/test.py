@@ -1,102 +1,268 @@
 import os
+import sys
+import json
+import hashlib
 import datetime
 import shutil
+import time
+import random
+import argparse
+import itertools
 import pandas as pd
 import fitz  # PyMuPDF
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from threading import Lock
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from bisect import bisect_right
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from dotenv import load_dotenv
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores.faiss import FAISS
-from langchain.embeddings import  BedrockEmbeddings
+
+from embedding_cache import EmbeddingCache
+from partitions import write_partitions, partitions_current, PARTITIONS_FILE
+from sqlite_docstore import write_sqlite_docstore, DOCSTORE_FILE
+from pk_tables import write_pk_tables
+from index_factory import (
+    INDEX_CONFIG, training_size, empty_vectorstore, train_vectorstore, rebuild_vectorstore, ivf_outgrown,
+    write_index_config, read_index_config, build_params,
+)
 
 # === ENVIRONMENT SETUP ===
 load_dotenv()
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
 
+RAG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Rag")
+# Shared with the RAG app; appended so modules of this folder take precedence
+if RAG_DIR not in sys.path:
+    sys.path.append(RAG_DIR)
+from model_providers import get_embedding_model
+from telemetry import start_trace, span, record, in_context, save_trace
+
+INGESTION_METRICS_DB = "ingestion_metrics.db"   # Same span schema as conversations.db; report with Rag/telemetry.py
+
 def debug_log(msg: str):
     print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] 🔍 {msg}")
 
-# === 1. Process PDF files ===
-def process_pdf_files(pdf_folder: str) -> List[Document]:
-    debug_log(f"📂 Processing PDF files in: {pdf_folder}")
-    documents = []
 
-    for file_name in os.listdir(pdf_folder):
-        if file_name.lower().endswith(".pdf"):
-            pdf_path = os.path.join(pdf_folder, file_name)
-            try:
-                pdf_doc = fitz.open(pdf_path)
-                num_pages = len(pdf_doc)
-                debug_log(f"📄 {file_name} has {num_pages} pages")
-
-                for page_num in range(num_pages):
-                    page_text = pdf_doc[page_num].get_text().strip()
-                    if not page_text:
-                        continue
-
-                    page_text += f"\n\nthis is a text chunk - {file_name}"
-
-                    documents.append(
-                        Document(
-                            page_content=page_text,
-                            metadata={
-                                "source": pdf_path,
-                                "file_name": file_name,
-                                "method": "PDF single page chunk",
-                                "chunk_id": page_num,
-                                "pages": str(page_num + 1),
-                            }
-                        )
-                    )
-
-                debug_log(f"📦 Created {num_pages} chunks from PDF: {file_name}")
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
+
+def list_files(folder: str, extension: str) -> List[str]:
+    return sorted(
+        os.path.join(folder, file_name)
+        for file_name in os.listdir(folder)
+        if file_name.lower().endswith(extension)
+    )
+
+# === 1. Process PDF files ===
+PAGES_PER_TASK = 50      # Large PDFs are split into page ranges of this size
+
+
+def make_page_document(pdf_path: str, page_num: int, page_text: str) -> Document:
+    file_name = os.path.basename(pdf_path)
+    return Document(
+        page_content=page_text + f"\n\nthis is a text chunk - {file_name}",
+        metadata={
+            "source": pdf_path,
+            "file_name": file_name,
+            "method": "PDF single page chunk",
+            "chunk_id": page_num,
+            "pages": str(page_num + 1),
+        }
+    )
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int):
+    """Process-pool worker: return ([(page_num, text)] for non-empty pages in [start, end), seconds)."""
+    started = time.perf_counter()
+    pdf_doc = fitz.open(pdf_path)
+    pages = []
+    for page_num in range(start, end):
+        page_text = pdf_doc[page_num].get_text().strip()
+        if page_text:
+            pages.append((page_num, page_text))
+    pdf_doc.close()
+    return pages, time.perf_counter() - started
+
+
+def _page_range_tasks(pdf_paths: Iterable[str], pages_per_task: int,
+                      on_error: Optional[Callable[[str, Exception], None]] = None):
+    for pdf_path in pdf_paths:
+        try:
+            with fitz.open(pdf_path) as pdf_doc:
+                num_pages = len(pdf_doc)
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(pdf_path, e)
+            continue
+        debug_log(f"📄 {os.path.basename(pdf_path)} has {num_pages} pages")
+        for start in range(0, num_pages, pages_per_task):
+            yield pdf_path, start, min(start + pages_per_task, num_pages)
+
+
+def iter_pdf_documents(pdf_paths: Iterable[str], max_workers: Optional[int] = None,
+                       pages_per_task: int = PAGES_PER_TASK,
+                       on_error: Optional[Callable[[str, Exception], None]] = None):
+    """Extract pages in a process pool and yield Documents as they become available.
+
+    Work is split across files and across page ranges of large files; pages
+    are yielded in (file, page) order, one Document per non-empty page.
+    A file that cannot be read raises, or with on_error is reported as
+    on_error(path, error) and yields no further pages.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    tasks = _page_range_tasks(pdf_paths, pages_per_task, on_error)
+    failed = set()
+    in_flight = deque()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # Keep a bounded number of page ranges queued ahead of the consumer
+            while len(in_flight) < max_workers * 2:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                in_flight.append((task, executor.submit(_extract_page_range, *task)))
+
+            if not in_flight:
+                break
+
+            (pdf_path, start, end), future = in_flight.popleft()
+            if pdf_path in failed:
+                continue
+            try:
+                pages, elapsed = future.result()
             except Exception as e:
-                debug_log(f"⚠️ Failed to process PDF {file_name}: {e}")
+                if on_error is None:
+                    raise
+                failed.add(pdf_path)
+                on_error(pdf_path, RuntimeError(f"pages {start + 1}-{end}: {e}"))
+                continue
+            # Timed in the worker process, so this is extraction work rather than waiting
+            record("pdf_extract", elapsed, file=os.path.basename(pdf_path), pages=end - start, chunks=len(pages))
+            for page_num, page_text in pages:
+                yield make_page_document(pdf_path, page_num, page_text)
 
-    return documents
-# === 2. Process CSV files ===
-from transformers import AutoTokenizer
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.schema import Document
 
-tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")
+def process_pdf_files(pdf_folder: str) -> List[Document]:
+    debug_log(f"📂 Processing PDF files in: {pdf_folder}")
+    return list(iter_pdf_documents(list_files(pdf_folder, ".pdf")))
+# === 2. Process CSV files ===
 MAX_TOKENS = 500
+CSV_NOTE = "\n\nthis is a csv"
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    # Loaded on first use so PDF-only runs (and pool workers) never pay for it
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained("bert-base-uncased")
 
 
 def count_tokens(text: str) -> int:
-    return len(tokenizer.encode(text, truncation=False))
+    return len(get_tokenizer().encode(text, truncation=False))
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """Token counts (special tokens included, like count_tokens) from one fast-tokenizer call."""
+    if not texts:
+        return []
+    return [len(ids) for ids in get_tokenizer()(texts, truncation=False)["input_ids"]]
+
+
+@lru_cache(maxsize=1)
+def special_token_count() -> int:
+    return count_tokens("")
 
 
-def split_csv_by_tokens(csv_text: str, max_tokens: int) -> List[str]:
+def pack_rows(row_token_counts: List[int], header_tokens: int, max_tokens: int) -> List[Tuple[int, int]]:
+    """Greedy row packing over prefix sums; returns [start, end) row ranges per chunk.
+
+    Reproduces the row-by-row loop exactly: a chunk takes rows while
+    header + rows fits in max_tokens, the row that overflows always opens the
+    next chunk, and the very first chunk may hold the header alone.
+    """
+    n = len(row_token_counts)
+    if n == 0:
+        return []
+    prefix = list(itertools.accumulate(row_token_counts, initial=0))
+    ranges = []
+    start = 0
+    end = min(n, max(0, bisect_right(prefix, max_tokens - header_tokens) - 1))
+    while end < n:
+        ranges.append((start, end))
+        start = end
+        end = min(n, max(start + 1, bisect_right(prefix, prefix[start] + max_tokens - header_tokens) - 1))
+    ranges.append((start, end))
+    return ranges
+
+
+def split_csv_by_tokens(csv_text: str, max_tokens: int, line_token_counts: Optional[List[int]] = None) -> List[str]:
     lines = csv_text.strip().splitlines()
     header = lines[0]
     rows = lines[1:]
 
-    chunks = []
-    current_chunk = [header]
-    current_token_count = count_tokens(header)
-
-    for row in rows:
-        row_token_count = count_tokens(row)
-        if current_token_count + row_token_count > max_tokens:
-            chunk_text = "\n".join(current_chunk) + "\n\nthis is a csv"
-            chunks.append(chunk_text)
-            current_chunk = [header, row]
-            current_token_count = count_tokens(header) + row_token_count
-        else:
-            current_chunk.append(row)
-            current_token_count += row_token_count
+    # Header and all rows are tokenized in a single batch; the header cost is reused for every chunk
+    if line_token_counts is None:
+        line_token_counts = count_tokens_batch(lines)
+    header_tokens = line_token_counts[0]
 
-    if len(current_chunk) > 1:
-        chunk_text = "\n".join(current_chunk) + "\n\nthis is a csv"
-        chunks.append(chunk_text)
+    return [
+        "\n".join([header] + rows[start:end]) + CSV_NOTE
+        for start, end in pack_rows(line_token_counts[1:], header_tokens, max_tokens)
+    ]
 
-    return chunks
+
+def process_csv_file(csv_path: str) -> List[Document]:
+    csv_file = os.path.basename(csv_path)
+    docs = []
+    with open(csv_path, "r", encoding="utf-8") as f:
+        content = f.read().strip()
+    content_with_note = content + CSV_NOTE
+
+    # Per-line counts from one batched call also give the whole-file count:
+    # BERT splits on whitespace first, so joining lines adds no tokens.
+    line_token_counts = count_tokens_batch(content.splitlines())
+    special = special_token_count()
+    token_count = (sum(count - special for count in line_token_counts)
+                   + count_tokens(CSV_NOTE.strip()))
+    debug_log(f"📏 Token count for {csv_file}: {token_count}")
+
+    if token_count > MAX_TOKENS:
+        debug_log(f"🔪 Splitting CSV: {csv_file} (> {MAX_TOKENS} tokens)")
+        chunks = split_csv_by_tokens(content, MAX_TOKENS, line_token_counts)
+        for i, chunk in enumerate(chunks):
+            docs.append(
+                Document(
+                    page_content=chunk,
+                    metadata={
+                        "source": csv_path,
+                        "file_name": csv_file,
+                        "method": "CSV chunk",
+                        "chunk_id": i
+                    }
+                )
+            )
+    else:
+        docs.append(
+            Document(
+                page_content=content_with_note,
+                metadata={
+                    "source": csv_path,
+                    "file_name": csv_file,
+                    "method": "CSV file",
+                    "chunk_id": 0
+                }
+            )
+        )
+    debug_log(f"📊 Processed CSV: {csv_file}")
+    return docs
 
 
 def process_csv_files(csv_folder: str) -> List[Document]:
@@ -105,145 +271,521 @@ def process_csv_files(csv_folder: str) -> List[Document]:
 
     for csv_file in os.listdir(csv_folder):
         if csv_file.lower().endswith(".csv"):
-            csv_path = os.path.join(csv_folder, csv_file)
-            try:
-                with open(csv_path, "r", encoding="utf-8") as f:
-                    content = f.read().strip()
-                content_with_note = content + "\n\nthis is a csv"
-
-                token_count = count_tokens(content_with_note)
-                debug_log(f"📏 Token count for {csv_file}: {token_count}")
-
-                if token_count > MAX_TOKENS:
-                    debug_log(f"🔪 Splitting CSV: {csv_file} (> {MAX_TOKENS} tokens)")
-                    chunks = split_csv_by_tokens(content, MAX_TOKENS)
-                    for i, chunk in enumerate(chunks):
-                        docs.append(
-                            Document(
-                                page_content=chunk,
-                                metadata={
-                                    "source": csv_path,
-                                    "file_name": csv_file,
-                                    "method": "CSV chunk",
-                                    "chunk_id": i
-                                }
-                            )
-                        )
-                else:
-                    docs.append(
-                        Document(
-                            page_content=content_with_note,
-                            metadata={
-                                "source": csv_path,
-                                "file_name": csv_file,
-                                "method": "CSV file",
-                                "chunk_id": 0
-                            }
-                        )
-                    )
-                debug_log(f"📊 Processed CSV: {csv_file}")
-            except Exception as e:
-                debug_log(f"⚠️ Failed to read CSV {csv_file}: {e}")
+            docs.extend(process_csv_file(os.path.join(csv_folder, csv_file)))
     return docs
 
 
+def iter_csv_documents(csv_paths: Iterable[str], on_error: Optional[Callable[[str, Exception], None]] = None):
+    """Chunk and interpret CSVs one by one; a failing file raises, or is passed to on_error and skipped.
+
+    The interpretation store is read once and written once when the stream ends.
+    """
+    store = load_interpretations()
+    stored_count = len(store)
+    try:
+        for csv_path in csv_paths:
+            with span("csv_chunk", file=os.path.basename(csv_path)) as attrs:
+                try:
+                    docs = process_csv_file(csv_path)
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    on_error(csv_path, e)
+                    continue
+                attrs["chunks"] = len(docs)
+            yield from interpret_csv_documents(docs, store)
+    finally:
+        # Also on failure, so interpretations already paid for are kept
+        if len(store) != stored_count:
+            save_interpretations(store)
+
+
+# === 2b. Interpret CSV chunks once at ingest time ===
+CSV_INTERPRETATIONS_FILE = "csv_interpretations.json"   # Sidecar store keyed by chunk content hash
+
+
+def load_interpretations(store_path: str = CSV_INTERPRETATIONS_FILE) -> Dict[str, str]:
+    if not os.path.exists(store_path):
+        return {}
+    with open(store_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_interpretations(store: Dict[str, str], store_path: str = CSV_INTERPRETATIONS_FILE):
+    # Write-then-rename, so an interrupted run never leaves a truncated store
+    tmp_path = f"{store_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(store, f, ensure_ascii=False)
+    os.replace(tmp_path, store_path)
+
+
+def interpret_csv_documents(docs: List[Document], store: Dict[str, str]) -> List[Document]:
+    """Attach the Mistral sentence rewrite of each CSV chunk as metadata["csv_interpretation"].
+
+    The rewrite depends only on the chunk text, so results are kept in a sidecar
+    JSON store keyed by content hash and reused across ingestion runs; the query
+    path then reads the stored text instead of calling the LLM. New results are
+    added to store in memory; the caller saves it.
+    """
+    # Reuse the exact prompt (and the concurrent, throttle-aware runner) of the RAG app
+    from csv_interpreter import interpret_chunks
+
+    keys = [content_hash(doc.page_content.strip()) for doc in docs]
+    missing = list(dict.fromkeys(key for key in keys if key not in store))
+    reused_count = sum(1 for key in keys if key in store)
+    texts_by_key = {key: doc.page_content.strip() for key, doc in zip(keys, docs)}
+
+    with span("csv_interpret", chunks=len(missing), reused=reused_count):
+        results = interpret_chunks([texts_by_key[key] for key in missing])
+    new_count = 0
+    for key, result in zip(missing, results):
+        if result is not None:
+            store[key] = result
+            new_count += 1
+
+    failed_count = 0
+    for key, doc in zip(keys, docs):
+        if key in store:
+            doc.metadata["csv_interpretation"] = store[key]
+        else:
+            failed_count += 1
+
+    debug_log(f"🧾 Interpreted CSV chunks: {new_count} new, {reused_count} reused, {failed_count} failed")
+    return docs
+
 
 # === 3. Embedding Generator ===
+THROTTLING_CODES = ("ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException")
+
+
+def is_throttling_error(error: Exception) -> bool:
+    response = getattr(error, "response", None)
+    code = response.get("Error", {}).get("Code", "") if isinstance(response, dict) else ""
+    # langchain re-raises Bedrock errors as ValueError, keeping only the message
+    return code in THROTTLING_CODES or any(c in str(error) for c in THROTTLING_CODES)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
 class EmbeddingGenerator:
-    def __init__(self, embedder, batch_size=64, max_workers=4):
+    """Streams documents through Bedrock in order-preserving batches.
+
+    Batches are embedded concurrently but yielded in input order, so vectors
+    always line up with their texts. On throttling the generator backs off,
+    halves its concurrency and batch size, then grows them back after a run
+    of successful calls. Only max_workers batches are in flight or waiting to
+    be yielded at any time, so memory stays bounded for any corpus size.
+    """
+
+    def __init__(self, embedder, batch_size=64, max_workers=4, cache: EmbeddingCache = None,
+                 min_batch_size=4, max_retries=8, backoff_base_s=1.0):
         self.embedder = embedder
         self.batch_size = batch_size
         self.max_workers = max_workers
+        self.cache = cache
+        self.min_batch_size = min_batch_size
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
         self.lock = Lock()
-        self.embeddings = []
+
+        # Adaptive limits, reduced on throttling
+        self.current_batch_size = batch_size
+        self.current_workers = max_workers
+        self.success_streak = 0
+
         self.processed = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.retries = 0
+        self.throttles = 0
+        self.latencies = []
+        self.started_at = None
+
+    def _on_throttle(self):
+        with self.lock:
+            self.throttles += 1
+            self.success_streak = 0
+            self.current_workers = max(1, self.current_workers // 2)
+            self.current_batch_size = max(self.min_batch_size, self.current_batch_size // 2)
 
-    def _process_batch(self, batch):
-        texts = [doc.page_content for doc in batch]
-        batch_embeddings = self.embedder.embed_documents(texts)
+    def _on_success(self, latency_s: float, count: int):
         with self.lock:
-            self.embeddings.extend(batch_embeddings)
-            self.processed += len(batch)
-            debug_log(f"✅ Processed batch ({self.processed} embeddings done)")
+            self.latencies.append(latency_s)
+            self.processed += count
+            self.success_streak += 1
+            if self.success_streak >= 4:
+                # Additive increase once Bedrock has accepted a few calls in a row
+                self.success_streak = 0
+                self.current_workers = min(self.max_workers, self.current_workers + 1)
+                self.current_batch_size = min(self.batch_size, self.current_batch_size * 2)
+
+    def _process_batch(self, texts):
+        # Titan bills ~4 characters per token; the span covers retries and backoff too
+        with span("embed_batch", chunks=len(texts), input_tokens=sum(len(t) for t in texts) // 4) as attrs:
+            for attempt in range(self.max_retries + 1):
+                attrs["retries"] = attempt
+                start = time.perf_counter()
+                try:
+                    batch_embeddings = self.embedder.embed_documents(texts)
+                except Exception as e:
+                    if attempt == self.max_retries or not is_throttling_error(e):
+                        raise
+                    self._on_throttle()
+                    with self.lock:
+                        self.retries += 1
+                    delay = self.backoff_base_s * (2 ** attempt) * (1 + random.random())
+                    debug_log(f"⏳ Bedrock throttled, retrying batch of {len(texts)} in {delay:.1f}s")
+                    time.sleep(delay)
+                    continue
+
+                self._on_success(time.perf_counter() - start, len(texts))
+                if self.cache is not None:
+                    self.cache.put_many(texts, batch_embeddings)
+                return batch_embeddings
+
+    def _next_batch(self, doc_iter):
+        batch = list(itertools.islice(doc_iter, self.current_batch_size))
+        if not batch:
+            return None
+        texts = [doc.page_content for doc in batch]
+        with span("embedding_cache", chunks=len(texts)) as attrs:
+            vectors = self.cache.get_many(texts) if self.cache is not None else [None] * len(texts)
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            attrs["cache_hits"] = len(texts) - len(missing)
+        self.cache_hits += len(texts) - len(missing)
+        self.cache_misses += len(missing)
+        return batch, vectors, missing
+
+    def iter_embeddings(self, documents: Iterable[Document]):
+        """Yield (documents, embeddings) batches in input order."""
+        self.started_at = self.started_at or time.perf_counter()
+        doc_iter = iter(documents)
+        slots = {}          # seq -> (batch, vectors, missing, future or None)
+        next_seq = 0        # next batch to yield
+        submitted = 0       # next batch to create
+        exhausted = False
 
-    def generate_embeddings(self, documents):
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = []
-            for i in range(0, len(documents), self.batch_size):
-                batch = documents[i:i + self.batch_size]
-                futures.append(executor.submit(self._process_batch, batch))
-            for future in futures:
-                future.result()
-        return self.embeddings
-
-# === 4. MAIN ===
+            while True:
+                # Keep the window filled up to the current (adaptive) concurrency
+                while not exhausted and submitted - next_seq < self.current_workers:
+                    prepared = self._next_batch(doc_iter)
+                    if prepared is None:
+                        exhausted = True
+                        break
+                    batch, vectors, missing = prepared
+                    future = None
+                    if missing:
+                        # Only cache misses are sent to Bedrock
+                        future = executor.submit(in_context(self._process_batch), [batch[i].page_content for i in missing])
+                    slots[submitted] = (batch, vectors, missing, future)
+                    submitted += 1
+
+                if next_seq == submitted:
+                    break
+
+                batch, vectors, missing, future = slots[next_seq]
+                if future is not None:
+                    for i, vector in zip(missing, future.result()):
+                        vectors[i] = vector
+                del slots[next_seq]
+                next_seq += 1
+                yield batch, vectors
+
+        debug_log(f"✅ Embedded {self.processed} chunks ({self.cache_hits} from cache) — {self.metrics_summary()}")
+
+    def generate_embeddings(self, documents):
+        embeddings = []
+        for _, vectors in self.iter_embeddings(documents):
+            embeddings.extend(vectors)
+        return embeddings
+
+    def metrics(self) -> Dict[str, float]:
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            "docs": self.cache_hits + self.cache_misses,
+            "docs_per_s": (self.cache_hits + self.cache_misses) / elapsed if elapsed else 0.0,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "retries": self.retries,
+            "throttles": self.throttles,
+            "p50_batch_s": percentile(self.latencies, 50),
+            "p99_batch_s": percentile(self.latencies, 99),
+        }
+
+    def metrics_summary(self) -> str:
+        m = self.metrics()
+        return (f"{m['docs_per_s']:.1f} docs/s, {m['retries']} retries, "
+                f"batch latency p50 {m['p50_batch_s']:.2f}s / p99 {m['p99_batch_s']:.2f}s")
+
+# === 4. Incremental FAISS index ===
+MANIFEST_FILE = "manifest.json"
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_index_atomically(vectorstore, index_dir: str, manifest: dict,
+                          write_extra: Optional[Callable[[str], None]] = None):
+    """Write the index next to the live one, then swap directories.
+
+    Readers either see the previous complete index or the new one; the RAG app
+    keeps serving its loaded copy during the brief moment the directory is renamed.
+    write_extra(tmp_dir) can add sidecar files before the swap.
+    """
+    tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+    old_dir = f"{index_dir}.old-{os.getpid()}"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+
+    vectorstore.save_local(tmp_dir)
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    if write_extra is not None:
+        write_extra(tmp_dir)
+
+    if os.path.exists(index_dir):
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+class IncrementalIndexer:
+    """Keeps a FAISS index in sync with a set of source files.
+
+    A manifest stored inside the index records, per source file, its size,
+    mtime, content hash and the IDs of the chunks it produced. Only new or
+    changed files are chunked and embedded; vectors of changed or deleted
+    files are removed by ID. A file enters the manifest only once it has been
+    chunked without errors into at least one chunk, so failed files are
+    retried on the next sync.
+    """
+
+    def __init__(self, index_dir: str, embedder, generator: "EmbeddingGenerator",
+                 iter_docs: Callable[..., Iterable[Document]],
+                 full_rebuild: bool = False):
+        self.index_dir = index_dir
+        self.embedder = embedder
+        self.generator = generator
+        # iter_docs(paths, on_error=...) turns the changed source paths into chunks whose
+        # metadata["source"] is the path, reporting files it could not read to on_error
+        self.iter_docs = iter_docs
+        self.full_rebuild = full_rebuild
+        self.full_rebuild_partitions = full_rebuild
+        self.config_changed = False
+
+    def _load(self):
+        manifest_path = os.path.join(self.index_dir, MANIFEST_FILE)
+        if self.full_rebuild or not os.path.exists(manifest_path):
+            return None, {"files": {}}
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        vectorstore = FAISS.load_local(self.index_dir, self.embedder, allow_dangerous_deserialization=True)
+        stored_config = read_index_config(self.index_dir)
+        # Search-time parameters only need the config re-saved; the index itself is kept
+        self.config_changed = stored_config != INDEX_CONFIG
+        if build_params(stored_config) != build_params(INDEX_CONFIG):
+            # Index type or build parameters changed in config: re-index the stored vectors
+            debug_log(f"🔁 Rebuilding {self.index_dir} as a '{INDEX_CONFIG['type']}' index")
+            vectorstore = rebuild_vectorstore(vectorstore, self.embedder)
+            self.full_rebuild_partitions = True
+        return vectorstore, manifest
+
+    def _add_batch(self, vectorstore, batch, embeddings, ids):
+        text_embeddings = list(zip([doc.page_content for doc in batch], embeddings))
+        vectorstore.add_embeddings(text_embeddings=text_embeddings, metadatas=[doc.metadata for doc in batch], ids=ids)
+
+    def _changed_paths(self, paths, old_files, new_files, pending_files, ids_to_delete, changed, summary):
+        """Yield new or changed files; their manifest entries wait in pending_files until chunked."""
+        for path in paths:
+            stat = os.stat(path)
+            entry = old_files.get(path)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                new_files[path] = entry
+                summary["unchanged"] += 1
+                continue
+
+            sha = file_hash(path)
+            if entry and entry["sha256"] == sha:
+                new_files[path] = {**entry, "size": stat.st_size, "mtime": stat.st_mtime}
+                summary["unchanged"] += 1
+                continue
+
+            if entry:
+                ids_to_delete.extend(entry["chunk_ids"])
+                summary["changed"] += 1
+            else:
+                summary["added"] += 1
+
+            pending_files[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha, "chunk_ids": []}
+            changed.append(path)
+            yield path
+
+    def _assign_ids(self, docs, pending_files, pending_ids):
+        for doc in docs:
+            entry = pending_files[doc.metadata["source"]]
+            # Content-derived IDs never collide with the vectors they replace
+            chunk_id = f"{os.path.basename(doc.metadata['source'])}:{entry['sha256'][:12]}:{len(entry['chunk_ids'])}"
+            entry["chunk_ids"].append(chunk_id)
+            pending_ids.append(chunk_id)
+            yield doc
+
+    def sync(self, paths: Iterable[str]) -> Dict[str, int]:
+        vectorstore, manifest = self._load()
+        old_files = manifest["files"]
+        new_files = {}
+        pending_files = {}
+        failed = set()
+        ids_to_delete = []
+        changed = []
+        pending_ids = deque()
+        summary = {"unchanged": 0, "added": 0, "changed": 0, "deleted": 0, "failed": 0}
+
+        def on_error(path: str, error: Exception):
+            debug_log(f"⚠️ Failed to process {os.path.basename(path)}, will retry on the next sync: {error}")
+            failed.add(path)
+
+        # Chunks stream from extraction through embedding into the index batch by batch
+        changed_paths = self._changed_paths(paths, old_files, new_files, pending_files, ids_to_delete, changed, summary)
+        docs = self._assign_ids(self.iter_docs(changed_paths, on_error=on_error), pending_files, pending_ids)
+        untrained = []     # IVF indexes buffer vectors until they have enough to train on
+        for batch, embeddings in self.generator.iter_embeddings(docs):
+            ids = [pending_ids.popleft() for _ in batch]
+            if vectorstore is None:
+                vectorstore = empty_vectorstore(self.embedder, len(embeddings[0]))
+            if vectorstore.index.is_trained:
+                self._add_batch(vectorstore, batch, embeddings, ids)
+                continue
+
+            untrained.append((batch, embeddings, ids))
+            if sum(len(b) for b, _, _ in untrained) >= training_size():
+                train_vectorstore(vectorstore, [v for _, vectors, _ in untrained for v in vectors])
+                for buffered in untrained:
+                    self._add_batch(vectorstore, *buffered)
+                untrained = []
+
+        if untrained:
+            # Corpus smaller than the training target: train on everything there is
+            train_vectorstore(vectorstore, [v for _, vectors, _ in untrained for v in vectors])
+            for buffered in untrained:
+                self._add_batch(vectorstore, *buffered)
+
+        for path, entry in pending_files.items():
+            if entry["chunk_ids"] and path not in failed:
+                new_files[path] = entry
+                continue
+            # Left out of the manifest so the next sync retries it; drop any chunks it did produce
+            if path not in failed:
+                debug_log(f"⚠️ {os.path.basename(path)} produced no chunks, will retry on the next sync")
+            ids_to_delete.extend(entry["chunk_ids"])
+            summary["failed"] += 1
+
+        for path, entry in old_files.items():
+            if path not in new_files and path not in pending_files:
+                ids_to_delete.extend(entry["chunk_ids"])
+                changed.append(path)
+                summary["deleted"] += 1
+
+        debug_log(f"🧮 {self.index_dir}: {summary['added']} new, {summary['changed']} changed, "
+                  f"{summary['deleted']} deleted, {summary['unchanged']} unchanged, {summary['failed']} failed files")
+
+        sidecars_built = all(
+            os.path.exists(os.path.join(self.index_dir, file_name)) for file_name in (PARTITIONS_FILE, DOCSTORE_FILE)
+        ) and partitions_current(new_files, self.index_dir)  # e.g. a table's source PDF was recorded since
+        if (not changed and sidecars_built and not self.full_rebuild_partitions and not self.config_changed
+                and vectorstore is not None):
+            debug_log(f"✅ {self.index_dir} is up to date")
+            return summary
+
+        if vectorstore is None:
+            debug_log(f"⚠️ Nothing to index for {self.index_dir}")
+            return summary
+
+        if ids_to_delete:
+            if INDEX_CONFIG["type"] == "flat":
+                vectorstore.delete(ids_to_delete)
+            else:
+                # IVF/HNSW cannot remove vectors in place; rebuild from the stored vectors
+                vectorstore = rebuild_vectorstore(vectorstore, self.embedder, exclude_ids=ids_to_delete)
+
+        if ivf_outgrown(vectorstore.index):
+            # Trained on a smaller corpus: retrain with as many lists as the vectors now support
+            debug_log(f"🔁 Retraining {self.index_dir} with more IVF lists ({vectorstore.index.ntotal} vectors)")
+            vectorstore = rebuild_vectorstore(vectorstore, self.embedder)
+
+        if self.full_rebuild_partitions or not sidecars_built:
+            # Every partition has to be (re)built from the main index
+            changed = list(new_files)
+
+        def write_sidecars(out_dir: str):
+            write_index_config(out_dir)
+            # Per-product sub-indexes let the retriever search only the products a query names
+            partition_ids = write_partitions(vectorstore, new_files, out_dir, self.index_dir, changed)
+            # The app reads chunks from SQLite by ID instead of unpickling index.pkl
+            write_sqlite_docstore(out_dir, vectorstore, partition_ids)
+
+        with span("index_save", index=self.index_dir, vectors=vectorstore.index.ntotal):
+            save_index_atomically(vectorstore, self.index_dir, {"files": new_files}, write_extra=write_sidecars)
+        debug_log(f"✅ FAISS index saved at '{self.index_dir}' ({vectorstore.index.ntotal} vectors)")
+        return summary
+
+
+# === 5. MAIN ===
 def main():
+    parser = argparse.ArgumentParser(description="Build or update the FAISS vectorstores")
+    parser.add_argument("--full", action="store_true", help="Rebuild both indexes from scratch")
+    parser.add_argument("--workers", type=int, default=4, help="Maximum concurrent Bedrock embedding calls")
+    args = parser.parse_args()
+
     pdf_folder = "Data"             # 📂 Folder containing PDF files
     csv_folder = "csv_files"             # 📂 Folder containing CSV files
     faiss_dir_text = "faiss_db_text"     # 📦 Vector DB for PDFs
     faiss_dir_csv = "faiss_db_csv"       # 📦 Vector DB for CSVs
 
-    embedder = BedrockEmbeddings(
-    model_id="amazon.titan-embed-text-v2:0",  # Titan model
-    region_name="eu-west-1",                  # Update region if needed
-)
+    trace = start_trace(kind="ingestion")
+    embedder = get_embedding_model()   # Titan on Bedrock, or the offline fake with MODEL_PROVIDER=fake
+    embedding_cache = EmbeddingCache(model_id=embedder.model_id)
 
     # === PDF Processing ===
-    pdf_docs = []
     if os.path.exists(pdf_folder):
-        pdf_docs = process_pdf_files(pdf_folder)
+        pdf_indexer = IncrementalIndexer(
+            faiss_dir_text, embedder, EmbeddingGenerator(embedder, max_workers=args.workers, cache=embedding_cache),
+            iter_docs=iter_pdf_documents, full_rebuild=args.full,
+        )
+        with span("index_sync", index=faiss_dir_text) as attrs:
+            attrs.update(pdf_indexer.sync(list_files(pdf_folder, ".pdf")))
     else:
         debug_log(f"⚠️ PDF folder not found: {pdf_folder}")
 
-    debug_log(f"📘 Total PDF chunks to embed: {len(pdf_docs)}")
-    if pdf_docs:
-        pdf_generator = EmbeddingGenerator(embedder)
-        pdf_embeddings = pdf_generator.generate_embeddings(pdf_docs)
-
-        debug_log("💾 Saving PDF FAISS index...")
-        texts = [doc.page_content for doc in pdf_docs]
-        metadatas = [doc.metadata for doc in pdf_docs]
-        vectorstore = FAISS.from_embeddings(
-            text_embeddings=list(zip(texts, pdf_embeddings)),
-            embedding=embedder,
-            metadatas=metadatas
-        )
-        if os.path.exists(faiss_dir_text):
-            shutil.rmtree(faiss_dir_text)
-        vectorstore.save_local(faiss_dir_text)
-        debug_log(f"✅ FAISS index for PDFs saved at '{faiss_dir_text}'")
-
     # === CSV Processing ===
-    csv_docs = []
     if os.path.exists(csv_folder):
-        csv_docs = process_csv_files(csv_folder)
+        csv_indexer = IncrementalIndexer(
+            faiss_dir_csv, embedder, EmbeddingGenerator(embedder, max_workers=args.workers, cache=embedding_cache),
+            iter_docs=iter_csv_documents, full_rebuild=args.full,
+        )
+        with span("index_sync", index=faiss_dir_csv) as attrs:
+            attrs.update(csv_indexer.sync(list_files(csv_folder, ".csv")))
+        # Exact-value store for the RAG app's SQL lookup path (pk_tables.sqlite)
+        with span("pk_tables") as attrs:
+            attrs.update(write_pk_tables(list_files(csv_folder, ".csv")))
     else:
         debug_log(f"⚠️ CSV folder not found: {csv_folder}")
 
-        debug_log(f"📈 Total CSV documents to embed: {len(csv_docs)}")
-    if csv_docs:
-        csv_generator = EmbeddingGenerator(embedder)
-        csv_embeddings = csv_generator.generate_embeddings(csv_docs)
-
-        debug_log("💾 Saving CSV FAISS index...")
-        texts = [doc.page_content for doc in csv_docs]
-        metadatas = [doc.metadata for doc in csv_docs]
-        vectorstore = FAISS.from_embeddings(
-            text_embeddings=list(zip(texts, csv_embeddings)),
-            embedding=embedder,
-            metadatas=metadatas
-        )
-        if os.path.exists(faiss_dir_csv):
-            shutil.rmtree(faiss_dir_csv)
-        vectorstore.save_local(faiss_dir_csv)
-        debug_log(f"✅ FAISS index for CSVs saved at '{faiss_dir_csv}'")
-
-        # === Final Check ===
-    #if not pdf_docs and not csv_docs:
-        debug_log("❌ No data processed. Nothing saved.")
+    embedding_cache.close()
+    save_trace(trace, INGESTION_METRICS_DB)
+    stage_ms = ", ".join(f"{stage} {ms / 1000:.1f}s" for stage, ms in trace.summary().items())
+    debug_log(f"⏱️ Ingestion stage totals: {stage_ms} (report: python Rag/telemetry.py --db {INGESTION_METRICS_DB})")
 
 
 if __name__ == "__main__":
-    main()
-
-
+    main()
\ No newline at end of file
@@ -0,0 +1,313 @@
+"""Refresh the whole corpus in one pipelined run.
+
+    Data/*.pdf ─┬─ render ── extract ── convert ── csv_index    (faiss_db_csv)
+                └─────────────────────────────── text_index   (faiss_db_text)
+
+Every stage runs in its own thread and hands its outputs to the next one
+through a bounded queue: a batch PDF goes to table extraction as soon as it is
+rendered, its tables are converted as soon as they are extracted, and each
+CSV is chunked and embedded as soon as it is written. The text index builds
+alongside. A refresh therefore takes about as long as its slowest stage
+instead of the sum of all of them.
+
+Unchanged inputs are skipped at every stage: rendering when the source PDFs
+and render settings match the previous run, extraction through its
+content-hash cache, conversion through the content-derived CSV names, and
+chunking/embedding through the indexes' manifests and the embedding cache.
+
+Usage (from the folder holding Data/, like the individual scripts):
+    python run_pipeline.py
+    MODEL_PROVIDER=fake python run_pipeline.py --stub      # offline, no Adobe or Bedrock calls
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Image_extraction first: its main.py is the extraction client (the RAG app's main.py is appended by test.py)
+for folder in ("Storing_in_vectorstore", "Image_extraction"):
+    sys.path.insert(0, os.path.join(ROOT_DIR, folder))
+
+from data_prepration import MIN_IMAGE_AREA_FRACTION, BATCH_PAGES_FILE, iter_image_pages, create_image_pdfs
+from main import MAX_IN_FLIGHT, REQUESTS_PER_MINUTE, AdobeExtractionService, ExtractionRun
+from xlsx_to_csv import (
+    find_workbooks, file_sha256, csv_name_for, clean_and_convert_excel, finish_conversion, load_table_origins,
+)
+from test import (
+    INGESTION_METRICS_DB, debug_log, list_files, iter_pdf_documents, iter_csv_documents,
+    EmbeddingGenerator, IncrementalIndexer,
+)
+from embedding_cache import EmbeddingCache
+from pk_tables import write_pk_tables
+from model_providers import get_embedding_model
+from telemetry import start_trace, record, in_context, save_trace
+
+PIPELINE_STATE_FILE = "pipeline_state.json"   # Render inputs of the last successful run
+QUEUE_SIZE = 8                                # Items waiting between two stages
+DONE = object()                               # End-of-stream marker
+
+
+def iter_queue(items: queue.Queue):
+    while True:
+        item = items.get()
+        if item is DONE:
+            return
+        yield item
+
+
+class Stage(threading.Thread):
+    """Runs target(stage) in its own thread; target reads stage.input and calls stage.emit()."""
+
+    def __init__(self, name: str, unit: str, target, input: queue.Queue = None, output: queue.Queue = None):
+        super().__init__(name=name, daemon=True)
+        self.unit = unit
+        self.target = in_context(target)   # Spans recorded by the stage land in the run's trace
+        self.input = input
+        self.output = output
+        self.lock = threading.Lock()
+        self.items = 0
+        self.skipped = 0
+        self.started_at = self.finished_at = None
+        self.error = None
+        self.input_done = False
+
+    def iter_input(self):
+        """Items from the previous stage until its end-of-stream marker."""
+        yield from iter_queue(self.input)
+        self.input_done = True
+
+    def emit(self, item, skipped: bool = False):
+        with self.lock:
+            self.items += 1
+            self.skipped += skipped
+        if self.output is not None:
+            self.output.put(item)
+
+    def run(self):
+        self.started_at = time.perf_counter()
+        try:
+            self.target(self)
+        except Exception as e:
+            self.error = e
+            debug_log(f"❌ {self.name} stage failed: {e}")
+            if self.input is not None and not self.input_done:
+                # Keep upstream stages from blocking on a full queue
+                for _ in iter_queue(self.input):
+                    pass
+        finally:
+            self.finished_at = time.perf_counter()
+            if self.output is not None:
+                self.output.put(DONE)
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished_at or time.perf_counter()) - (self.started_at or time.perf_counter())
+
+
+def render_fingerprint(args) -> dict:
+    pdfs = {os.path.basename(path): [os.path.getsize(path), os.path.getmtime(path)]
+            for path in list_files(args.data, ".pdf")}
+    return {"pdfs": pdfs, "min_image_area": args.min_image_area,
+            "pages_per_pdf": args.pages_per_pdf}
+
+
+def load_state() -> dict:
+    if os.path.exists(PIPELINE_STATE_FILE):
+        with open(PIPELINE_STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def render_stage(args, state: dict):
+    def run(stage: Stage):
+        fingerprint = render_fingerprint(args)
+        batch_pages_path = os.path.join(args.image_pdfs, BATCH_PAGES_FILE)
+        if state.get("render") == fingerprint and os.path.exists(batch_pages_path):
+            debug_log("✅ Source PDFs unchanged, reusing the rendered batch PDFs")
+            with open(batch_pages_path, "r", encoding="utf-8") as f:
+                for name in json.load(f):
+                    stage.emit(os.path.join(args.image_pdfs, name), skipped=True)
+            return
+
+        pages = iter_image_pages(args.data, min_area=args.min_image_area, max_workers=args.workers)
+        create_image_pdfs(pages, args.image_pdfs, images_per_pdf=args.pages_per_pdf, on_batch=stage.emit)
+        state["render"] = fingerprint
+    return run
+
+
+def extract_stage(args, service):
+    def run(stage: Stage):
+        extraction = ExtractionRun(service, args.max_in_flight, args.rpm)
+        slots = threading.Semaphore(extraction.max_in_flight)
+
+        def on_done(pdf_path, future):
+            slots.release()
+            cached = future.exception() is None and future.result()["cached"]
+            entry_dir = extraction.complete(pdf_path, future)
+            if entry_dir is not None:
+                stage.emit(entry_dir, skipped=cached)
+
+        with ThreadPoolExecutor(max_workers=extraction.max_in_flight) as executor:
+            for pdf_path in stage.iter_input():
+                slots.acquire()
+                future = executor.submit(extraction.extract_one, pdf_path)
+                future.add_done_callback(lambda f, pdf_path=pdf_path: on_done(pdf_path, f))
+        if extraction.finish():
+            raise RuntimeError(f"{extraction.failed} batch PDF(s) could not be extracted")
+    return run
+
+
+def convert_stage(args, upstream):
+    def run(stage: Stage):
+        os.makedirs(args.csv, exist_ok=True)
+        sources, lock = {}, threading.Lock()
+        slots = threading.Semaphore((args.workers or os.cpu_count() or 1) * 2)
+
+        def on_done(name, future):
+            slots.release()
+            try:
+                print(f"✅ Saved: {future.result()}")
+                stage.emit(future.result())
+            except Exception as e:
+                print(f"❌ Could not convert {sources[name]}: {e}")
+                with lock:
+                    del sources[name]
+
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for entry_dir in stage.iter_input():
+                for path in find_workbooks([entry_dir]):
+                    name = csv_name_for(file_sha256(path))
+                    with lock:
+                        if name in sources:
+                            continue  # Identical table extracted twice
+                        sources[name] = path
+                    csv_path = os.path.join(args.csv, name)
+                    if os.path.exists(csv_path):
+                        stage.emit(csv_path, skipped=True)
+                        continue
+                    slots.acquire()
+                    future = executor.submit(clean_and_convert_excel, path, csv_path)
+                    future.add_done_callback(lambda f, name=name: on_done(name, f))
+        # A failed render or extraction leaves workbooks missing, not gone: keep their CSVs indexed
+        failed = [s.name for s in upstream if s.error]
+        if failed:
+            kept = [name for name in sorted(os.listdir(args.csv))
+                    if name.startswith("table_") and name.endswith(".csv") and name not in sources]
+            debug_log(f"⚠️ {', '.join(failed)} failed, keeping {len(kept)} CSVs of earlier runs")
+            for name in kept:
+                stage.emit(os.path.join(args.csv, name), skipped=True)
+        # The manifest and batch_pages.json are complete once extraction has finished
+        origins = load_table_origins(batch_pages_path=os.path.join(args.image_pdfs, BATCH_PAGES_FILE))
+        finish_conversion(sources, args.csv, prune=not failed, origins=origins)
+    return run
+
+
+def index_stage(args, index_dir: str, iter_docs, embedder, embedding_cache, paths, after_sync=None):
+    def run(stage: Stage):
+        generator = EmbeddingGenerator(embedder, max_workers=args.embed_workers, cache=embedding_cache)
+        indexer = IncrementalIndexer(index_dir, embedder, generator, iter_docs=iter_docs, full_rebuild=args.full)
+        summary = indexer.sync(paths(stage))
+        stage.items = generator.processed + generator.cache_hits
+        stage.skipped = generator.cache_hits
+        debug_log(f"📦 {index_dir}: {summary}")
+        if after_sync is not None:
+            after_sync()
+    return run
+
+
+def print_summary(stages, wall_s: float):
+    print(f"\n📊 Pipeline finished in {wall_s:.1f}s wall time "
+          f"({sum(stage.seconds for stage in stages):.1f}s of stage time overlapped)")
+    print(f"{'stage':<12}{'items':>8}{'skipped':>9}  {'unit':<12}{'seconds':>9}{'per s':>9}  status")
+    for stage in stages:
+        fresh = stage.items - stage.skipped
+        rate = f"{fresh / stage.seconds:.1f}" if fresh and stage.seconds else "-"
+        status = f"failed: {stage.error}" if stage.error else "ok"
+        print(f"{stage.name:<12}{stage.items:>8}{stage.skipped:>9}  {stage.unit:<12}{stage.seconds:>9.1f}{rate:>9}  {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="Data", help="Folder containing the source PDFs")
+    parser.add_argument("--image-pdfs", default="image_pdfs", help="Folder for the rendered batch PDFs")
+    parser.add_argument("--csv", default="csv_files", help="Folder for the converted table CSVs")
+    parser.add_argument("--text-index", default="faiss_db_text")
+    parser.add_argument("--csv-index", default="faiss_db_csv")
+    parser.add_argument("--pages-per-pdf", type=int, default=25, help="Adobe API page limit per request")
+    parser.add_argument("--min-image-area", type=float, default=MIN_IMAGE_AREA_FRACTION)
+    parser.add_argument("--workers", type=int, default=None, help="Render/convert processes (default: CPU count)")
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT, help="Concurrent extraction jobs")
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="Maximum extraction jobs per minute")
+    parser.add_argument("--embed-workers", type=int, default=4, help="Maximum concurrent embedding calls per index")
+    parser.add_argument("--full", action="store_true", help="Rebuild both indexes from scratch")
+    parser.add_argument("--stub", action="store_true", help="Use the local extraction stand-in instead of Adobe")
+    parser.add_argument("--stub-latency", type=float, default=0.5, help="Seconds per stubbed extraction job")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data):
+        parser.error(f"PDF folder not found: {args.data}")
+
+    if args.stub:
+        from extraction_stub import LocalExtractionStub
+        service = LocalExtractionStub(latency_s=args.stub_latency)
+    else:
+        service = AdobeExtractionService(
+            client_id=os.getenv("PDF_SERVICES_CLIENT_ID", "client_id"),
+            client_secret=os.getenv("PDF_SERVICES_CLIENT_SECRET", "client_secret"),
+        )
+
+    trace = start_trace(kind="ingestion")
+    state = load_state()
+    embedder = get_embedding_model()
+    embedding_cache = EmbeddingCache(model_id=embedder.model_id)
+    batches, results, csvs = (queue.Queue(QUEUE_SIZE) for _ in range(3))
+
+    def csv_paths(stage: Stage):
+        # CSVs placed in the folder by hand stay indexed next to the converted tables
+        yield from (path for path in list_files(args.csv, ".csv") if not os.path.basename(path).startswith("table_"))
+        yield from stage.iter_input()
+
+    os.makedirs(args.csv, exist_ok=True)
+    render = Stage("render", "batch PDFs", render_stage(args, state), output=batches)
+    extract = Stage("extract", "batch PDFs", extract_stage(args, service), input=batches, output=results)
+    stages = [
+        render,
+        extract,
+        # Upstream errors are final by the time convert reads their end-of-stream marker
+        Stage("convert", "CSVs", convert_stage(args, [render, extract]), input=results, output=csvs),
+        # The exact-value store for the RAG app's SQL lookup path is loaded from the same CSVs
+        Stage("csv_index", "chunks", index_stage(args, args.csv_index, iter_csv_documents, embedder, embedding_cache,
+                                                 csv_paths, lambda: write_pk_tables(list_files(args.csv, ".csv"))),
+              input=csvs),
+        Stage("text_index", "chunks", index_stage(args, args.text_index, iter_pdf_documents, embedder,
+                                                  embedding_cache, lambda stage: list_files(args.data, ".pdf"))),
+    ]
+
+    started = time.perf_counter()
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
+    wall_s = time.perf_counter() - started
+
+    embedding_cache.close()
+    for stage in stages:
+        record(f"pipeline.{stage.name}", stage.seconds, items=stage.items, skipped=stage.skipped)
+    save_trace(trace, INGESTION_METRICS_DB)
+
+    failed = [stage.name for stage in stages if stage.error]
+    if not failed:
+        # Only a complete run may let the next one skip rendering
+        with open(PIPELINE_STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+    print_summary(stages, wall_s)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()